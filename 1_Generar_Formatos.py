@@ -572,8 +572,12 @@ def pad_mpio(v):
 
 def buscar_info_terceros(nits_list, progress_bar=None, log_fn=None):
     import requests
+    import sys
     from time import sleep
-    import re
+    # Patrones precompilados y HTML→texto con parser en C, compartidos con dian-proxy/fallback.py
+    _proxy_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dian-proxy')
+    if _proxy_dir not in sys.path: sys.path.append(_proxy_dir)
+    import parsers
 
     def log(msg):
         if log_fn: log_fn(msg)
@@ -637,12 +641,11 @@ def buscar_info_terceros(nits_list, progress_bar=None, log_fn=None):
             if resp.status_code == 200:
                 info = {'razon_social': '', 'dv': '', 'dir': '', 'dp': '', 'mp': '', 'pais': '169'}
                 texto = resp.text
-                rs_match = re.findall(r'<h1[^>]*class="[^"]*nombre[^"]*"[^>]*>([^<]+)</h1>', texto, re.IGNORECASE)
-                if not rs_match: rs_match = re.findall(r'<title>([^<]+?)[\s\-|]', texto)
+                rs_match = parsers.RE_H1_NOMBRE.findall(texto) or parsers.RE_TITLE.findall(texto)
                 if rs_match:
                     rs = rs_match[0].strip()
                     if len(rs) > 3 and str(nit) not in rs.lower(): info['razon_social'] = rs.upper()
-                dir_match = re.findall(r'(?:Direcci[oó]n|Domicilio)[:\s]*</[^>]+>\s*<[^>]+>([^<]+)', texto, re.IGNORECASE)
+                dir_match = parsers.RE_DIR_ETIQUETA.findall(texto)
                 if dir_match: info['dir'] = dir_match[0].strip()
                 if info.get('razon_social') or info.get('dir'): return info, None
             return None, f"HTTP {resp.status_code}"
@@ -677,28 +680,18 @@ def buscar_info_terceros(nits_list, progress_bar=None, log_fn=None):
     def extraer_info_web(nit, html):
         info = {'razon_social': '', 'dv': '', 'dir': '', 'dp': '', 'mp': '', 'pais': '169'}
         nit_str = str(nit)
-        texto = re.sub(r'<[^>]+>', ' ', html)
-        texto = re.sub(r'\s+', ' ', texto)
-        patrones_rs = [
-            r'(?:NIT|Nit|nit)[\s.:]*' + re.escape(nit_str) + r'[\s\-–—:,.]+([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ\s&.,]+)',
-            r'([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ\s&.,]{5,50}?)[\s\-–—:,.]+(?:NIT|Nit|nit)[\s.:]*' + re.escape(nit_str),
-            r'([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ\s&.,]{5,50}?)\s*[-–—]\s*NIT[\s.:]*' + re.escape(nit_str),
-        ]
-        for patron in patrones_rs:
-            matches = re.findall(patron, texto)
-            if matches:
-                rs = matches[0].strip().rstrip('.,;:-– ')
+        texto = parsers.html_a_texto(html)
+        for patron in parsers.patrones_razon_social_mayusculas(nit_str):
+            rs = parsers.primera_cerca_del_nit(patron, texto, nit_str)
+            if rs:
+                rs = rs.strip().rstrip('.,;:-– ')
                 if 3 < len(rs) < 120:
                     info['razon_social'] = rs.upper()
                     break
-        patrones_dir = [
-            r'(?:Direcci[oó]n|Dir\.?|Ubicaci[oó]n)[:\s]+([A-Za-z]{2,3}[\s.]*(?:No\.?\s*)?\d+[\w\s#\-.,No°]+?\d)',
-            r'((?:CL|CR|KR|TV|DG|CALLE|CARRERA|AV|AVENIDA|TRANSVERSAL|DIAGONAL)[\s.]*(?:No\.?\s*)?\d+[\w\s#\-.,No°]*\d)',
-        ]
-        for patron in patrones_dir:
-            matches = re.findall(patron, texto, re.IGNORECASE)
-            if matches:
-                dir_candidata = matches[0].strip()[:100]
+        for patron in parsers.RE_DIRECCIONES:
+            m = patron.search(texto)
+            if m:
+                dir_candidata = m.group(1).strip()[:100]
                 if len(dir_candidata) > 5:
                     info['dir'] = dir_candidata
                     break
@@ -1,76 +1,501 @@
 """
-Caché in-memory con TTL para resultados de consulta NIT.
-Persiste a disco como JSON para sobrevivir reinicios.
+Caché con TTL para resultados de consulta NIT, en dos niveles:
+  - Caliente (L1): LRU en memoria con tamaño máximo (CACHE_MAX_HOT entradas).
+  - Frío (L2), según CACHE_BACKEND:
+      "sqlite" (defecto): SQLite embebido (una fila por NIT) que sobrevive
+        reinicios. Cada escritura es un upsert de esa sola fila y la
+        expiración usa un índice por expires_at.
+      "redis": servidor Redis compartido (REDIS_URL) para que todas las
+        instancias de Cloud Run vean lo que consultó cualquiera de ellas.
+        Redis expira las llaves solo; si no responde, cuenta como miss.
+        Es red: desde código async se usan aget/aget_many/aset..., que
+        corren el nivel frío en un hilo (asyncio.to_thread) para no frenar
+        el event loop, y las lecturas masivas van en un solo MGET.
+Con CACHE_STALE_DAYS > 0 (stale-while-revalidate) una entrada vencida se
+sigue guardando ese tiempo extra: get(allow_stale=True) la entrega marcada
+como "stale" con su edad mientras el llamador la refresca en segundo plano.
+Pasado ese límite duro ya no se sirve.
+Los NIT que no aparecen en ninguna fuente se guardan como entradas
+negativas con un TTL corto y propio (CACHE_NEGATIVE_HOURS), nunca stale.
+Un barrido periódico en segundo plano elimina lo expirado de ambos niveles.
+Las estadísticas son contadores O(1), sin recorrer entradas.
 """
+import asyncio
 import json
+import logging
 import os
+import sqlite3
+import threading
 import time
+from collections import OrderedDict
 from pathlib import Path
 
-CACHE_FILE = Path(__file__).parent / "cache_data.json"
+try:
+    import redis
+except ImportError:  # Solo se necesita con CACHE_BACKEND=redis
+    redis = None
+
+logger = logging.getLogger("exogenadian.cache")
+
+CACHE_FILE = Path(__file__).parent / "cache_data.db"
 DEFAULT_TTL = 30 * 24 * 3600  # 30 días en segundos
+CACHE_MAX_HOT = int(os.getenv("CACHE_MAX_HOT", "20000"))
+CACHE_SWEEP_SECONDS = int(os.getenv("CACHE_SWEEP_SECONDS", "600"))
+CACHE_STALE_DAYS = int(os.getenv("CACHE_STALE_DAYS", "30"))
+CACHE_NEGATIVE_HOURS = int(os.getenv("CACHE_NEGATIVE_HOURS", "12"))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_PREFIX = os.getenv("REDIS_PREFIX", "nit:")
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", "0.3"))  # segundos
+REDIS_RETRY_SECONDS = 30  # Tras un error, no reintentar Redis durante este tiempo
+REDIS_LOTE = 500  # Llaves por MGET / pipeline
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS nit_cache (
+    nit        TEXT PRIMARY KEY,
+    data       TEXT NOT NULL,
+    cached_at  REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_nit_cache_expires ON nit_cache (expires_at);
+"""
+
+
+class SQLiteStore:
+    """Nivel frío: SQLite (WAL, autocommit). Si el disco falla, queda solo en memoria."""
+
+    bloqueante = False  # Local y sub-milisegundo: se llama directo desde el event loop
+
+    def __init__(self, path: Path | str = CACHE_FILE):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._count: int | None = None  # Se calcula la primera vez que se pide
+        try:
+            self._db = self._connect(self.path)
+        except sqlite3.Error:
+            # En Cloud Run el disco es efímero, no es crítico
+            self.path = ":memory:"
+            self._db = self._connect(self.path)
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        return db
+
+    def get(self, nit: str) -> tuple[dict, float] | None:
+        """Retorna (entrada, expires_at) o None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT data, expires_at FROM nit_cache WHERE nit = ?", (nit,)
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def get_many(self, nits: list[str]) -> dict[str, tuple[dict, float]]:
+        encontrados = {}
+        for i in range(0, len(nits), 500):
+            bloque = nits[i:i + 500]
+            with self._lock:
+                rows = self._db.execute(
+                    f"SELECT nit, data, expires_at FROM nit_cache WHERE nit IN ({','.join('?' * len(bloque))})",
+                    bloque,
+                ).fetchall()
+            encontrados.update((nit, (json.loads(data), expires_at)) for nit, data, expires_at in rows)
+        return encontrados
+
+    def put(self, nit: str, entry: dict, cached_at: float, expires_at: float):
+        data = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO nit_cache (nit, data, cached_at, expires_at) VALUES (?, ?, ?, ?)",
+                (nit, data, cached_at, expires_at),
+            )
+            if cur.rowcount:
+                if self._count is not None:
+                    self._count += 1
+            else:
+                self._db.execute(
+                    "UPDATE nit_cache SET data = ?, cached_at = ?, expires_at = ? WHERE nit = ?",
+                    (data, cached_at, expires_at, nit),
+                )
+
+    def put_many(self, rows: list[tuple[str, dict, float, float]]):
+        for nit, entry, cached_at, expires_at in rows:
+            self.put(nit, entry, cached_at, expires_at)
+
+    def delete(self, nit: str):
+        with self._lock:
+            cur = self._db.execute("DELETE FROM nit_cache WHERE nit = ?", (nit,))
+            if cur.rowcount and self._count is not None:
+                self._count -= cur.rowcount
+
+    def purge_expired(self, now: float) -> int:
+        with self._lock:
+            cur = self._db.execute("DELETE FROM nit_cache WHERE expires_at <= ?", (now,))
+            if self._count is not None:
+                self._count -= cur.rowcount
+            return cur.rowcount
+
+    def count(self) -> int:
+        with self._lock:
+            if self._count is None:
+                self._count = self._db.execute("SELECT COUNT(*) FROM nit_cache").fetchone()[0]
+            return self._count
+
+    def checkpoint(self):
+        try:
+            with self._lock:
+                self._db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+        except sqlite3.Error:
+            pass
+
+
+class RedisStore:
+    """
+    Nivel frío compartido en Redis: una llave por NIT con expiración nativa.
+    Timeouts cortos y cualquier error se trata como miss / escritura omitida,
+    para que un Redis caído nunca bloquee ni tumbe una consulta.
+    """
+
+    path = "redis"
+    bloqueante = True  # Red: desde async, NITCache lo llama en un hilo
+
+    def __init__(self, client, prefix: str = REDIS_PREFIX):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+        self._down_until = 0.0
+
+    @classmethod
+    def from_url(cls, url: str = REDIS_URL, prefix: str = REDIS_PREFIX) -> "RedisStore":
+        client = redis.Redis.from_url(
+            url, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT,
+        )
+        return cls(client, prefix)
+
+    def _call(self, fn, *args, **kwargs):
+        if time.time() < self._down_until:
+            return None
+        try:
+            return fn(*args, **kwargs)
+        except Exception as e:
+            self.errors += 1
+            self._down_until = time.time() + REDIS_RETRY_SECONDS
+            logger.warning("[Cache] Redis no disponible (%s), se omite por %ds", e, REDIS_RETRY_SECONDS)
+            return None
+
+    def get(self, nit: str) -> tuple[dict, float] | None:
+        return self._decodificar(self._call(self.client.get, self.prefix + nit))
+
+    @staticmethod
+    def _decodificar(raw) -> tuple[dict, float] | None:
+        if not raw:
+            return None
+        try:
+            data = json.loads(raw)
+            return data["e"], data["x"]
+        except (ValueError, KeyError, TypeError):
+            return None
+
+    def get_many(self, nits: list[str]) -> dict[str, tuple[dict, float]]:
+        """Un MGET por bloque de REDIS_LOTE llaves en vez de un GET por NIT."""
+        encontrados = {}
+        for i in range(0, len(nits), REDIS_LOTE):
+            bloque = nits[i:i + REDIS_LOTE]
+            raws = self._call(self.client.mget, [self.prefix + n for n in bloque]) or []
+            for nit, raw in zip(bloque, raws):
+                cold = self._decodificar(raw)
+                if cold:
+                    encontrados[nit] = cold
+        return encontrados
+
+    def put(self, nit: str, entry: dict, cached_at: float, expires_at: float):
+        self.put_many([(nit, entry, cached_at, expires_at)])
+
+    def put_many(self, rows: list[tuple[str, dict, float, float]]):
+        """Escrituras en pipeline: un round trip por bloque de REDIS_LOTE."""
+        now = time.time()
+        for i in range(0, len(rows), REDIS_LOTE):
+            pipe = self.client.pipeline(transaction=False)
+            for nit, entry, cached_at, expires_at in rows[i:i + REDIS_LOTE]:
+                ttl = int(expires_at - now)
+                if ttl > 0:
+                    data = json.dumps({"e": entry, "x": expires_at}, ensure_ascii=False)
+                    pipe.set(self.prefix + nit, data, ex=ttl)
+            if len(pipe):
+                self._call(pipe.execute)
+
+    def delete(self, nit: str):
+        self._call(self.client.delete, self.prefix + nit)
+
+    def purge_expired(self, now: float) -> int:
+        return 0  # Redis expira las llaves por su cuenta
+
+    def count(self) -> int:
+        # SCAN con MATCH: solo las llaves de este caché, aunque la base Redis sea
+        # compartida. Es O(n); desde async se llama vía NITCache.astats (en un hilo)
+        return self._call(self._contar) or 0
+
+    def _contar(self) -> int:
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*", count=REDIS_LOTE))
+
+    def checkpoint(self):
+        pass
+
+
+def crear_store(backend: str = CACHE_BACKEND, path: Path | str = CACHE_FILE):
+    """Nivel frío según CACHE_BACKEND. Si Redis no está disponible, usa SQLite."""
+    if backend == "redis":
+        if redis is None:
+            logger.warning("[Cache] CACHE_BACKEND=redis pero el paquete redis no está instalado; usando SQLite")
+        else:
+            return RedisStore.from_url()
+    return SQLiteStore(path)
 
 
 class NITCache:
-    def __init__(self, ttl_days: int = 7):
+    def __init__(self, ttl_days: int = 7, path: Path | str = CACHE_FILE,
+                 max_hot: int = CACHE_MAX_HOT, store=None, stale_days: int = 0,
+                 negative_hours: int = CACHE_NEGATIVE_HOURS):
         self.ttl = ttl_days * 24 * 3600
-        self.data: dict[str, dict] = {}
-        self._load()
+        self.negative_ttl = negative_hours * 3600
+        # Límite duro: después de esto la entrada se borra y no se sirve ni como stale
+        self.hard_ttl = self.ttl + stale_days * 24 * 3600
+        self.max_hot = max_hot
+        self.store = store if store is not None else SQLiteStore(path)
+        # Nivel caliente: nit → (entrada, expires_at), en orden de uso (LRU)
+        self._hot: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper: asyncio.Task | None = None
+        self.counters = {
+            "hits": 0, "hot_hits": 0, "stale_hits": 0, "negative_hits": 0, "misses": 0,
+            "writes": 0, "evictions": 0, "expirations": 0,
+        }
+        self._migrate_legacy_json()
 
-    def _load(self):
-        """Cargar caché desde disco al iniciar."""
-        if CACHE_FILE.exists():
-            try:
-                with open(CACHE_FILE, "r", encoding="utf-8") as f:
-                    raw = json.load(f)
-                # Filtrar entradas expiradas al cargar
-                now = time.time()
-                self.data = {
-                    k: v for k, v in raw.items()
-                    if now - v.get("_cached_at", 0) < self.ttl
-                }
-            except (json.JSONDecodeError, OSError):
-                self.data = {}
-
-    def _save(self):
-        """Persistir caché a disco."""
+    def _migrate_legacy_json(self):
+        """Importar una sola vez el cache_data.json del formato anterior, si existe."""
+        if not isinstance(self.store, SQLiteStore) or self.store.path == ":memory:":
+            return
+        legacy = Path(self.store.path).with_suffix(".json")
+        if not legacy.exists():
+            return
         try:
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(self.data, f, ensure_ascii=False, indent=None)
-        except OSError:
-            pass  # En Cloud Run el disco es efímero, no es crítico
+            with open(legacy, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+            now = time.time()
+            self.store.put_many([
+                (nit, v, v.get("_cached_at", 0), v.get("_cached_at", 0) + self.hard_ttl)
+                for nit, v in raw.items()
+                if isinstance(v, dict) and now - v.get("_cached_at", 0) < self.hard_ttl
+            ])
+            legacy.rename(legacy.with_suffix(".json.migrated"))
+        except (json.JSONDecodeError, OSError, sqlite3.Error):
+            pass
+
+    def _hot_put(self, nit: str, entry: dict, expires_at: float):
+        """Insertar en el nivel caliente, desalojando el menos usado si se llena."""
+        with self._lock:
+            self._hot[nit] = (entry, expires_at)
+            self._hot.move_to_end(nit)
+            while len(self._hot) > self.max_hot:
+                self._hot.popitem(last=False)
+                self.counters["evictions"] += 1
 
-    def get(self, nit: str) -> dict | None:
-        """Obtener resultado cacheado. Retorna None si no existe o expiró."""
+    def get(self, nit: str, allow_stale: bool = False) -> dict | None:
+        """
+        Obtener resultado cacheado. Retorna None si no existe o expiró.
+        Con allow_stale, una entrada vencida pero dentro del límite duro se
+        retorna con stale=True y age_seconds para que el llamador la refresque.
+        """
         nit = str(nit).strip()
-        entry = self.data.get(nit)
-        if not entry:
+        hot = self._hot_get(nit)
+        return self._servir(nit, hot, None if hot else self.store.get(nit), allow_stale)
+
+    def get_many(self, nits: list[str], allow_stale: bool = False) -> dict[str, dict]:
+        """get() para muchos NITs con una sola lectura del nivel frío. Retorna solo los hits."""
+        nits = [str(n).strip() for n in nits]
+        hots = {nit: self._hot_get(nit) for nit in nits}
+        faltan = [nit for nit, hot in hots.items() if not hot]
+        colds = self.store.get_many(faltan) if faltan else {}
+        resultados = {}
+        for nit in nits:
+            result = self._servir(nit, hots[nit], colds.get(nit), allow_stale)
+            if result is not None:
+                resultados[nit] = result
+        return resultados
+
+    def _hot_get(self, nit: str) -> tuple[dict, float] | None:
+        with self._lock:
+            hot = self._hot.get(nit)
+            if hot:
+                self._hot.move_to_end(nit)
+        return hot
+
+    def _servir(self, nit: str, hot, cold, allow_stale: bool) -> dict | None:
+        now = time.time()
+        if hot:
+            entry, expires_at = hot
+            from_hot = True
+        else:
+            if not cold:
+                self.counters["misses"] += 1
+                return None
+            entry, expires_at = cold
+            from_hot = False
+        if now > expires_at:
+            with self._lock:
+                self._hot.pop(nit, None)
+            self.store.delete(nit)
+            self.counters["expirations"] += 1
+            self.counters["misses"] += 1
             return None
-        if time.time() - entry.get("_cached_at", 0) > self.ttl:
-            del self.data[nit]
+        if not from_hot:
+            self._hot_put(nit, entry, expires_at)
+        age = now - entry.get("_cached_at", now)
+        stale = age >= self.ttl
+        if stale and not allow_stale:
+            self.counters["misses"] += 1
             return None
+        self.counters["hits"] += 1
+        self.counters["hot_hits"] += from_hot
         result = {k: v for k, v in entry.items() if not k.startswith("_")}
         result["cached"] = True
+        if entry.get("_negative"):
+            self.counters["negative_hits"] += 1
+            result["negative"] = True
+            result["dian_checked"] = entry.get("_dian_checked", False)
+        if stale:
+            self.counters["stale_hits"] += 1
+            result["stale"] = True
+            result["age_seconds"] = int(age)
         return result
 
     def set(self, nit: str, result: dict):
-        """Guardar resultado en caché."""
+        """Guardar resultado en caché (write-through: nivel caliente + upsert en el frío)."""
+        self.set_many({nit: result})
+
+    def set_many(self, resultados: dict[str, dict]):
+        """set() de varios NITs con una sola escritura al nivel frío (pipeline en Redis)."""
+        now = time.time()
+        filas = []
+        for nit, result in resultados.items():
+            nit = str(nit).strip()
+            entry = {**result, "_cached_at": now}
+            self._hot_put(nit, entry, now + self.hard_ttl)
+            filas.append((nit, entry, now, now + self.hard_ttl))
+        self.store.put_many(filas)
+        self.counters["writes"] += len(filas)
+
+    def set_negative(self, nit: str, result: dict, dian_checked: bool = False):
+        """
+        Guardar un "no encontrado" con TTL corto. dian_checked indica si la DIAN
+        también lo confirmó; si no, solo vale para consultas sin DIAN.
+        Nunca pisa una entrada positiva vigente (p. ej. un refresco SWR fallido).
+        """
         nit = str(nit).strip()
-        entry = {**result, "_cached_at": time.time()}
-        self.data[nit] = entry
-        # Persistir cada 10 escrituras para no escribir en cada request
-        if len(self.data) % 10 == 0:
-            self._save()
+        now = time.time()
+        with self._lock:
+            existing = self._hot.get(nit)
+        existing = existing or self.store.get(nit)
+        if existing and not existing[0].get("_negative") and existing[1] > now:
+            return
+        entry = {**result, "_cached_at": now, "_negative": True, "_dian_checked": dian_checked}
+        self._hot_put(nit, entry, now + self.negative_ttl)
+        self.store.put(nit, entry, now, now + self.negative_ttl)
+        self.counters["writes"] += 1
+
+    # ── Versiones para código async: con un nivel frío de red (Redis) la E/S va
+    # en un hilo; un hit del nivel caliente se sirve sin salir del event loop.
+
+    async def aget(self, nit: str, allow_stale: bool = False) -> dict | None:
+        if not self.store.bloqueante or str(nit).strip() in self._hot:
+            return self.get(nit, allow_stale)
+        return await asyncio.to_thread(self.get, nit, allow_stale)
+
+    async def aget_many(self, nits: list[str], allow_stale: bool = False) -> dict[str, dict]:
+        if not self.store.bloqueante:
+            return self.get_many(nits, allow_stale)
+        return await asyncio.to_thread(self.get_many, nits, allow_stale)
+
+    async def aset(self, nit: str, result: dict):
+        await self.aset_many({nit: result})
+
+    async def aset_many(self, resultados: dict[str, dict]):
+        if not self.store.bloqueante:
+            return self.set_many(resultados)
+        await asyncio.to_thread(self.set_many, resultados)
+
+    async def aset_negative(self, nit: str, result: dict, dian_checked: bool = False):
+        if not self.store.bloqueante:
+            return self.set_negative(nit, result, dian_checked)
+        await asyncio.to_thread(self.set_negative, nit, result, dian_checked)
+
+    def sweep(self) -> int:
+        """Eliminar entradas expiradas de ambos niveles. Retorna cuántas borró del nivel frío."""
+        now = time.time()
+        with self._lock:
+            expired = [nit for nit, (_, expires_at) in self._hot.items() if expires_at <= now]
+            for nit in expired:
+                del self._hot[nit]
+        removed = self.store.purge_expired(now)
+        self.counters["expirations"] += removed
+        return removed
+
+    # Compatibilidad con el nombre anterior
+    purge_expired = sweep
+
+    async def _sweep_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.info("[Cache] Barrido: %d entradas expiradas eliminadas", removed)
+            except Exception as e:
+                logger.warning("[Cache] Error en barrido: %s", e)
+
+    def start_sweeper(self, interval: float = CACHE_SWEEP_SECONDS):
+        """Iniciar el barrido periódico (llamar desde el event loop, p. ej. en startup)."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
 
     def flush(self):
-        """Forzar escritura a disco."""
-        self._save()
+        """Forzar escritura a disco (checkpoint del WAL)."""
+        self.store.checkpoint()
 
     def stats(self) -> dict:
-        """Estadísticas del caché."""
-        now = time.time()
-        valid = sum(1 for v in self.data.values() if now - v.get("_cached_at", 0) < self.ttl)
-        return {"total_entries": len(self.data), "valid_entries": valid}
+        """Estadísticas del caché (contadores O(1))."""
+        c = self.counters
+        lookups = c["hits"] + c["misses"]
+        return {
+            "backend": "redis" if isinstance(self.store, RedisStore) else "sqlite",
+            "total_entries": self.store.count(),
+            "hot_entries": len(self._hot),
+            "max_hot_entries": self.max_hot,
+            **c,
+            "hit_rate": round(c["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+    async def astats(self) -> dict:
+        """stats() para endpoints: con Redis el conteo va en un hilo."""
+        if not self.store.bloqueante:
+            return self.stats()
+        return await asyncio.to_thread(self.stats)
 
 
 # Singleton
@@ -80,5 +505,5 @@ _cache_instance: NITCache | None = None
 def get_cache(ttl_days: int = 7) -> NITCache:
     global _cache_instance
     if _cache_instance is None:
-        _cache_instance = NITCache(ttl_days)
+        _cache_instance = NITCache(ttl_days, store=crear_store(), stale_days=CACHE_STALE_DAYS)
     return _cache_instance
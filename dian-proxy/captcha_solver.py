@@ -1,13 +1,174 @@
 """
 Resolver Cloudflare Turnstile usando CapSolver API.
 Documentación: https://docs.capsolver.com/en/guide/antibots/cloudflare-turnstile/
+
+El polling de getTaskResult lo hace un único planificador (PollScheduler)
+para todas las tareas en curso: el primer poll de cada tarea espera lo que
+suele tardar CapSolver (percentil observado), luego backoff exponencial, y
+las consultas que vencen juntas salen en una misma ronda sobre el cliente
+compartido "captcha" (multiplexadas si hay HTTP/2).
 """
 import asyncio
+import bisect
+import logging
 import os
-import httpx
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from http_clients import get_client
+
+logger = logging.getLogger("exogenadian.captcha")
 
 CAPSOLVER_API = "https://api.capsolver.com"
 
+CAPTCHA_POLL_PERCENTIL = float(os.getenv("CAPTCHA_POLL_PERCENTIL", "0.25"))  # Primer poll
+CAPTCHA_POLL_INICIAL = float(os.getenv("CAPTCHA_POLL_INICIAL", "3"))  # Sin historial suficiente
+CAPTCHA_POLL_MIN = float(os.getenv("CAPTCHA_POLL_MIN", "0.5"))
+CAPTCHA_POLL_MAX = float(os.getenv("CAPTCHA_POLL_MAX", "4"))
+CAPTCHA_POLL_FACTOR = float(os.getenv("CAPTCHA_POLL_FACTOR", "1.5"))
+CAPTCHA_POLL_RONDA = 0.05  # Tareas que vencen con esta diferencia salen en la misma ronda
+MIN_MUESTRAS = 5
+
+# Límites superiores (segundos) del histograma de tiempos de resolución
+HISTOGRAMA_LIMITES = (2, 4, 6, 8, 10, 15, 20, 30, 45)
+
+
+@dataclass
+class _TareaCaptcha:
+    task_id: str
+    api_key: str
+    futuro: asyncio.Future
+    creada_en: float
+    proximo_poll: float
+    intervalo: float
+    polls: int = 0
+
+
+@dataclass
+class PollScheduler:
+    """Planificador compartido de getTaskResult para todas las tareas CapSolver en curso."""
+    ventana: int = 200
+    _tiempos: deque = field(init=False)
+    _pendientes: dict = field(default_factory=dict)
+    _task: asyncio.Task | None = None
+    _despertar: asyncio.Event | None = None
+    histograma: list = field(default_factory=lambda: [0] * (len(HISTOGRAMA_LIMITES) + 1))
+    counters: dict = field(default_factory=lambda: {
+        "solved": 0, "failed": 0, "timeouts": 0, "polls": 0, "rounds": 0, "poll_errors": 0,
+    })
+
+    def __post_init__(self):
+        self._tiempos = deque(maxlen=self.ventana)
+
+    def percentil(self, p: float) -> float | None:
+        if len(self._tiempos) < MIN_MUESTRAS:
+            return None
+        ordenados = sorted(self._tiempos)
+        return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+    def retraso_inicial(self) -> float:
+        """Espera antes del primer poll: lo que tarda el percentil bajo de las resoluciones."""
+        observado = self.percentil(CAPTCHA_POLL_PERCENTIL)
+        if observado is None:
+            return CAPTCHA_POLL_INICIAL
+        return max(CAPTCHA_POLL_MIN, observado)
+
+    def registrar(self, segundos: float):
+        self._tiempos.append(segundos)
+        self.histograma[bisect.bisect_left(HISTOGRAMA_LIMITES, segundos)] += 1
+
+    async def esperar(self, api_key: str, task_id: str, timeout: float) -> dict | None:
+        """Respuesta final de getTaskResult (ready/failed) o None si vence el timeout."""
+        ahora = time.monotonic()
+        tarea = _TareaCaptcha(
+            task_id=task_id,
+            api_key=api_key,
+            futuro=asyncio.get_running_loop().create_future(),
+            creada_en=ahora,
+            proximo_poll=ahora + self.retraso_inicial(),
+            intervalo=CAPTCHA_POLL_MIN,
+        )
+        self._pendientes[task_id] = tarea
+        if self._task is None or self._task.done() or self._task.get_loop() is not asyncio.get_running_loop():
+            self._despertar = asyncio.Event()
+            self._task = asyncio.ensure_future(self._bucle())
+        else:
+            self._despertar.set()
+        try:
+            return await asyncio.wait_for(tarea.futuro, timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            return None
+        finally:
+            self._pendientes.pop(task_id, None)
+
+    async def _bucle(self):
+        while self._pendientes:
+            ahora = time.monotonic()
+            siguiente = min(t.proximo_poll for t in self._pendientes.values())
+            if siguiente > ahora:
+                # Dormir hasta el próximo vencimiento o hasta que llegue una tarea nueva
+                self._despertar.clear()
+                try:
+                    await asyncio.wait_for(self._despertar.wait(), siguiente - ahora)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            vencidas = [t for t in self._pendientes.values() if t.proximo_poll <= ahora + CAPTCHA_POLL_RONDA]
+            self.counters["rounds"] += 1
+            await asyncio.gather(*(self._consultar(t) for t in vencidas))
+
+    async def _consultar(self, tarea: _TareaCaptcha):
+        self.counters["polls"] += 1
+        tarea.polls += 1
+        try:
+            resp = await get_client("captcha").post(f"{CAPSOLVER_API}/getTaskResult", json={
+                "clientKey": tarea.api_key,
+                "taskId": tarea.task_id,
+            })
+            data = resp.json()
+        except Exception as e:
+            self.counters["poll_errors"] += 1
+            logger.debug("[CAPTCHA] Poll %s falló: %s", tarea.task_id, str(e)[:100])
+            data = {}
+        status = data.get("status", "")
+        if status in ("ready", "failed") or data.get("errorId"):
+            if status == "ready":
+                self.counters["solved"] += 1
+                self.registrar(time.monotonic() - tarea.creada_en)
+            else:
+                self.counters["failed"] += 1
+            if not tarea.futuro.done():
+                tarea.futuro.set_result(data)
+            self._pendientes.pop(tarea.task_id, None)
+            return
+        # status == "processing" → backoff exponencial
+        tarea.proximo_poll = time.monotonic() + tarea.intervalo
+        tarea.intervalo = min(CAPTCHA_POLL_MAX, tarea.intervalo * CAPTCHA_POLL_FACTOR)
+
+    def stats(self) -> dict:
+        resueltas = self.counters["solved"]
+        return {
+            **self.counters,
+            "pending": len(self._pendientes),
+            "initial_delay": round(self.retraso_inicial(), 2),
+            "p50": self.percentil(0.5),
+            "p90": self.percentil(0.9),
+            "polls_per_solve": round(self.counters["polls"] / resueltas, 2) if resueltas else None,
+            "solve_time_histogram": {
+                (f"<={limite}s" if i < len(HISTOGRAMA_LIMITES) else f">{HISTOGRAMA_LIMITES[-1]}s"): n
+                for i, (limite, n) in enumerate(zip((*HISTOGRAMA_LIMITES, None), self.histograma))
+            },
+        }
+
+
+poll_scheduler = PollScheduler()
+
+
+def stats() -> dict:
+    return poll_scheduler.stats()
+
 
 async def solve_turnstile(site_key: str, page_url: str, timeout: int = 45, retries: int = 1) -> str | None:
     """
@@ -19,55 +180,43 @@ async def solve_turnstile(site_key: str, page_url: str, timeout: int = 45, retri
     if not api_key:
         raise ValueError("CAPSOLVER_API_KEY no configurada")
 
-    import logging
-    logger = logging.getLogger("exogenadian.captcha")
-
     for attempt in range(1, retries + 1):
         try:
-            async with httpx.AsyncClient(timeout=90) as client:
-                # Crear tarea
-                logger.info("[CAPTCHA] Intento %d/%d — sitekey=%s", attempt, retries, site_key[:20])
-                create_resp = await client.post(f"{CAPSOLVER_API}/createTask", json={
-                    "clientKey": api_key,
-                    "task": {
-                        "type": "AntiTurnstileTaskProxyLess",
-                        "websiteURL": page_url,
-                        "websiteKey": site_key,
-                    }
-                })
-                create_data = create_resp.json()
-
-                if create_data.get("errorId", 1) != 0:
-                    error_desc = create_data.get("errorDescription", "Unknown error")
-                    logger.warning("[CAPTCHA] createTask error: %s", error_desc)
-                    if attempt < retries:
-                        await asyncio.sleep(2)
-                        continue
-                    raise RuntimeError(f"CapSolver createTask error: {error_desc}")
-
-                task_id = create_data["taskId"]
-
-                # Polling hasta obtener resultado
-                for _ in range(timeout):
-                    await asyncio.sleep(1)
-                    result_resp = await client.post(f"{CAPSOLVER_API}/getTaskResult", json={
-                        "clientKey": api_key,
-                        "taskId": task_id,
-                    })
-                    result_data = result_resp.json()
-
-                    status = result_data.get("status", "")
-                    if status == "ready":
-                        token = result_data.get("solution", {}).get("token")
-                        logger.info("[CAPTCHA] Resuelto en intento %d", attempt)
-                        return token
-                    elif status == "failed":
-                        error_desc = result_data.get("errorDescription", "Task failed")
-                        logger.warning("[CAPTCHA] Task failed: %s", error_desc)
-                        break  # Sale del polling, reintenta
-                    # status == "processing" → seguir esperando
-
-                logger.warning("[CAPTCHA] Timeout en intento %d/%d", attempt, retries)
+            client = get_client("captcha")
+            # Crear tarea
+            logger.info("[CAPTCHA] Intento %d/%d — sitekey=%s", attempt, retries, site_key[:20])
+            create_resp = await client.post(f"{CAPSOLVER_API}/createTask", json={
+                "clientKey": api_key,
+                "task": {
+                    "type": "AntiTurnstileTaskProxyLess",
+                    "websiteURL": page_url,
+                    "websiteKey": site_key,
+                }
+            })
+            create_data = create_resp.json()
+
+            if create_data.get("errorId", 1) != 0:
+                error_desc = create_data.get("errorDescription", "Unknown error")
+                logger.warning("[CAPTCHA] createTask error: %s", error_desc)
+                if attempt < retries:
+                    await asyncio.sleep(2)
+                    continue
+                raise RuntimeError(f"CapSolver createTask error: {error_desc}")
+
+            task_id = create_data["taskId"]
+
+            # Polling compartido hasta obtener resultado
+            result_data = await poll_scheduler.esperar(api_key, task_id, timeout)
+            if result_data is not None:
+                if result_data.get("status") == "ready":
+                    token = result_data.get("solution", {}).get("token")
+                    logger.info("[CAPTCHA] Resuelto en intento %d", attempt)
+                    return token
+                error_desc = result_data.get("errorDescription", "Task failed")
+                logger.warning("[CAPTCHA] Task failed: %s", error_desc)
+                continue  # Reintenta
+
+            logger.warning("[CAPTCHA] Timeout en intento %d/%d", attempt, retries)
         except RuntimeError:
             raise
         except Exception as e:
@@ -84,9 +233,9 @@ async def get_balance() -> float:
     if not api_key:
         return 0.0
 
-    async with httpx.AsyncClient(timeout=10) as client:
-        resp = await client.post(f"{CAPSOLVER_API}/getBalance", json={
-            "clientKey": api_key,
-        })
-        data = resp.json()
-        return data.get("balance", 0.0)
+    client = get_client("captcha")
+    resp = await client.post(f"{CAPSOLVER_API}/getBalance", timeout=10, json={
+        "clientKey": api_key,
+    })
+    data = resp.json()
+    return data.get("balance", 0.0)
@@ -21,6 +21,8 @@ from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
+from http_clients import get_client
+
 logger = logging.getLogger("exogenadian.chat")
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
@@ -271,15 +273,15 @@ async def _log_chat(ip: str, question: str, is_pro: bool):
     if not CHAT_LOG_WEBHOOK:
         return
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            await client.post(CHAT_LOG_WEBHOOK, json={
-                "type": "chat_log",
-                "question": question[:500],
-                "ip": ip[:20],
-                "pro": is_pro,
-                "page": "chatbot",
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            })
+        client = get_client("google")
+        await client.post(CHAT_LOG_WEBHOOK, timeout=5.0, json={
+            "type": "chat_log",
+            "question": question[:500],
+            "ip": ip[:20],
+            "pro": is_pro,
+            "page": "chatbot",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        })
     except Exception:
         pass  # No bloquear el chat si falla el log
 
@@ -291,24 +293,24 @@ async def _send_budget_alert():
         return
     stats = cost_tracker.stats()
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            await client.get(
-                ALERT_WEBHOOK_URL,
-                params={
-                    "action": "sendAlert",
-                    "email": ALERT_EMAIL,
-                    "subject": f"⚠️ Exa: {stats['percent_used']}% del presupuesto usado",
-                    "body": (
-                        f"Hola,\n\n"
-                        f"El chatbot Exa ha usado el {stats['percent_used']}% del presupuesto mensual.\n\n"
-                        f"Gasto: ${stats['spend_usd']} USD de ${stats['budget_usd']} USD\n"
-                        f"Mensajes este mes: {stats['messages']}\n"
-                        f"Mes: {stats['month']}\n\n"
-                        f"Recarga tu saldo en console.anthropic.com → Settings → Billing.\n\n"
-                        f"---\nExógenaDIAN · exogenadian.com"
-                    ),
-                },
-            )
+        client = get_client("google")
+        await client.get(
+            ALERT_WEBHOOK_URL,
+            params={
+                "action": "sendAlert",
+                "email": ALERT_EMAIL,
+                "subject": f"⚠️ Exa: {stats['percent_used']}% del presupuesto usado",
+                "body": (
+                    f"Hola,\n\n"
+                    f"El chatbot Exa ha usado el {stats['percent_used']}% del presupuesto mensual.\n\n"
+                    f"Gasto: ${stats['spend_usd']} USD de ${stats['budget_usd']} USD\n"
+                    f"Mensajes este mes: {stats['messages']}\n"
+                    f"Mes: {stats['month']}\n\n"
+                    f"Recarga tu saldo en console.anthropic.com → Settings → Billing.\n\n"
+                    f"---\nExógenaDIAN · exogenadian.com"
+                ),
+            },
+        )
         cost_tracker.mark_alert_sent()
         logger.info("Budget alert sent to %s", ALERT_EMAIL)
     except Exception as e:
@@ -368,15 +370,16 @@ class ProRateLimiter:
             return cached[0]
 
         try:
-            async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-                resp = await client.get(
-                    PRO_VALIDATION_URL,
-                    params={"action": "validateKey", "key": key, "device": device_id},
-                )
-                data = resp.json()
-                valid = data.get("valid", False)
-                self.validated_keys[key] = (valid, now)
-                return valid
+            client = get_client("google")
+            resp = await client.get(
+                PRO_VALIDATION_URL,
+                follow_redirects=True,
+                params={"action": "validateKey", "key": key, "device": device_id},
+            )
+            data = resp.json()
+            valid = data.get("valid", False)
+            self.validated_keys[key] = (valid, now)
+            return valid
         except Exception as e:
             logger.warning("PRO validation failed: %s", e)
             # On network error, trust cached value if available
@@ -469,61 +472,61 @@ async def chat(body: ChatRequest, request: Request):
         nonlocal usage_input, usage_cached, usage_output
         try:
             api_messages = [{"role": "system", "content": system_prompt}] + messages
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                async with client.stream(
-                    "POST",
-                    OPENROUTER_URL,
-                    headers={
-                        "Authorization": f"Bearer {OPENROUTER_API_KEY}",
-                        "Content-Type": "application/json",
-                        "HTTP-Referer": BASE,
-                        "X-Title": "ExógenaDIAN Chat",
-                    },
-                    json={
-                        "model": CHAT_MODEL,
-                        "max_tokens": CHAT_MAX_TOKENS,
-                        "messages": api_messages,
-                        "stream": True,
-                    },
-                ) as resp:
-                    if resp.status_code != 200:
-                        error_body = await resp.aread()
-                        logger.error("OpenRouter API error %s: %s", resp.status_code, error_body[:500])
-                        yield None  # Signal to try fallback
-                        return
-
-                    has_content = False
-                    async for line in resp.aiter_lines():
-                        if not line.startswith("data: "):
-                            continue
-                        data_str = line[6:].strip()
-                        if data_str == "[DONE]":
-                            if has_content:
-                                yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                            break
-                        try:
-                            event = json.loads(data_str)
-                        except json.JSONDecodeError:
-                            continue
-
-                        # OpenAI streaming format
-                        choices = event.get("choices", [])
-                        if choices:
-                            delta = choices[0].get("delta", {})
-                            text = delta.get("content", "")
-                            if text:
-                                has_content = True
-                                yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
-
-                        # Capture usage if present
-                        u = event.get("usage")
-                        if u:
-                            usage_input = u.get("prompt_tokens", 0)
-                            usage_cached = u.get("prompt_tokens_details", {}).get("cached_tokens", 0)
-                            usage_output = u.get("completion_tokens", 0)
-
-                    if not has_content:
-                        yield None  # Signal to try fallback
+            client = get_client("llm")
+            async with client.stream(
+                "POST",
+                OPENROUTER_URL,
+                headers={
+                    "Authorization": f"Bearer {OPENROUTER_API_KEY}",
+                    "Content-Type": "application/json",
+                    "HTTP-Referer": BASE,
+                    "X-Title": "ExógenaDIAN Chat",
+                },
+                json={
+                    "model": CHAT_MODEL,
+                    "max_tokens": CHAT_MAX_TOKENS,
+                    "messages": api_messages,
+                    "stream": True,
+                },
+            ) as resp:
+                if resp.status_code != 200:
+                    error_body = await resp.aread()
+                    logger.error("OpenRouter API error %s: %s", resp.status_code, error_body[:500])
+                    yield None  # Signal to try fallback
+                    return
+
+                has_content = False
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data_str = line[6:].strip()
+                    if data_str == "[DONE]":
+                        if has_content:
+                            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+                        break
+                    try:
+                        event = json.loads(data_str)
+                    except json.JSONDecodeError:
+                        continue
+
+                    # OpenAI streaming format
+                    choices = event.get("choices", [])
+                    if choices:
+                        delta = choices[0].get("delta", {})
+                        text = delta.get("content", "")
+                        if text:
+                            has_content = True
+                            yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
+
+                    # Capture usage if present
+                    u = event.get("usage")
+                    if u:
+                        usage_input = u.get("prompt_tokens", 0)
+                        usage_cached = u.get("prompt_tokens_details", {}).get("cached_tokens", 0)
+                        usage_output = u.get("completion_tokens", 0)
+
+                if not has_content:
+                    yield None  # Signal to try fallback
 
         except (httpx.TimeoutException, httpx.ConnectError, Exception) as e:
             logger.warning("OpenRouter stream failed: %s", e)
@@ -533,56 +536,56 @@ async def chat(body: ChatRequest, request: Request):
         """Fallback a Anthropic si DeepSeek falla."""
         nonlocal usage_input, usage_cached, usage_output
         try:
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                async with client.stream(
-                    "POST",
-                    "https://api.anthropic.com/v1/messages",
-                    headers={
-                        "x-api-key": ANTHROPIC_API_KEY,
-                        "anthropic-version": "2023-06-01",
-                        "content-type": "application/json",
-                    },
-                    json={
-                        "model": ANTHROPIC_FALLBACK_MODEL,
-                        "max_tokens": CHAT_MAX_TOKENS,
-                        "system": system_prompt,
-                        "messages": messages,
-                        "stream": True,
-                    },
-                ) as resp:
-                    if resp.status_code != 200:
-                        error_body = await resp.aread()
-                        logger.error("Anthropic fallback error %s: %s", resp.status_code, error_body[:500])
-                        yield f"data: {json.dumps({'type': 'error', 'error': 'Error al procesar tu mensaje. Intenta de nuevo.'})}\n\n"
-                        return
-
-                    async for line in resp.aiter_lines():
-                        if not line.startswith("data: "):
-                            continue
-                        data_str = line[6:]
-                        if data_str.strip() == "[DONE]":
-                            break
-                        try:
-                            event = json.loads(data_str)
-                        except json.JSONDecodeError:
-                            continue
-
-                        etype = event.get("type", "")
-                        if etype == "message_start":
-                            u = event.get("message", {}).get("usage", {})
-                            usage_input = u.get("input_tokens", 0)
-                            usage_cached = u.get("cache_read_input_tokens", 0)
-                        elif etype == "content_block_delta":
-                            delta = event.get("delta", {})
-                            if delta.get("type") == "text_delta":
-                                text = delta.get("text", "")
-                                if text:
-                                    yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
-                        elif etype == "message_delta":
-                            u = event.get("usage", {})
-                            usage_output = u.get("output_tokens", 0)
-                        elif etype == "message_stop":
-                            yield f"data: {json.dumps({'type': 'done'})}\n\n"
+            client = get_client("llm")
+            async with client.stream(
+                "POST",
+                "https://api.anthropic.com/v1/messages",
+                headers={
+                    "x-api-key": ANTHROPIC_API_KEY,
+                    "anthropic-version": "2023-06-01",
+                    "content-type": "application/json",
+                },
+                json={
+                    "model": ANTHROPIC_FALLBACK_MODEL,
+                    "max_tokens": CHAT_MAX_TOKENS,
+                    "system": system_prompt,
+                    "messages": messages,
+                    "stream": True,
+                },
+            ) as resp:
+                if resp.status_code != 200:
+                    error_body = await resp.aread()
+                    logger.error("Anthropic fallback error %s: %s", resp.status_code, error_body[:500])
+                    yield f"data: {json.dumps({'type': 'error', 'error': 'Error al procesar tu mensaje. Intenta de nuevo.'})}\n\n"
+                    return
+
+                async for line in resp.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    data_str = line[6:]
+                    if data_str.strip() == "[DONE]":
+                        break
+                    try:
+                        event = json.loads(data_str)
+                    except json.JSONDecodeError:
+                        continue
+
+                    etype = event.get("type", "")
+                    if etype == "message_start":
+                        u = event.get("message", {}).get("usage", {})
+                        usage_input = u.get("input_tokens", 0)
+                        usage_cached = u.get("cache_read_input_tokens", 0)
+                    elif etype == "content_block_delta":
+                        delta = event.get("delta", {})
+                        if delta.get("type") == "text_delta":
+                            text = delta.get("text", "")
+                            if text:
+                                yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
+                    elif etype == "message_delta":
+                        u = event.get("usage", {})
+                        usage_output = u.get("output_tokens", 0)
+                    elif etype == "message_stop":
+                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
 
         except Exception as e:
             logger.error("Anthropic fallback error: %s", e)
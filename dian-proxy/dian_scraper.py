@@ -5,10 +5,15 @@ Incluye Circuit Breaker para detectar bloqueos y autocorregir.
 Browser Pool para reusar instancias de Chromium y soportar miles de usuarios.
 """
 import asyncio
+import contextvars
 import logging
+import math
+import os
 import re
 import time
+from collections import deque
 from dataclasses import dataclass, field
+from urllib.parse import urlsplit
 
 from playwright.async_api import async_playwright, Page, Browser, Playwright
 
@@ -25,6 +30,30 @@ SEL_NOMBRE = '#vistaConsultaEstadoRUT\\:formConsultaEstadoRUT\\:nombre'
 SEL_TURNSTILE = 'iframe[src*="challenges.cloudflare.com"]'
 SEL_TURNSTILE_INPUT = 'input[name="cf-turnstile-response"]'
 
+# Páginas del formulario que se mantienen abiertas y listas entre consultas
+DIAN_WARM_PAGES = int(os.getenv("DIAN_WARM_PAGES", "2"))
+DIAN_PAGE_MAX_USES = int(os.getenv("DIAN_PAGE_MAX_USES", "50"))
+DIAN_PAGE_MAX_AGE = float(os.getenv("DIAN_PAGE_MAX_AGE", "900"))  # segundos (sesión JSF)
+DIAN_WARM_TURNSTILE = os.getenv("DIAN_WARM_TURNSTILE", "1") == "1"  # Resolver Turnstile al calentar (si hay demanda)
+TURNSTILE_TOKEN_TTL = 270  # Los tokens Turnstile valen 300 s; margen para el submit
+TURNSTILE_ESPERA = 2  # Segundos tras inyectar el token antes de usar el formulario
+TURNSTILE_PREFETCH_MAX = int(os.getenv("TURNSTILE_PREFETCH_MAX", "3"))  # 0 = sin pre-resolución
+TURNSTILE_DEMANDA_VENTANA = 120  # Segundos de historial para estimar la demanda
+TURNSTILE_DEMANDA_MINIMA = 2  # Consultas en la ventana para hablar de demanda (una sola no es tasa)
+
+# Recursos que los contexts del pool no descargan (el formulario JSF no los necesita).
+# Vacío = cargar todo. Turnstile (challenges.cloudflare.com) siempre pasa.
+DIAN_BLOCK_RESOURCES = frozenset(
+    t.strip() for t in os.getenv("DIAN_BLOCK_RESOURCES", "image,font,media,stylesheet").split(",") if t.strip()
+)
+DIAN_BLOCK_HOSTS = tuple(
+    h.strip() for h in os.getenv(
+        "DIAN_BLOCK_HOSTS",
+        "google-analytics.com,googletagmanager.com,doubleclick.net,facebook.net,hotjar.com",
+    ).split(",") if h.strip()
+)
+HOSTS_PERMITIDOS = ("challenges.cloudflare.com",)
+
 # Señales de bloqueo Cloudflare
 CLOUDFLARE_SIGNALS = [
     "just a moment", "checking your browser", "ray id",
@@ -37,19 +66,72 @@ CLOUDFLARE_SIGNALS = [
 #  BROWSER POOL — reusar instancias de Chromium
 # ═══════════════════════════════════════════════════════════════
 
+def recurso_bloqueado(url: str, resource_type: str) -> bool:
+    """¿Abortar esta petición de una página del pool? (DIAN_BLOCK_RESOURCES / DIAN_BLOCK_HOSTS)"""
+    host = urlsplit(url).hostname or ""
+    if _host_en(host, HOSTS_PERMITIDOS):
+        return False
+    if _host_en(host, DIAN_BLOCK_HOSTS):
+        return True
+    return resource_type in DIAN_BLOCK_RESOURCES
+
+
+def _host_en(host: str, dominios: tuple[str, ...]) -> bool:
+    return any(host == d or host.endswith("." + d) for d in dominios)
+
+
+@dataclass
+class PaginaMuisca:
+    """Página con su context propio, idealmente ya sobre el formulario MUISCA."""
+    context: object
+    page: Page
+    generation: int = 0           # Browser en que se creó (un reinicio la invalida)
+    created_at: float = field(default_factory=time.time)
+    uses: int = 0
+    navigated: bool = False       # Ya está sobre el formulario
+    sitekey: str | None = None
+    token_at: float = 0           # Cuándo se resolvió el token Turnstile inyectado aún sin usar
+    ultimo_token: str = ""        # Último token inyectado (ya consumido tras el submit)
+
+    @property
+    def token_vigente(self) -> bool:
+        return bool(self.token_at) and time.time() - self.token_at < TURNSTILE_TOKEN_TTL
+
+    @property
+    def vencida(self) -> bool:
+        return self.uses >= DIAN_PAGE_MAX_USES or time.time() - self.created_at >= DIAN_PAGE_MAX_AGE
+
+
 class BrowserPool:
     """
     Pool de browsers Chromium para evitar crear/destruir por cada request.
-    Cada consulta DIAN usa un context nuevo (aislado) sobre un browser compartido.
+    Cada consulta DIAN usa un context aislado sobre un browser compartido.
     Semáforo limita consultas DIAN concurrentes por worker (Chromium es pesado).
+
+    Páginas tibias: tras una consulta exitosa la página no se cierra; se limpia
+    el formulario y queda en espera para el siguiente NIT (sin goto ni detección
+    de Turnstile). Después de cada uso se rellena en segundo plano hasta
+    `warm_pages` páginas ya navegadas y, si se puede, con Turnstile resuelto.
+    Una página con error, vencida o que no pasa el chequeo se descarta.
     """
-    def __init__(self, max_concurrent: int = 5):
+    def __init__(self, max_concurrent: int = 5, warm_pages: int = DIAN_WARM_PAGES):
         self._playwright: Playwright | None = None
         self._browser: Browser | None = None
         self._lock = asyncio.Lock()
         self._semaphore = asyncio.Semaphore(max_concurrent)
         self._request_count = 0
         self._max_requests_before_restart = 200
+        self._generation = 0
+        self.warm_pages = warm_pages
+        self._warm: deque[PaginaMuisca] = deque()
+        self._warming = 0
+        self._in_use = 0
+        self._refill_task: asyncio.Task | None = None
+        self.resource_stats = {"blocked": 0, "allowed": 0}
+        self.page_stats = {
+            "warm_hits": 0, "cold_starts": 0, "recycled": 0, "evicted": 0, "warmed": 0,
+            "session_lookups": 0, "session_renewals": 0, "captcha_reused": 0, "warm_token_skipped": 0,
+        }
 
     async def _start_playwright(self):
         """Iniciar o reiniciar Playwright completamente."""
@@ -58,6 +140,9 @@ class BrowserPool:
         old_pw = self._playwright
         self._browser = None
         self._playwright = None
+        # Las páginas tibias mueren con el browser
+        self._generation += 1
+        self._warm.clear()
 
         for cleanup in [
             lambda: old_browser.close() if old_browser else None,
@@ -107,27 +192,138 @@ class BrowserPool:
                 logger.info("[BrowserPool] Reiniciando browser (límite de requests)")
                 await self._start_playwright()
         try:
-            context = await self._browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                           "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                locale="es-CO",
-            )
-            return context
+            return await self._crear_context()
         except Exception as e:
             logger.error("[BrowserPool] Error creando context: %s — reiniciando", str(e)[:100])
             async with self._lock:
                 await self._start_playwright()
-            context = await self._browser.new_context(
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                           "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-                locale="es-CO",
-            )
-            return context
+            return await self._crear_context()
+
+    async def _crear_context(self):
+        context = await self._browser.new_context(
+            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                       "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+            locale="es-CO",
+        )
+        if DIAN_BLOCK_RESOURCES or DIAN_BLOCK_HOSTS:
+            await context.route("**/*", self._filtrar_recurso)
+        return context
+
+    async def _filtrar_recurso(self, route):
+        """Abortar imágenes, fuentes, CSS y trackers; el formulario y Turnstile pasan."""
+        request = route.request
+        if recurso_bloqueado(request.url, request.resource_type):
+            self.resource_stats["blocked"] += 1
+            await route.abort()
+        else:
+            self.resource_stats["allowed"] += 1
+            await route.continue_()
+
+    async def new_page(self) -> PaginaMuisca:
+        """Página nueva (fría) en un context propio."""
+        context = await self.get_context()
+        try:
+            page = await context.new_page()
+        except Exception:
+            await context.close()
+            raise
+        return PaginaMuisca(context=context, page=page, generation=self._generation)
+
+    async def acquire_page(self) -> PaginaMuisca:
+        """Tomar una página tibia sana o, si no hay, una nueva. Devolver con release_page()."""
+        try:
+            while self._warm:
+                pagina = self._warm.popleft()
+                if pagina.generation == self._generation and not pagina.vencida and await _pagina_sana(pagina):
+                    self.page_stats["warm_hits"] += 1
+                    self._in_use += 1
+                    return pagina
+                await self._descartar(pagina)
+            self.page_stats["cold_starts"] += 1
+            pagina = await self.new_page()
+            self._in_use += 1
+            return pagina
+        finally:
+            self._programar_relleno()
+
+    async def release_page(self, pagina: PaginaMuisca, reusable: bool):
+        """Devolver la página tras una consulta: se recicla si quedó sana, si no se descarta."""
+        if reusable and self.reutilizable(pagina) and len(self._warm) < self.warm_pages:
+            reusable = await _reciclar(pagina)
+        await self.devolver(pagina, reusable)
+
+    def reutilizable(self, pagina: PaginaMuisca) -> bool:
+        return pagina.navigated and pagina.generation == self._generation and not pagina.vencida
+
+    async def devolver(self, pagina: PaginaMuisca, lista: bool):
+        """Devolver una página tomada con acquire_page(); `lista` = ya reciclada para otro NIT."""
+        self._in_use -= 1
+        if lista and self.reutilizable(pagina) and len(self._warm) < self.warm_pages:
+            self._warm.append(pagina)
+            self.page_stats["recycled"] += 1
+            return
+        await self._descartar(pagina)
+
+    async def _descartar(self, pagina: PaginaMuisca):
+        self.page_stats["evicted"] += 1
+        try:
+            await pagina.context.close()
+        except Exception:
+            pass
+
+    def _programar_relleno(self):
+        if self.warm_pages <= 0 or (self._refill_task and not self._refill_task.done()):
+            return
+        # Las páginas en uso cuentan: al terminar vuelven al pool
+        if len(self._warm) + self._warming + self._in_use < self.warm_pages:
+            self._refill_task = asyncio.ensure_future(self._rellenar())
+
+    async def _rellenar(self):
+        """Calentar páginas hasta warm_pages (una a la vez, no compite con las consultas)."""
+        while (len(self._warm) + self._in_use < self.warm_pages
+               and circuit_breaker.state == "CLOSED"):
+            self._warming += 1
+            pagina = None
+            try:
+                pagina = await self.new_page()
+                if not await _calentar(pagina):
+                    await self._descartar(pagina)
+                    return  # Bloqueo o error: no insistir hasta la próxima consulta
+                if pagina.generation != self._generation:
+                    await self._descartar(pagina)
+                    return
+                self._warm.append(pagina)
+                self.page_stats["warmed"] += 1
+            except asyncio.CancelledError:
+                if pagina:
+                    await self._descartar(pagina)
+                raise
+            except Exception as e:
+                logger.warning("[BrowserPool] Error calentando página: %s", str(e)[:100])
+                if pagina:
+                    await self._descartar(pagina)
+                return
+            finally:
+                self._warming -= 1
+
+    def stats(self) -> dict:
+        return {
+            "warm_pages": len(self._warm),
+            "warm_target": self.warm_pages,
+            "warming": self._warming,
+            "in_use": self._in_use,
+            **self.page_stats,
+            "requests_blocked": self.resource_stats["blocked"],
+            "requests_allowed": self.resource_stats["allowed"],
+        }
 
     async def _restart_browser(self):
         await self._start_playwright()
 
     async def shutdown(self):
+        if self._refill_task:
+            self._refill_task.cancel()
+        self._warm.clear()
         try:
             if self._browser:
                 await self._browser.close()
@@ -253,6 +449,155 @@ class CircuitBreaker:
 circuit_breaker = CircuitBreaker()
 
 
+# ═══════════════════════════════════════════════════════════════
+#  PRE-RESOLUCIÓN DE TURNSTILE
+# ═══════════════════════════════════════════════════════════════
+
+class TokenPrefetcher:
+    """
+    Cola de tokens Turnstile resueltos en segundo plano, para que una consulta
+    DIAN no espere los 5-30 s de CapSolver.
+
+    El tamaño objetivo sigue a la demanda: consultas por segundo de los
+    últimos TURNSTILE_DEMANDA_VENTANA s × tiempo medio de resolución (tokens
+    que se necesitarán mientras se resuelve uno nuevo), con tope `max_tokens`
+    y sin pasar de las consultas esperadas dentro de TURNSTILE_TOKEN_TTL. Con
+    tráfico escaso (menos de TURNSTILE_DEMANDA_MINIMA consultas en la ventana,
+    o menos de una esperada mientras el token vale) no se resuelve nada por
+    adelantado: el token vencería sin usarse y se pagaría igual. Un
+    trabajo masivo puede anunciar cuántas consultas viene a hacer con
+    anticipar(n) para tener tokens listos desde el primer NIT.
+    Los tokens que vencen (TURNSTILE_TOKEN_TTL) sin usarse cuentan como perdidos.
+    """
+
+    def __init__(self, max_tokens: int = TURNSTILE_PREFETCH_MAX):
+        self.max_tokens = max_tokens
+        # Se aprende de la primera página MUISCA (o se fija por entorno)
+        self.sitekey: str | None = os.getenv("TURNSTILE_SITEKEY") or None
+        self._tokens: deque[tuple[str, float]] = deque()  # (token, resuelto_en)
+        self._demanda: deque[float] = deque()
+        self._anticipadas = 0
+        self._anticipadas_en = 0.0
+        self._en_vuelo = 0
+        self._tiempo_resolucion = 15.0  # EWMA de segundos por token
+        self._task: asyncio.Task | None = None
+        self.counters = {"hits": 0, "misses": 0, "wasted": 0, "solved": 0, "failed": 0}
+
+    def _purgar(self):
+        ahora = time.time()
+        while self._tokens and ahora - self._tokens[0][1] >= TURNSTILE_TOKEN_TTL:
+            self._tokens.popleft()
+            self.counters["wasted"] += 1
+        while self._demanda and ahora - self._demanda[0] > TURNSTILE_DEMANDA_VENTANA:
+            self._demanda.popleft()
+        # Un masivo anunciado que dejó de consultar (cliente desconectado): olvidarlo
+        ultima = max(self._anticipadas_en, self._demanda[-1] if self._demanda else 0)
+        if self._anticipadas and ahora - ultima > TURNSTILE_DEMANDA_VENTANA:
+            self._anticipadas = 0
+
+    def objetivo(self) -> int:
+        """Tokens que conviene tener listos según la demanda reciente."""
+        if self.max_tokens <= 0 or not self.sitekey:
+            return 0
+        return min(self.max_tokens, max(self._estimado(), self._anticipadas))
+
+    def hay_demanda(self) -> bool:
+        """¿Un token resuelto ahora se usaría antes de vencer? (mismo criterio que objetivo)"""
+        self._purgar()
+        return self._anticipadas > 0 or self._estimado() > 0
+
+    def _estimado(self) -> int:
+        """Tokens que pide la demanda reciente (sin tope ni anticipadas)."""
+        por_segundo = len(self._demanda) / TURNSTILE_DEMANDA_VENTANA
+        # Consultas esperadas mientras un token recién resuelto sigue vigente:
+        # si no alcanza a 1, el token más probablemente vence sin usarse
+        esperadas = por_segundo * (TURNSTILE_TOKEN_TTL - self._tiempo_resolucion)
+        if len(self._demanda) < TURNSTILE_DEMANDA_MINIMA or esperadas < 1:
+            return 0
+        return min(math.ceil(por_segundo * self._tiempo_resolucion), math.floor(esperadas))
+
+    def anticipar(self, n: int):
+        """Avisar que vienen n consultas DIAN (p. ej. fase DIAN de un masivo)."""
+        self._anticipadas += n
+        self._anticipadas_en = time.time()
+        self._programar()
+
+    def tomar(self, sitekey: str, consulta: bool = True) -> tuple[str, float] | None:
+        """
+        (token, resuelto_en) vigente para este sitekey, o None si hay que resolver en línea.
+        consulta=False (calentar una página) no cuenta como demanda ni en la tasa de aciertos.
+        """
+        if sitekey != self.sitekey:
+            self.sitekey = sitekey
+            self._tokens.clear()
+        if consulta:
+            self._demanda.append(time.time())
+            self._anticipadas = max(0, self._anticipadas - 1)
+        self._purgar()
+        item = self._tokens.popleft() if self._tokens else None
+        if consulta:
+            self.counters["hits" if item else "misses"] += 1
+        self._programar()
+        return item
+
+    def _programar(self):
+        if self._task and not self._task.done():
+            return
+        if len(self._tokens) + self._en_vuelo < self.objetivo():
+            self._task = asyncio.ensure_future(self._rellenar())
+
+    async def _resolver_uno(self, sitekey: str):
+        self._en_vuelo += 1
+        inicio = time.time()
+        try:
+            token = await solve_turnstile(sitekey, DIAN_URL)
+        except Exception as e:
+            token = None
+            logger.debug("[Turnstile] Pre-resolución falló: %s", str(e)[:100])
+        finally:
+            self._en_vuelo -= 1
+        if not token:
+            self.counters["failed"] += 1
+            return False
+        duracion = time.time() - inicio
+        self._tiempo_resolucion = 0.8 * self._tiempo_resolucion + 0.2 * duracion
+        self.counters["solved"] += 1
+        if sitekey == self.sitekey:
+            self._tokens.append((token, time.time()))
+        return True
+
+    async def _rellenar(self):
+        """Resolver en paralelo los tokens que faltan para llegar al objetivo."""
+        while circuit_breaker.state == "CLOSED":
+            self._purgar()
+            faltan = self.objetivo() - len(self._tokens) - self._en_vuelo
+            if faltan <= 0:
+                return
+            resultados = await asyncio.gather(*(self._resolver_uno(self.sitekey) for _ in range(faltan)))
+            if not any(resultados):
+                return  # CapSolver falla: no insistir hasta la próxima consulta
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    def stats(self) -> dict:
+        self._purgar()
+        usados = self.counters["hits"] + self.counters["misses"]
+        return {
+            "queued": len(self._tokens),
+            "in_flight": self._en_vuelo,
+            "target": self.objetivo(),
+            "avg_solve_seconds": round(self._tiempo_resolucion, 1),
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / usados, 3) if usados else 0.0,
+        }
+
+
+token_prefetcher = TokenPrefetcher()
+
+
 # ═══════════════════════════════════════════════════════════════
 #  DETECCIÓN DE BLOQUEO
 # ═══════════════════════════════════════════════════════════════
@@ -322,6 +667,120 @@ async def _inject_turnstile_token(page: Page, token: str):
     """, token)
 
 
+async def _abrir_formulario(pagina: PaginaMuisca, nit: str = "") -> str | None:
+    """Navegar al formulario MUISCA. Retorna el motivo de bloqueo o None."""
+    page = pagina.page
+    logger.info("[DIAN %s] Navegando a %s", nit, DIAN_URL)
+    response = await page.goto(DIAN_URL, wait_until="domcontentloaded", timeout=45000)
+    logger.info("[DIAN %s] Respuesta HTTP %s", nit, response.status if response else "None")
+
+    if response and response.status in (403, 503, 429):
+        return f"HTTP {response.status}"
+
+    block = await _check_page_blocked(page)
+    if block:
+        return block
+
+    pagina.sitekey = await _extract_turnstile_sitekey(page)
+    pagina.navigated = True
+    logger.info("[DIAN %s] Turnstile sitekey: %s", nit, pagina.sitekey[:20] if pagina.sitekey else "None")
+    return None
+
+
+async def _resolver_turnstile(pagina: PaginaMuisca, nit: str = "", consulta: bool = True) -> bool:
+    """Resolver e inyectar Turnstile si la página lo tiene y no hay token vigente."""
+    if not pagina.sitekey or pagina.token_vigente:
+        return True
+    prefetch = token_prefetcher.tomar(pagina.sitekey, consulta)
+    if prefetch:
+        token, resuelto_en = prefetch
+        logger.info("[DIAN %s] CAPTCHA desde cola pre-resuelta", nit)
+    else:
+        token, resuelto_en = await solve_turnstile(pagina.sitekey, DIAN_URL), time.time()
+        logger.info("[DIAN %s] CAPTCHA resuelto: %s", nit, "OK" if token else "FAIL")
+    if not token:
+        return False
+    await _inject_turnstile_token(pagina.page, token)
+    await asyncio.sleep(TURNSTILE_ESPERA)
+    pagina.token_at = resuelto_en  # La vigencia corre desde que se resolvió
+    pagina.ultimo_token = token
+    return True
+
+
+async def _calentar(pagina: PaginaMuisca) -> bool:
+    """
+    Dejar una página sobre el formulario y, si hay demanda, con Turnstile
+    resuelto. Con tráfico escaso (token_prefetcher.hay_demanda) no se paga
+    CapSolver: el token vencería antes de la siguiente consulta.
+    """
+    block = await _abrir_formulario(pagina, "warm")
+    if block:
+        logger.warning("[BrowserPool] Bloqueo al calentar página: %s", block)
+        return False
+    if DIAN_WARM_TURNSTILE and pagina.sitekey and not token_prefetcher.hay_demanda():
+        browser_pool.page_stats["warm_token_skipped"] += 1
+    elif DIAN_WARM_TURNSTILE:
+        try:
+            await _resolver_turnstile(pagina, "warm", consulta=False)
+        except Exception as e:
+            # Sin token la página sigue sirviendo: se resuelve al consultar
+            logger.debug("[BrowserPool] Turnstile al calentar falló: %s", str(e)[:100])
+    return True
+
+
+async def _pagina_sana(pagina: PaginaMuisca) -> bool:
+    """Chequeo rápido de una página tibia: abierta y con el campo NIT presente."""
+    try:
+        if pagina.page.is_closed():
+            return False
+        return await pagina.page.query_selector(SEL_NIT_INPUT) is not None
+    except Exception:
+        return False
+
+
+async def _limpiar_formulario(pagina: PaginaMuisca) -> bool:
+    """Dejar el formulario listo para otro NIT. False si ya no está usable."""
+    try:
+        if await _check_page_blocked(pagina.page):
+            return False
+        await pagina.page.fill(SEL_NIT_INPUT, "", timeout=5000)
+        return True
+    except Exception as e:
+        logger.debug("[BrowserPool] No se pudo limpiar el formulario: %s", str(e)[:100])
+        return False
+
+
+async def _token_en_pagina(pagina: PaginaMuisca) -> bool:
+    """¿El widget Turnstile ya trae un token nuevo (sesión validada, sin CapSolver)?"""
+    try:
+        valor = await pagina.page.input_value(SEL_TURNSTILE_INPUT, timeout=1000)
+    except Exception:
+        return False
+    return bool(valor) and valor != pagina.ultimo_token
+
+
+async def _reciclar(pagina: PaginaMuisca) -> bool:
+    """
+    Preparar la página para el siguiente NIT tras un submit: limpiar el
+    formulario y volver a mirar Turnstile. Si tras el postback el formulario
+    ya no pide CAPTCHA, o el widget se resolvió solo, el siguiente NIT no
+    paga CapSolver.
+    """
+    pagina.uses += 1
+    pagina.token_at = 0  # El submit consumió el token inyectado
+    if pagina.vencida or not await _limpiar_formulario(pagina):
+        return False
+    try:
+        pagina.sitekey = await _extract_turnstile_sitekey(pagina.page)
+    except Exception:
+        return False
+    if not pagina.sitekey or await _token_en_pagina(pagina):
+        if pagina.sitekey:
+            pagina.token_at = time.time()
+        browser_pool.page_stats["captcha_reused"] += 1
+    return True
+
+
 async def _parse_resultado(page: Page) -> dict:
     """Parsear la página de resultado después del submit."""
     result = {
@@ -470,127 +929,202 @@ async def consultar_dian(nit: str) -> dict:
             "_circuit_open": True,
         }
 
+    # Consulta masiva: reusar la página de la sesión del worker
+    sesion = sesion_actual.get()
+    if sesion is not None:
+        return await sesion.consultar(nit)
+
     # Semáforo: limita consultas DIAN concurrentes (Chromium es pesado)
     async with browser_pool.semaphore:
-        context = await browser_pool.get_context()
-        page = await context.new_page()
-
+        pagina = await browser_pool.acquire_page()
+        reusable = False
         try:
-            # 1. Navegar al portal
-            logger.info("[DIAN %s] Navegando a %s", nit, DIAN_URL)
-            response = await page.goto(DIAN_URL, wait_until="domcontentloaded", timeout=45000)
-            logger.info("[DIAN %s] Respuesta HTTP %s", nit, response.status if response else "None")
+            result, reusable = await _consultar_en_pagina(pagina, nit)
+            return result
+        finally:
+            await browser_pool.release_page(pagina, reusable)
 
-            # 2. Verificar bloqueo inmediato
-            if response and response.status in (403, 503, 429):
-                circuit_breaker.record_failure(f"HTTP {response.status}")
-                return {"nit": nit, "error": f"DIAN respondió HTTP {response.status}", "fuente": "DIAN MUISCA"}
 
-            block = await _check_page_blocked(page)
+async def _consultar_en_pagina(pagina: PaginaMuisca, nit: str) -> tuple[dict, bool]:
+    """Consultar un NIT en una página del pool. Retorna (resultado, página reutilizable)."""
+    page = pagina.page
+    reusable = False
+    try:
+        # 1-2. Navegar al portal y verificar bloqueo (las páginas tibias ya están ahí)
+        if not pagina.navigated:
+            block = await _abrir_formulario(pagina, nit)
             if block:
                 logger.warning("[DIAN %s] Bloqueado: %s", nit, block)
                 circuit_breaker.record_failure(block)
-                return {"nit": nit, "error": block, "fuente": "DIAN MUISCA"}
-
-            # 3. Buscar y resolver Turnstile
-            sitekey = await _extract_turnstile_sitekey(page)
-            logger.info("[DIAN %s] Turnstile sitekey: %s", nit, sitekey[:20] if sitekey else "None")
-            if sitekey:
-                token = await solve_turnstile(sitekey, DIAN_URL)
-                logger.info("[DIAN %s] CAPTCHA resuelto: %s", nit, "OK" if token else "FAIL")
-                if token:
-                    await _inject_turnstile_token(page, token)
-                    await asyncio.sleep(2)
-                else:
-                    circuit_breaker.record_failure("CAPTCHA no resuelto")
-                    return {"nit": nit, "error": "No se pudo resolver el CAPTCHA", "fuente": "DIAN MUISCA"}
-
-            # 4. Esperar a que el campo NIT esté visible y llenar
-            logger.info("[DIAN %s] Buscando campo NIT...", nit)
+                error = f"DIAN respondió {block}" if block.startswith("HTTP ") else block
+                return {"nit": nit, "error": error, "fuente": "DIAN MUISCA"}, False
+
+        # 3. Resolver Turnstile (si la página tibia ya tiene token vigente, no espera)
+        if not await _resolver_turnstile(pagina, nit):
+            circuit_breaker.record_failure("CAPTCHA no resuelto")
+            return {"nit": nit, "error": "No se pudo resolver el CAPTCHA", "fuente": "DIAN MUISCA"}, False
+
+        # 4. Esperar a que el campo NIT esté visible y llenar
+        logger.info("[DIAN %s] Buscando campo NIT...", nit)
+        try:
+            await page.wait_for_selector(SEL_NIT_INPUT, state="visible", timeout=15000)
+            logger.info("[DIAN %s] Campo NIT encontrado", nit)
+        except Exception as wait_err:
+            # Diagnosticar: qué ve realmente el browser
             try:
-                await page.wait_for_selector(SEL_NIT_INPUT, state="visible", timeout=15000)
-                logger.info("[DIAN %s] Campo NIT encontrado", nit)
-            except Exception as wait_err:
-                # Diagnosticar: qué ve realmente el browser
-                try:
-                    title = await page.title()
-                    url = page.url
-                    html_snippet = (await page.content())[:500]
-                    logger.warning("[DIAN %s] Campo NIT no encontrado. title=%s url=%s html=%s",
-                                   nit, title, url, html_snippet)
-                except Exception:
-                    logger.warning("[DIAN %s] Campo NIT no encontrado: %s", nit, str(wait_err)[:100])
-                alt_selectors = [
-                    'input[id*="numNit"]',
-                    'input[type="text"][maxlength]',
-                    'input[name*="nit" i]',
-                ]
-                found = False
-                for sel in alt_selectors:
-                    el = await page.query_selector(sel)
-                    if el:
-                        await el.fill(nit)
-                        await page.keyboard.press("Enter")
-                        found = True
-                        break
-                if not found:
-                    return {"nit": nit, "error": "No se encontró el campo de NIT en la DIAN", "fuente": "DIAN MUISCA"}
-                result = await _parse_resultado(page)
-                result["nit"] = nit
-                result["fuente"] = "DIAN MUISCA"
-                if not result.get("error"):
-                    circuit_breaker.record_success()
-                return result
-
-            await page.fill(SEL_NIT_INPUT, nit)
-            await page.keyboard.press("Enter")
-            logger.info("[DIAN %s] NIT enviado, esperando resultado...", nit)
-
-            # 5. Parsear resultado
+                title = await page.title()
+                url = page.url
+                html_snippet = (await page.content())[:500]
+                logger.warning("[DIAN %s] Campo NIT no encontrado. title=%s url=%s html=%s",
+                               nit, title, url, html_snippet)
+            except Exception:
+                logger.warning("[DIAN %s] Campo NIT no encontrado: %s", nit, str(wait_err)[:100])
+            alt_selectors = [
+                'input[id*="numNit"]',
+                'input[type="text"][maxlength]',
+                'input[name*="nit" i]',
+            ]
+            found = False
+            for sel in alt_selectors:
+                el = await page.query_selector(sel)
+                if el:
+                    await el.fill(nit)
+                    await page.keyboard.press("Enter")
+                    found = True
+                    break
+            if not found:
+                return {"nit": nit, "error": "No se encontró el campo de NIT en la DIAN", "fuente": "DIAN MUISCA"}, False
             result = await _parse_resultado(page)
             result["nit"] = nit
             result["fuente"] = "DIAN MUISCA"
-            logger.info("[DIAN %s] Resultado: estado=%s, nombre=%s, error=%s",
-                        nit, result.get("estado_rut", ""), result.get("razon_social", "")[:50], result.get("error", ""))
-
-            # 6. Circuit breaker: registrar éxito o fallo
-            if result.get("_blocked"):
-                circuit_breaker.record_failure(result.get("error", "Blocked"))
-                del result["_blocked"]
-            elif result.get("error") and "timeout" in result["error"].lower():
-                circuit_breaker.record_failure(result["error"])
-            else:
+            if not result.get("error"):
                 circuit_breaker.record_success()
+            return result, False
+
+        await page.fill(SEL_NIT_INPUT, nit)
+        await page.keyboard.press("Enter")
+        logger.info("[DIAN %s] NIT enviado, esperando resultado...", nit)
+
+        # 5. Parsear resultado
+        result = await _parse_resultado(page)
+        result["nit"] = nit
+        result["fuente"] = "DIAN MUISCA"
+        logger.info("[DIAN %s] Resultado: estado=%s, nombre=%s, error=%s",
+                    nit, result.get("estado_rut", ""), result.get("razon_social", "")[:50], result.get("error", ""))
+
+        # 6. Circuit breaker: registrar éxito o fallo
+        if result.get("_blocked"):
+            circuit_breaker.record_failure(result.get("error", "Blocked"))
+            del result["_blocked"]
+        elif result.get("error") and "timeout" in result["error"].lower():
+            circuit_breaker.record_failure(result["error"])
+        else:
+            circuit_breaker.record_success()
+            # La página sigue sobre el formulario: se recicla para el siguiente NIT
+            reusable = True
 
-            return result
+        return result, reusable
 
-        except Exception as e:
-            error_msg = str(e)[:200]
-            logger.error("[DIAN %s] EXCEPCIÓN: %s", nit, error_msg)
-            circuit_breaker.record_failure(error_msg)
-            return {
-                "nit": nit,
-                "error": f"Error al consultar DIAN: {error_msg}",
-                "fuente": "DIAN MUISCA",
-            }
+    except Exception as e:
+        error_msg = str(e)[:200]
+        logger.error("[DIAN %s] EXCEPCIÓN: %s", nit, error_msg)
+        circuit_breaker.record_failure(error_msg)
+        return {
+            "nit": nit,
+            "error": f"Error al consultar DIAN: {error_msg}",
+            "fuente": "DIAN MUISCA",
+        }, False
+
+
+class SesionMuisca:
+    """
+    Una página MUISCA fija para consultar muchos NITs seguidos (consultas masivas).
+    Tras cada resultado se limpia el formulario y se envía el siguiente NIT en
+    la misma página; si Turnstile no vuelve a pedir token, el CAPTCHA se paga
+    una vez por sesión y no por NIT. Solo cuando el formulario se rompe o hay
+    bloqueo se descarta la página y el siguiente NIT abre una nueva.
+    Ocupa un cupo del semáforo del pool mientras está abierta.
+
+    Si la sesión se cierra por una excepción o cancelación (p. ej. el cliente
+    cortó el streaming) la página no vuelve al pool tibio: se descarta. Y si
+    en ese momento hay una consulta en curso (sigue viva, protegida por el
+    single-flight de main), la página y el cupo los suelta esa consulta al
+    terminar, para que nadie más use la página mientras tanto.
+    """
+
+    def __init__(self):
+        self.pagina: PaginaMuisca | None = None
+        self.consultas = 0
+        self.renovaciones = 0
+        self._ocupada = False
+        self._cerrada = False
+
+    async def __aenter__(self):
+        await browser_pool.semaphore.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, *exc):
+        self._cerrada = True
+        if self._ocupada:
+            return  # La consulta en curso suelta página y cupo al terminar
+        await self._soltar(lista=exc_type is None)
+
+    async def _soltar(self, lista: bool):
+        try:
+            if self.pagina is not None:
+                pagina, self.pagina = self.pagina, None
+                await browser_pool.devolver(pagina, lista)
         finally:
-            await context.close()
+            browser_pool.semaphore.release()
+
+    async def consultar(self, nit: str) -> dict:
+        if self.pagina is None:
+            self.pagina = await browser_pool.acquire_page()
+        pagina = self.pagina
+        self._ocupada = True
+        try:
+            result, reusable = await _consultar_en_pagina(pagina, nit)
+            self.consultas += 1
+            browser_pool.page_stats["session_lookups"] += 1
+            if self._cerrada or not (reusable and browser_pool.reutilizable(pagina) and await _reciclar(pagina)):
+                # Formulario roto, bloqueo o sesión cerrada: el siguiente NIT arranca con página nueva
+                self.pagina = None
+                self.renovaciones += 1
+                browser_pool.page_stats["session_renewals"] += 1
+                await browser_pool.devolver(pagina, lista=False)
+            return result
+        finally:
+            self._ocupada = False
+            if self._cerrada:
+                await self._soltar(lista=False)
+
+
+# Sesión del worker masivo actual: consultar_dian la usa si está definida
+sesion_actual: contextvars.ContextVar[SesionMuisca | None] = contextvars.ContextVar("sesion_muisca", default=None)
 
 
 async def consultar_dian_batch(nits: list[str], max_concurrent: int = 3) -> list[dict]:
-    """Consultar múltiples NITs con límite de concurrencia y respeto al circuit breaker."""
-    semaphore = asyncio.Semaphore(max_concurrent)
-
-    async def _limited(nit):
-        async with semaphore:
-            # Si el circuito se abrió durante el batch, no seguir golpeando
-            if not circuit_breaker.can_request():
-                return {
-                    "nit": nit,
-                    "error": "DIAN pausada durante consulta masiva",
-                    "fuente": "DIAN MUISCA (pausado)",
-                }
-            return await consultar_dian(nit)
-
-    tasks = [_limited(nit) for nit in nits]
-    return await asyncio.gather(*tasks)
+    """
+    Consultar múltiples NITs con límite de concurrencia y respeto al circuit breaker.
+    Cada worker mantiene una sesión MUISCA y consulta sus NITs en la misma página.
+    """
+    pendientes = deque(enumerate(nits))
+    resultados: list[dict | None] = [None] * len(nits)
+
+    async def _worker():
+        async with SesionMuisca() as sesion:
+            sesion_actual.set(sesion)
+            while pendientes:
+                i, nit = pendientes.popleft()
+                # Si el circuito se abrió durante el batch, no seguir golpeando
+                if not circuit_breaker.can_request():
+                    resultados[i] = {
+                        "nit": nit,
+                        "error": "DIAN pausada durante consulta masiva",
+                        "fuente": "DIAN MUISCA (pausado)",
+                    }
+                    continue
+                resultados[i] = await consultar_dian(nit)
+
+    await asyncio.gather(*(_worker() for _ in range(min(max_concurrent, len(nits)))))
+    return resultados
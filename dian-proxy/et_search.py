@@ -12,9 +12,10 @@ import os
 import re
 from pathlib import Path
 
-import httpx
 import numpy as np
 
+from http_clients import get_client
+
 logger = logging.getLogger("exogenadian.et_search")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
@@ -154,18 +155,19 @@ class ETSearchEngine:
     async def _embed_query(self, text: str) -> list[float] | None:
         """Genera embedding para una consulta."""
         try:
-            async with httpx.AsyncClient(timeout=10.0) as client:
-                resp = await client.post(
-                    f"{EMBED_URL}?key={GEMINI_API_KEY}",
-                    json={
-                        "model": f"models/{EMBEDDING_MODEL}",
-                        "content": {"parts": [{"text": text}]},
-                    },
-                )
-                if resp.status_code != 200:
-                    logger.error("Embedding API error %s: %s", resp.status_code, resp.text[:200])
-                    return None
-                return resp.json()["embedding"]["values"]
+            client = get_client("llm")
+            resp = await client.post(
+                f"{EMBED_URL}?key={GEMINI_API_KEY}",
+                timeout=10.0,
+                json={
+                    "model": f"models/{EMBEDDING_MODEL}",
+                    "content": {"parts": [{"text": text}]},
+                },
+            )
+            if resp.status_code != 200:
+                logger.error("Embedding API error %s: %s", resp.status_code, resp.text[:200])
+                return None
+            return resp.json()["embedding"]["values"]
         except Exception as e:
             logger.error("Error generando embedding de consulta: %s", e)
             return None
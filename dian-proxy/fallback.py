@@ -1,12 +1,23 @@
 """
 Fuentes de fallback para cuando DIAN MUISCA no responde.
 Consulta en cascada: RegistroNIT → datos.gov.co → Einforma → DuckDuckGo.
+Para consultas masivas, buscar_datos_gov_lote resuelve datos.gov.co por bloques.
 """
 import asyncio
+import contextvars
 import logging
-import re
+import os
+import time
+from dataclasses import dataclass, field
+
 import httpx
 
+from http_clients import get_client
+from parsers import (
+    RE_DIR_COMERCIAL, RE_DIR_ETIQUETA, RE_ESTADO, RE_H1, RE_H1_NOMBRE, RE_NO_DIGITOS,
+    RE_SUFIJO_SITIO, RE_TITLE, html_a_texto, patrones_razon_social, primera_cerca_del_nit,
+)
+
 logger = logging.getLogger("exogenadian.fallback")
 
 HEADERS = {
@@ -15,6 +26,155 @@ HEADERS = {
     "Accept-Language": "es-CO,es;q=0.9",
 }
 
+# Segundos que se espera a una fuente de mayor prioridad antes de aceptar
+# el resultado de una de menor prioridad que ya respondió
+FALLBACK_HEDGE_DELAY = float(os.getenv("FALLBACK_HEDGE_DELAY", "2.0"))
+fallback_stats = {"races": 0, "hedged_wins": 0, "cancelled": 0, "no_answer": 0, "pool_timeouts": 0}
+
+# Resultado cuando ninguna fuente respondió (caídas, timeouts o circuito abierto):
+# a diferencia de "No encontrado", no dice nada del NIT y no se guarda en la caché negativa
+NO_ENCONTRADO = "No encontrado"
+SIN_RESPUESTA = "Sin respuesta"
+
+# Fuentes que respondieron (aunque sea sin el NIT) en la consulta en curso; lo llena _get
+_respondieron: contextvars.ContextVar[set | None] = contextvars.ContextVar("fallback_respondieron", default=None)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  SALUD POR FUENTE (EWMA + circuit breaker)
+# ═══════════════════════════════════════════════════════════════
+
+@dataclass
+class SaludFuente:
+    """
+    Salud de una fuente de fallback, medida por petición HTTP.
+    Fallo = excepción/timeout o HTTP 403, 429, 5xx ("no encontrado" es sano).
+    Como el CircuitBreaker de la DIAN: tras failure_threshold fallos seguidos
+    la fuente se salta (OPEN) durante el cooldown, luego se prueba (HALF_OPEN).
+    Con tasa de éxito EWMA baja la fuente se corre al final de la prioridad.
+    """
+    nombre: str
+    state: str = "CLOSED"           # CLOSED | OPEN | HALF_OPEN
+    failures: int = 0               # Fallos consecutivos
+    failure_threshold: int = 5
+    opened_at: float = 0
+    cooldown_seconds: float = 300   # 5 minutos inicial
+    max_cooldown: float = 3600      # 1 hora máximo
+    alpha: float = 0.2              # Peso de la última muestra en los EWMA
+    success_ewma: float = 1.0
+    latency_ewma: float = 0.0
+    requests: int = 0
+    skipped: int = 0
+    last_error: str = ""
+    probe_timeout: float = 30       # Si la prueba no reporta (p. ej. cancelada), permitir otra
+    _probe_at: float = field(default=0.0, repr=False)
+
+    @property
+    def degraded(self) -> bool:
+        return self.success_ewma < 0.5
+
+    def can_request(self) -> bool:
+        if self.state == "CLOSED":
+            return True
+        if self.state == "OPEN":
+            if time.time() - self.opened_at < self.cooldown_seconds:
+                return False
+            self.state = "HALF_OPEN"
+            self._probe_at = 0.0
+        # HALF_OPEN: una sola consulta de prueba a la vez
+        now = time.time()
+        if now - self._probe_at < self.probe_timeout:
+            return False
+        self._probe_at = now
+        return True
+
+    def _muestra(self, ok: bool, latency: float):
+        self.requests += 1
+        self.success_ewma += self.alpha * (float(ok) - self.success_ewma)
+        if self.latency_ewma == 0.0:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma += self.alpha * (latency - self.latency_ewma)
+
+    def record_success(self, latency: float):
+        self._muestra(True, latency)
+        self.failures = 0
+        if self.state == "HALF_OPEN":
+            self.state = "CLOSED"
+            self.cooldown_seconds = 300
+            logger.info("[Fallback %s] Recuperada", self.nombre)
+
+    def record_failure(self, latency: float, error: str = ""):
+        self._muestra(False, latency)
+        self.failures += 1
+        self.last_error = error[:200]
+        if self.state == "HALF_OPEN":
+            self.state = "OPEN"
+            self.opened_at = time.time()
+            self.cooldown_seconds = min(self.cooldown_seconds * 2, self.max_cooldown)
+        elif self.state == "CLOSED" and self.failures >= self.failure_threshold:
+            self.state = "OPEN"
+            self.opened_at = time.time()
+            logger.warning("[Fallback %s] Circuito abierto por %ds: %s",
+                           self.nombre, self.cooldown_seconds, self.last_error)
+
+    def get_status(self) -> dict:
+        info = {
+            "state": self.state,
+            "failures": self.failures,
+            "success_ewma": round(self.success_ewma, 3),
+            "latency_ewma_ms": int(self.latency_ewma * 1000),
+            "degraded": self.degraded,
+            "requests": self.requests,
+            "skipped": self.skipped,
+            "last_error": self.last_error,
+        }
+        if self.state == "OPEN":
+            info["retry_in_seconds"] = max(0, int(self.cooldown_seconds - (time.time() - self.opened_at)))
+        return info
+
+
+def _nueva_salud() -> dict[str, SaludFuente]:
+    return {n: SaludFuente(n) for n in ("registronit", "datos_gov", "einforma", "web")}
+
+
+salud_fuentes = _nueva_salud()
+
+
+def estado_fuentes() -> dict:
+    """Estado de salud de cada fuente, para /api/health (admin)."""
+    return {n: s.get_status() for n, s in salud_fuentes.items()}
+
+
+async def _get(fuente: str, url: str, **kwargs) -> httpx.Response:
+    """GET por el pool de la fuente, registrando latencia y resultado en la salud de la fuente."""
+    salud = salud_fuentes[fuente]
+    t0 = time.monotonic()
+    try:
+        resp = await get_client(fuente).get(url, **kwargs)
+    except asyncio.CancelledError:
+        raise  # Cancelada por la carrera: no es culpa de la fuente
+    except httpx.PoolTimeout:
+        # Sin conexión libre en nuestro pool: saturación local, la fuente ni se enteró
+        fallback_stats["pool_timeouts"] += 1
+        raise
+    except Exception as e:
+        salud.record_failure(time.monotonic() - t0, f"{type(e).__name__}: {e}")
+        raise
+    if resp.status_code in (403, 429) or resp.status_code >= 500:
+        salud.record_failure(time.monotonic() - t0, f"HTTP {resp.status_code}")
+    else:
+        salud.record_success(time.monotonic() - t0)
+        marcar_respuesta(fuente)
+    return resp
+
+
+def marcar_respuesta(fuente: str):
+    """Registrar que `fuente` contestó en la consulta en curso (ver consultar_fallback)."""
+    respondieron = _respondieron.get()
+    if respondieron is not None:
+        respondieron.add(fuente)
+
 
 def _calc_dv(nit: str) -> int:
     """Calcular dígito de verificación DIAN (módulo 11)."""
@@ -29,120 +189,211 @@ def _calc_dv(nit: str) -> int:
 async def buscar_registronit(nit: str) -> dict | None:
     """Consultar registronit.com — directorio público de NITs colombianos."""
     try:
-        async with httpx.AsyncClient(timeout=12, follow_redirects=True) as client:
-            resp = await client.get(
-                f"https://www.registronit.com/{nit}",
-                headers=HEADERS,
-            )
-            if resp.status_code != 200:
-                return None
-
-            texto = resp.text
-            info = {"nit": nit, "fuente": "RegistroNIT"}
-
-            # Razón social desde <h1>
-            h1 = re.findall(r'<h1[^>]*>([^<]+)</h1>', texto, re.IGNORECASE)
-            if h1:
-                rs = h1[0].strip()
-                if len(rs) > 3 and "no encontrado" not in rs.lower():
-                    info["razon_social"] = rs.upper()
-
-            # Dirección comercial
-            dir_match = re.search(
-                r'[Dd]irecci[oó]n\s+comercial\s+es\s+([^.]{5,100})',
-                texto,
-            )
-            if dir_match:
-                info["direccion"] = dir_match.group(1).strip().rstrip(".")
-
-            # Estado — NO confiable desde fuentes externas, solo informativo
-            # Solo DIAN MUISCA es fuente oficial del estado del RUT
-            estado_match = re.search(r'en\s+estado\s+(ACTIVA|CANCELADA|INACTIVA)', texto, re.IGNORECASE)
-            if estado_match:
-                raw_estado = estado_match.group(1).upper()
-                # Normalizar terminación femenina → masculina (DIAN usa masculino)
-                estado_map = {"ACTIVA": "ACTIVO", "CANCELADA": "CANCELADO", "INACTIVA": "INACTIVO"}
-                info["estado_rut"] = estado_map.get(raw_estado, raw_estado)
-                info["_estado_no_oficial"] = True  # Marcar como no verificado en DIAN
-
-            if info.get("razon_social"):
-                info["dv"] = _calc_dv(nit)
-                return info
+        resp = await _get(
+            "registronit",
+            f"https://www.registronit.com/{nit}",
+            timeout=12, follow_redirects=True,
+            headers=HEADERS,
+        )
+        if resp.status_code != 200:
+            return None
+
+        texto = resp.text
+        info = {"nit": nit, "fuente": "RegistroNIT"}
+
+        # Razón social desde <h1>
+        h1 = RE_H1.findall(texto)
+        if h1:
+            rs = h1[0].strip()
+            if len(rs) > 3 and "no encontrado" not in rs.lower():
+                info["razon_social"] = rs.upper()
+
+        # Dirección comercial
+        dir_match = RE_DIR_COMERCIAL.search(texto)
+        if dir_match:
+            info["direccion"] = dir_match.group(1).strip().rstrip(".")
+
+        # Estado — NO confiable desde fuentes externas, solo informativo
+        # Solo DIAN MUISCA es fuente oficial del estado del RUT
+        estado_match = RE_ESTADO.search(texto)
+        if estado_match:
+            raw_estado = estado_match.group(1).upper()
+            # Normalizar terminación femenina → masculina (DIAN usa masculino)
+            estado_map = {"ACTIVA": "ACTIVO", "CANCELADA": "CANCELADO", "INACTIVA": "INACTIVO"}
+            info["estado_rut"] = estado_map.get(raw_estado, raw_estado)
+            info["_estado_no_oficial"] = True  # Marcar como no verificado en DIAN
+
+        if info.get("razon_social"):
+            info["dv"] = _calc_dv(nit)
+            return info
     except Exception as e:
         logger.debug("registronit.com lookup failed for %s: %s", nit, e)
     return None
 
 
+# Datasets de datos.gov.co y columnas donde buscar el NIT, en orden de prioridad
+DATOS_GOV_DATASETS = [
+    # Base de datos de NITs empresas con actividad comercial (Confecámaras)
+    ("rtt5-cgkk", ["nit"]),
+    # Base de datos NIT y Actividad Económica
+    ("cas9-r54x", ["nit"]),
+    # Dataset Pymes (original)
+    ("gskn-y6cz", ["nit", "identificacion"]),
+]
+DATOS_GOV_LOTE = 100  # NITs por consulta SoQL en modo masivo
+DATOS_GOV_CONCURRENCIA = 4  # Consultas simultáneas por dataset en modo masivo
+
+
+async def _probar_dataset(dataset_id: str, campos: list[str], clean_nit: str) -> dict | None:
+    where_clause = " OR ".join(f"{c}='{clean_nit}'" for c in campos)
+    try:
+        resp = await _get(
+            "datos_gov",
+            f"https://www.datos.gov.co/resource/{dataset_id}.json",
+            params={"$where": where_clause, "$limit": 5},
+            headers=HEADERS,
+        )
+        if resp.status_code == 200:
+            data = resp.json()
+            if data and isinstance(data, list) and len(data) > 0:
+                return _extraer_info_dict(data[0], "datos.gov.co", dataset_id)
+    except Exception as e:
+        logger.debug("datos.gov.co %s failed for %s: %s", dataset_id, clean_nit, e)
+    return None
+
+
 async def buscar_datos_gov(nit: str) -> dict | None:
-    """Consultar datos.gov.co — múltiples datasets de empresas colombianas."""
-    clean_nit = re.sub(r'[^0-9]', '', nit)
-    datasets = [
-        # Base de datos de NITs empresas con actividad comercial (Confecámaras)
-        ("rtt5-cgkk", f"nit='{clean_nit}'"),
-        # Base de datos NIT y Actividad Económica
-        ("cas9-r54x", f"nit='{clean_nit}'"),
-        # Dataset Pymes (original)
-        ("gskn-y6cz", f"nit='{clean_nit}' OR identificacion='{clean_nit}'"),
-    ]
+    """
+    Consultar datos.gov.co — múltiples datasets de empresas colombianas.
+    Los datasets se consultan a la vez; gana el primero que encuentre el NIT
+    y los demás se cancelan (el orden de DATOS_GOV_DATASETS desempata).
+    """
+    clean_nit = RE_NO_DIGITOS.sub('', nit)
     try:
-        async with httpx.AsyncClient(timeout=15) as client:
-            for dataset_id, where_clause in datasets:
-                try:
-                    resp = await client.get(
-                        f"https://www.datos.gov.co/resource/{dataset_id}.json",
-                        params={"$where": where_clause, "$limit": 5},
-                        headers=HEADERS,
-                    )
-                    if resp.status_code == 200:
-                        data = resp.json()
-                        if data and isinstance(data, list) and len(data) > 0:
-                            return _extraer_info_dict(data[0], "datos.gov.co")
-                except Exception:
-                    continue
+        return await _carrera_priorizada(
+            [_probar_dataset(d, campos, clean_nit) for d, campos in DATOS_GOV_DATASETS],
+            hedge_delay=0,
+            stats=None,
+        )
     except Exception as e:
         logger.debug("datos.gov.co lookup failed for %s: %s", nit, e)
     return None
 
 
-async def buscar_einforma(nit: str) -> dict | None:
-    """Consultar Einforma.co para información de la empresa."""
+async def buscar_datos_gov_lote(nits: list[str]) -> tuple[dict[str, dict], set[str]]:
+    """
+    Resolver muchos NITs contra datos.gov.co con pocas consultas:
+    `$where nit in (...)` por bloques de DATOS_GOV_LOTE, dataset por dataset,
+    pasando al siguiente solo con los que faltan. Retorna ({nit: info} con los
+    que tienen razón social, NITs sin respuesta): los segundos estaban en un
+    bloque que falló (HTTP/SoQL/timeout), así que datos.gov.co no dijo nada de
+    ellos y hay que volver a consultarlos por NIT.
+    """
+    pendientes = {RE_NO_DIGITOS.sub('', n) for n in nits} - {""}
+    todos = set(pendientes)
+    encontrados: dict[str, dict] = {}
+    sin_respuesta: set[str] = set()
+    semaforo = asyncio.Semaphore(DATOS_GOV_CONCURRENCIA)
+
+    async def _bloque(dataset_id, campos, bloque) -> list | None:
+        lista = ",".join(f"'{n}'" for n in bloque)
+        where_clause = " OR ".join(f"{c} in ({lista})" for c in campos)
+        async with semaforo:
+            try:
+                resp = await _get(
+                    "datos_gov",
+                    f"https://www.datos.gov.co/resource/{dataset_id}.json",
+                    params={"$where": where_clause, "$limit": len(bloque) * 5},
+                    headers=HEADERS,
+                    timeout=30,
+                )
+                if resp.status_code == 200:
+                    data = resp.json()
+                    if isinstance(data, list):
+                        return data
+                logger.debug("datos.gov.co lote %s: HTTP %s", dataset_id, resp.status_code)
+            except Exception as e:
+                logger.debug("datos.gov.co lote %s failed: %s", dataset_id, e)
+        return None
+
     try:
-        async with httpx.AsyncClient(timeout=12, follow_redirects=True) as client:
-            resp = await client.get(
-                f"https://www.einforma.co/servlet/app/portal/ENTP/prod/ETIQUETA_EMPRESA_498/nif/{nit}",
-                headers=HEADERS,
+        for dataset_id, campos in DATOS_GOV_DATASETS:
+            if not pendientes:
+                break
+            lista = sorted(pendientes)
+            bloques = [lista[i:i + DATOS_GOV_LOTE] for i in range(0, len(lista), DATOS_GOV_LOTE)]
+            respuestas = await asyncio.gather(
+                *[_bloque(dataset_id, campos, b) for b in bloques]
             )
-            if resp.status_code != 200:
-                return None
-
-            texto = resp.text
-            info = {"nit": nit, "fuente": "Einforma"}
+            for bloque, filas in zip(bloques, respuestas):
+                if filas is None:
+                    sin_respuesta.update(bloque)
+                    continue
+                for fila in filas:
+                    if not isinstance(fila, dict):
+                        continue
+                    for campo in campos:
+                        nit = RE_NO_DIGITOS.sub('', str(fila.get(campo, "")))
+                        if nit in pendientes and nit not in encontrados:
+                            info = _extraer_info_dict(fila, "datos.gov.co", dataset_id)
+                            if info and info.get("razon_social"):
+                                info["nit"] = nit
+                                info.setdefault("dv", _calc_dv(nit))
+                                encontrados[nit] = info
+                            break
+            pendientes -= encontrados.keys()
+    except Exception as e:
+        logger.debug("datos.gov.co batch lookup failed: %s", e)
+        sin_respuesta = todos
+    sin_respuesta -= encontrados.keys()
+    logger.info("[datos.gov.co] Lote: %d de %d NITs resueltos, %d sin respuesta",
+                len(encontrados), len(nits), len(sin_respuesta))
+    return encontrados, sin_respuesta
+
+
+# Títulos de Einforma que son el nombre del sitio, no de la empresa
+_EINFORMA_FALSOS_POSITIVOS = {"einforma", "einforma colombia", "einforma.co", "empresas", "buscar empresa"}
+
+# Palabras que indican basura en la razón social encontrada por búsqueda web
+_WEB_RUIDO = {
+    "politica", "tratamiento", "datos", "personales", "privacidad",
+    "terminos", "condiciones", "certificado", "existencia",
+    "representacion", "legal", "camara", "comercio", "registro",
+    "consulta", "resultado", "buscar", "busqueda", "colombia",
+    "informacion", "empresa", "noticias", "documento", "pdf",
+}
 
-            # Razón social
-            rs_match = re.findall(
-                r'<h1[^>]*class="[^"]*nombre[^"]*"[^>]*>([^<]+)</h1>',
-                texto, re.IGNORECASE,
-            )
-            if not rs_match:
-                rs_match = re.findall(r"<title>([^<]+?)[\s\-|]", texto)
-            # Filtrar falsos positivos (nombre del sitio, no de la empresa)
-            FALSOS_POSITIVOS = {"einforma", "einforma colombia", "einforma.co", "empresas", "buscar empresa"}
-            if rs_match:
-                rs = rs_match[0].strip()
-                if len(rs) > 3 and str(nit) not in rs.lower() and rs.strip().lower() not in FALSOS_POSITIVOS:
-                    info["razon_social"] = rs.upper()
-
-            # Dirección
-            dir_match = re.findall(
-                r'(?:Direcci[oó]n|Domicilio)[:\s]*</[^>]+>\s*<[^>]+>([^<]+)',
-                texto, re.IGNORECASE,
-            )
-            if dir_match:
-                info["direccion"] = dir_match[0].strip()
 
-            if info.get("razon_social") or info.get("direccion"):
-                info["dv"] = _calc_dv(nit)
-                return info
+async def buscar_einforma(nit: str) -> dict | None:
+    """Consultar Einforma.co para información de la empresa."""
+    try:
+        resp = await _get(
+            "einforma",
+            f"https://www.einforma.co/servlet/app/portal/ENTP/prod/ETIQUETA_EMPRESA_498/nif/{nit}",
+            timeout=12, follow_redirects=True,
+            headers=HEADERS,
+        )
+        if resp.status_code != 200:
+            return None
+
+        texto = resp.text
+        info = {"nit": nit, "fuente": "Einforma"}
+
+        # Razón social
+        rs_match = RE_H1_NOMBRE.findall(texto) or RE_TITLE.findall(texto)
+        if rs_match:
+            rs = rs_match[0].strip()
+            if len(rs) > 3 and str(nit) not in rs.lower() and rs.strip().lower() not in _EINFORMA_FALSOS_POSITIVOS:
+                info["razon_social"] = rs.upper()
+
+        # Dirección
+        dir_match = RE_DIR_ETIQUETA.findall(texto)
+        if dir_match:
+            info["direccion"] = dir_match[0].strip()
+
+        if info.get("razon_social") or info.get("direccion"):
+            info["dv"] = _calc_dv(nit)
+            return info
     except Exception as e:
         logger.debug("Einforma lookup failed for %s: %s", nit, e)
     return None
@@ -151,140 +402,213 @@ async def buscar_einforma(nit: str) -> dict | None:
 async def buscar_web(nit: str) -> dict | None:
     """Búsqueda web como último recurso (DuckDuckGo)."""
     try:
-        async with httpx.AsyncClient(timeout=12) as client:
-            resp = await client.get(
-                "https://html.duckduckgo.com/html/",
-                params={"q": f"NIT {nit} Colombia empresa"},
-                headers=HEADERS,
-            )
-            if resp.status_code != 200:
-                return None
-
-            texto = re.sub(r"<[^>]+>", " ", resp.text)
-            texto = re.sub(r"\s+", " ", texto)
-
-            patrones = [
-                r'(?:NIT|Nit|nit)[\s.:]*' + re.escape(str(nit)) + r'[\s\-–—:,.]+([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]+)',
-                r'([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]{5,50}?)[\s\-–—:,.]+(?:NIT|Nit|nit)[\s.:]*' + re.escape(str(nit)),
-                r'([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]{3,60}?)\s*-\s*' + re.escape(str(nit)),
-            ]
-            # Palabras que indican basura en la razón social
-            RUIDO = {
-                "politica", "tratamiento", "datos", "personales", "privacidad",
-                "terminos", "condiciones", "certificado", "existencia",
-                "representacion", "legal", "camara", "comercio", "registro",
-                "consulta", "resultado", "buscar", "busqueda", "colombia",
-                "informacion", "empresa", "noticias", "documento", "pdf",
-            }
-            for patron in patrones:
-                matches = re.findall(patron, texto)
-                if matches:
-                    rs = matches[0].strip().rstrip(".,;:-– ")
-                    # Filtrar si tiene palabras de ruido (no es razón social real)
-                    palabras = rs.lower().split()
-                    ruido_count = sum(1 for p in palabras if p in RUIDO)
-                    if 3 < len(rs) < 80 and ruido_count < 2 and len(palabras) <= 10:
-                        # Limpiar sufijos de sitios web
-                        rs = re.sub(r'\s*[-–]\s*(edirectorio|registronit|einforma|empresite).*$', '', rs, flags=re.IGNORECASE)
-                        if len(rs.strip()) > 3:
-                            return {
-                                "nit": nit,
-                                "razon_social": rs.strip().upper(),
-                                "dv": _calc_dv(nit),
-                                "fuente": "Búsqueda web",
-                            }
+        resp = await _get(
+            "web",
+            "https://html.duckduckgo.com/html/",
+            timeout=12,
+            params={"q": f"NIT {nit} Colombia empresa"},
+            headers=HEADERS,
+        )
+        if resp.status_code != 200:
+            return None
+
+        texto = html_a_texto(resp.text)
+
+        for patron in patrones_razon_social(str(nit)):
+            rs = primera_cerca_del_nit(patron, texto, str(nit))
+            if rs:
+                rs = rs.strip().rstrip(".,;:-– ")
+                # Filtrar si tiene palabras de ruido (no es razón social real)
+                palabras = rs.lower().split()
+                ruido_count = sum(1 for p in palabras if p in _WEB_RUIDO)
+                if 3 < len(rs) < 80 and ruido_count < 2 and len(palabras) <= 10:
+                    # Limpiar sufijos de sitios web
+                    rs = RE_SUFIJO_SITIO.sub('', rs)
+                    if len(rs.strip()) > 3:
+                        return {
+                            "nit": nit,
+                            "razon_social": rs.strip().upper(),
+                            "dv": _calc_dv(nit),
+                            "fuente": "Búsqueda web",
+                        }
     except Exception as e:
         logger.debug("Web search failed for %s: %s", nit, e)
     return None
 
 
-def _extraer_info_dict(emp: dict, fuente: str) -> dict | None:
-    """Extraer información relevante de un dict de respuesta."""
+# Campo lógico → alias posibles en las respuestas, en orden de preferencia
+_ALIAS_CAMPOS = {
+    "nit": ["nit", "Nit", "NIT", "numero_identificacion", "NumeroIdentificacion"],
+    "razon_social": [
+        "razon_social", "Razon_Social", "RazonSocial", "razonSocial",
+        "nombre", "Nombre", "nombre_razon_social", "NombreEstablecimiento",
+        "organizacion", "nombre_empresa", "empresa", "nombre_propio",
+    ],
+    "dv": ["digito_verificacion", "Digito_Verificacion", "dv", "DV"],
+    "direccion": ["direccion", "Direccion", "direccion_comercial", "DireccionComercial"],
+    "departamento": ["departamento", "codigo_departamento", "departamento_municipio_empresa"],
+    "municipio": ["municipio", "codigo_municipio", "ciudad", "mun_comercial", "MunicipioComercial"],
+}
+
+# Esquema aprendido por dataset: campo lógico → alias que usa ese dataset.
+# Cada dataset tiene columnas fijas, así que tras el primer registro no hace
+# falta probar todos los alias en cada fila.
+_esquemas: dict[str, dict[str, str]] = {}
+
+
+def _valor_campo(emp: dict, campo: str, esquema: dict[str, str] | None):
+    """Primer alias con valor para el campo lógico, probando antes el del esquema aprendido."""
+    def _tiene(val):
+        if campo == "dv":
+            return val is not None and str(val).strip()
+        return bool(val)
+
+    alias = esquema.get(campo) if esquema is not None else None
+    if alias is not None:
+        val = emp.get(alias, "")
+        if _tiene(val):
+            return val
+    for alias in _ALIAS_CAMPOS[campo]:
+        val = emp.get(alias, "")
+        if _tiene(val):
+            if esquema is not None:
+                esquema[campo] = alias
+            return val
+    return None
+
+
+def _extraer_info_dict(emp: dict, fuente: str, dataset: str | None = None) -> dict | None:
+    """
+    Extraer información relevante de un dict de respuesta.
+    Con dataset, usa (y aprende) el esquema de alias de ese dataset.
+    """
     if not isinstance(emp, dict):
         return None
 
+    esquema = _esquemas.setdefault(dataset, {}) if dataset else None
     info = {"fuente": fuente}
 
-    # NIT
-    for campo in ["nit", "Nit", "NIT", "numero_identificacion", "NumeroIdentificacion"]:
-        val = emp.get(campo, "")
-        if val:
-            info["nit"] = str(val).strip()
-            break
-
-    # Razón social
-    for campo in [
-        "razon_social", "Razon_Social", "RazonSocial", "razonSocial",
-        "nombre", "Nombre", "nombre_razon_social", "NombreEstablecimiento",
-        "organizacion", "nombre_empresa", "empresa", "nombre_propio",
-    ]:
-        val = emp.get(campo, "")
-        if val:
-            info["razon_social"] = str(val).strip().upper()
-            break
-
-    # DV
-    for campo in ["digito_verificacion", "Digito_Verificacion", "dv", "DV"]:
-        val = emp.get(campo, "")
-        if val is not None and str(val).strip():
-            info["dv"] = str(val).strip()
-            break
-
-    # Dirección
-    for campo in ["direccion", "Direccion", "direccion_comercial", "DireccionComercial"]:
-        val = emp.get(campo, "")
-        if val:
-            info["direccion"] = str(val).strip()
-            break
-
-    # Departamento y municipio
-    for campo in ["departamento", "codigo_departamento", "departamento_municipio_empresa"]:
-        val = emp.get(campo, "")
-        if val:
-            info["departamento"] = str(val).strip()
-            break
-
-    for campo in ["municipio", "codigo_municipio", "ciudad", "mun_comercial", "MunicipioComercial"]:
-        val = emp.get(campo, "")
-        if val:
-            info["municipio"] = str(val).strip()
-            break
+    for campo in _ALIAS_CAMPOS:
+        val = _valor_campo(emp, campo, esquema)
+        if val is None:
+            continue
+        val = str(val).strip()
+        info[campo] = val.upper() if campo == "razon_social" else val
 
     if info.get("razon_social") or info.get("direccion"):
         return info
     return None
 
 
-async def consultar_fallback(nit: str) -> dict:
+def _exito(task: asyncio.Task) -> dict | None:
+    """Resultado útil de una fuente terminada (con razón social), o None."""
+    if task.cancelled() or task.exception() is not None:
+        return None
+    result = task.result()
+    return result if result and result.get("razon_social") else None
+
+
+async def _carrera_priorizada(fuentes: list, hedge_delay: float,
+                              stats: dict | None = fallback_stats) -> dict | None:
     """
-    Consultar todas las fuentes de fallback en PARALELO.
-    Retorna el mejor resultado (prioridad: RegistroNIT > datos.gov > Einforma > web).
+    Correr las fuentes (corutinas, en orden de prioridad) en paralelo y retornar
+    apenas haya un ganador: el éxito de mayor prioridad cuyas fuentes superiores
+    ya terminaron sin resultado. Pasado hedge_delay ya no se esperan las
+    superiores: gana el mejor éxito disponible. Las perdedoras se cancelan.
+    """
+    loop = asyncio.get_running_loop()
+    tasks = [asyncio.ensure_future(f) for f in fuentes]
+    terminadas = [False] * len(tasks)
+    exitos: list[dict | None] = [None] * len(tasks)
+    inicio = loop.time()
+    try:
+        pendientes = set(tasks)
+        while pendientes:
+            restante = hedge_delay - (loop.time() - inicio)
+            done, pendientes = await asyncio.wait(
+                pendientes,
+                timeout=restante if restante > 0 else None,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for t in done:
+                i = tasks.index(t)
+                terminadas[i] = True
+                exitos[i] = _exito(t)
+            hedge_vencido = loop.time() - inicio >= hedge_delay
+            for i in range(len(tasks)):
+                if exitos[i]:
+                    if stats is not None:
+                        stats["hedged_wins"] += hedge_vencido and not all(terminadas[:i])
+                    return exitos[i]
+                if not terminadas[i] and not hedge_vencido:
+                    break  # Una fuente de mayor prioridad todavía puede ganar
+        return None
+    finally:
+        for t in tasks:
+            if not t.done():
+                t.cancel()
+                if stats is not None:
+                    stats["cancelled"] += 1
+
+
+async def consultar_fallback(nit: str, skip_datos_gov: bool = False) -> dict:
+    """
+    Consultar las fuentes de fallback en PARALELO, como carrera priorizada.
+    Retorna el mejor resultado (prioridad: RegistroNIT > datos.gov > Einforma > web)
+    sin esperar a las fuentes lentas que ya no pueden ganar (ver _carrera_priorizada).
+    Las fuentes caídas se saltan y las degradadas pierden prioridad (ver SaludFuente).
+    skip_datos_gov: el NIT ya se buscó en datos.gov.co por lote (consulta masiva)
+    y datos.gov.co respondió por él.
     """
     nit = str(nit).strip()
 
-    # Lanzar todas las fuentes en paralelo
-    results = await asyncio.gather(
-        buscar_registronit(nit),
-        buscar_datos_gov(nit),
-        buscar_einforma(nit),
-        buscar_web(nit),
-        return_exceptions=True,
-    )
-
-    # Retornar el primer resultado exitoso por orden de prioridad
-    for result in results:
-        if isinstance(result, Exception) or result is None:
-            continue
-        if result.get("razon_social"):
-            result["nit"] = nit
-            result.setdefault("dv", _calc_dv(nit))
-            return result
+    candidatas = [
+        ("registronit", buscar_registronit),
+        ("datos_gov", buscar_datos_gov),
+        ("einforma", buscar_einforma),
+        ("web", buscar_web),
+    ]
+    if skip_datos_gov:
+        candidatas = [c for c in candidatas if c[0] != "datos_gov"]
+    # Saltar las fuentes con circuito abierto; las degradadas van al final
+    activas = []
+    for nombre, fn in candidatas:
+        if salud_fuentes[nombre].can_request():
+            activas.append((nombre, fn))
+        else:
+            salud_fuentes[nombre].skipped += 1
+    activas.sort(key=lambda c: salud_fuentes[c[0]].degraded)
+    # Con skip_datos_gov, datos.gov.co ya contestó por este NIT en el lote
+    respondieron: set[str] = {"datos_gov"} if skip_datos_gov else set()
+    token = _respondieron.set(respondieron)  # Las tareas de la carrera heredan el contexto
+    try:
+        fuentes = [fn(nit) for _, fn in activas]
+        fallback_stats["races"] += 1
+        result = await _carrera_priorizada(fuentes, FALLBACK_HEDGE_DELAY)
+    finally:
+        _respondieron.reset(token)
+
+    if result:
+        result["nit"] = nit
+        result.setdefault("dv", _calc_dv(nit))
+        return result
+
+    if not respondieron:
+        # Todas fallaron o se saltaron: no se sabe si el NIT existe
+        fallback_stats["no_answer"] += 1
+        return {
+            "nit": nit,
+            "dv": _calc_dv(nit),
+            "razon_social": "",
+            "fuente": SIN_RESPUESTA,
+            "error": "Ninguna fuente de fallback respondió (caídas o en pausa)",
+        }
 
     # Nada encontrado
     return {
         "nit": nit,
         "dv": _calc_dv(nit),
         "razon_social": "",
-        "fuente": "No encontrado",
+        "fuente": NO_ENCONTRADO,
         "error": "NIT no encontrado en ninguna fuente",
     }
@@ -0,0 +1,157 @@
+"""
+Clientes httpx compartidos por propósito, con pools de conexiones reutilizables.
+
+En vez de abrir un httpx.AsyncClient (y un handshake TCP+TLS) por llamada,
+cada módulo pide get_client("<propósito>") y reutiliza las conexiones
+keep-alive de ese pool. Los clientes se crean perezosamente (sirven igual en
+scripts y tests) y se cierran en el shutdown de la app con cerrar_clientes().
+
+HTTP/2 se activa si el paquete h2 está instalado (httpx[http2]).
+Métricas por pool (en vuelo, pico, saturación) en stats().
+"""
+import asyncio
+import importlib.util
+import logging
+
+import httpx
+
+logger = logging.getLogger("exogenadian.http")
+
+HTTP2 = importlib.util.find_spec("h2") is not None
+KEEPALIVE_EXPIRY = 30.0  # segundos
+
+# propósito: (max_connections, max_keepalive_connections, timeout por defecto)
+# Las fuentes de fallback tienen un pool por host: una fuente lenta o muy pedida
+# (fase 2 masiva: 50 NITs × 4 fuentes) no deja sin conexiones a las demás.
+POOLS = {
+    "registronit": (40, 20, 15.0),
+    "datos_gov": (30, 15, 15.0),   # www.datos.gov.co (Socrata): sondas por dataset; los lotes piden 30 s
+    "einforma": (40, 20, 15.0),
+    "web": (40, 20, 15.0),         # DuckDuckGo
+    "captcha": (20, 10, 90.0),    # CapSolver
+    "google": (20, 10, 10.0),     # Apps Script: validación PRO, logs, alertas
+    "llm": (50, 20, 60.0),        # Gemini, OpenRouter, Anthropic
+}
+_DEFAULT_POOL = (20, 10, 15.0)
+
+# propósito → (cliente, event loop donde se creó): las conexiones no se comparten entre loops
+_clients: dict[str, tuple[httpx.AsyncClient, asyncio.AbstractEventLoop | None]] = {}
+_transports: dict[str, "_TransporteMedido"] = {}
+_transporte_pruebas: httpx.AsyncBaseTransport | None = None
+
+
+class _StreamMedido(httpx.AsyncByteStream):
+    """Cuerpo de respuesta que libera el contador del pool al cerrarse."""
+
+    def __init__(self, stream, transporte: "_TransporteMedido"):
+        self._stream = stream
+        self._transporte = transporte
+        self._cerrado = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if not self._cerrado:
+            self._cerrado = True
+            self._transporte.en_vuelo -= 1
+        await self._stream.aclose()
+
+
+class _TransporteMedido(httpx.AsyncBaseTransport):
+    """Envuelve el transporte real para contar peticiones en vuelo y saturación del pool."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, max_conexiones: int):
+        self.inner = inner
+        self.max_conexiones = max_conexiones
+        self.en_vuelo = 0
+        self.pico = 0
+        self.total = 0
+        self.saturadas = 0  # Peticiones que llegaron con el pool lleno (esperan conexión)
+        self.errores = 0
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.total += 1
+        if self.en_vuelo >= self.max_conexiones:
+            self.saturadas += 1
+        self.en_vuelo += 1
+        self.pico = max(self.pico, self.en_vuelo)
+        try:
+            response = await self.inner.handle_async_request(request)
+        except BaseException:
+            self.en_vuelo -= 1
+            self.errores += 1
+            raise
+        if response.is_closed:
+            # Cuerpo ya leído por el transporte (p. ej. MockTransport): nada que esperar
+            self.en_vuelo -= 1
+        else:
+            response.stream = _StreamMedido(response.stream, self)
+        return response
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+    def stats(self) -> dict:
+        pool = getattr(self.inner, "_pool", None)
+        return {
+            "in_flight": self.en_vuelo,
+            "peak": self.pico,
+            "max_connections": self.max_conexiones,
+            "open_connections": len(getattr(pool, "connections", []) or []),
+            "requests": self.total,
+            "saturated": self.saturadas,
+            "errors": self.errores,
+        }
+
+
+def get_client(nombre: str) -> httpx.AsyncClient:
+    """Cliente compartido para un propósito (ver POOLS). No cerrarlo: lo hace el shutdown."""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    client, client_loop = _clients.get(nombre, (None, None))
+    if client is None or client.is_closed or client_loop is not loop:
+        max_conn, keepalive, timeout = POOLS.get(nombre, _DEFAULT_POOL)
+        limits = httpx.Limits(
+            max_connections=max_conn,
+            max_keepalive_connections=keepalive,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        )
+        inner = _transporte_pruebas or httpx.AsyncHTTPTransport(http2=HTTP2, limits=limits)
+        transporte = _TransporteMedido(inner, max_conn)
+        client = httpx.AsyncClient(transport=transporte, timeout=timeout)
+        _clients[nombre] = (client, loop)
+        _transports[nombre] = transporte
+    return client
+
+
+async def cerrar_clientes():
+    """Cerrar todos los pools (shutdown de la app)."""
+    for nombre, (client, _loop) in list(_clients.items()):
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.debug("Error cerrando cliente %s: %s", nombre, e)
+    _clients.clear()
+    _transports.clear()
+
+
+def usar_transporte(transporte: httpx.AsyncBaseTransport | None):
+    """
+    Tests: que todos los clientes usen este transporte (p. ej. httpx.MockTransport).
+    Descarta los clientes existentes; None vuelve a la red real.
+    """
+    global _transporte_pruebas
+    _transporte_pruebas = transporte
+    _clients.clear()
+    _transports.clear()
+
+
+def stats() -> dict:
+    return {
+        "http2": HTTP2,
+        "pools": {nombre: t.stats() for nombre, t in _transports.items()},
+    }
@@ -19,6 +19,7 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
 
 from et_search import et_engine
+from http_clients import get_client
 
 logger = logging.getLogger("exogenadian.ia")
 
@@ -564,45 +565,45 @@ async def _call_gemini(system: str, user_message: str, max_tokens: int) -> dict:
         return {"error": "IA no configurada. Falta GEMINI_API_KEY."}
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            resp = await client.post(
-                f"{GEMINI_URL}?key={GEMINI_API_KEY}",
-                headers={"content-type": "application/json"},
-                json={
-                    "system_instruction": {
-                        "parts": [{"text": system}]
-                    },
-                    "contents": [
-                        {
-                            "role": "user",
-                            "parts": [{"text": user_message}]
-                        }
-                    ],
-                    "generationConfig": {
-                        "maxOutputTokens": max_tokens,
-                        "temperature": 0.3,
-                        "responseMimeType": "application/json",
-                    },
+        client = get_client("llm")
+        resp = await client.post(
+            f"{GEMINI_URL}?key={GEMINI_API_KEY}",
+            headers={"content-type": "application/json"},
+            json={
+                "system_instruction": {
+                    "parts": [{"text": system}]
                 },
-            )
+                "contents": [
+                    {
+                        "role": "user",
+                        "parts": [{"text": user_message}]
+                    }
+                ],
+                "generationConfig": {
+                    "maxOutputTokens": max_tokens,
+                    "temperature": 0.3,
+                    "responseMimeType": "application/json",
+                },
+            },
+        )
 
-            if resp.status_code != 200:
-                logger.error("Gemini API error %s: %s", resp.status_code, resp.text[:500])
-                return {"error": "Error al procesar tu solicitud. Intenta de nuevo."}
+        if resp.status_code != 200:
+            logger.error("Gemini API error %s: %s", resp.status_code, resp.text[:500])
+            return {"error": "Error al procesar tu solicitud. Intenta de nuevo."}
 
-            data = resp.json()
+        data = resp.json()
 
-            # Extraer texto de la respuesta Gemini
-            candidates = data.get("candidates", [])
-            if not candidates:
-                return {"error": "Gemini no generó respuesta."}
+        # Extraer texto de la respuesta Gemini
+        candidates = data.get("candidates", [])
+        if not candidates:
+            return {"error": "Gemini no generó respuesta."}
 
-            parts = candidates[0].get("content", {}).get("parts", [])
-            if not parts:
-                return {"error": "Respuesta vacía de Gemini."}
+        parts = candidates[0].get("content", {}).get("parts", [])
+        if not parts:
+            return {"error": "Respuesta vacía de Gemini."}
 
-            text = parts[0].get("text", "")
-            return _parse_json_response(text)
+        text = parts[0].get("text", "")
+        return _parse_json_response(text)
 
     except httpx.TimeoutException:
         return {"error": "Tiempo de espera agotado. Intenta de nuevo."}
@@ -628,55 +629,55 @@ async def _stream_gemini(system: str, messages: list[dict]):
         gemini_contents.append({"role": role, "parts": [{"text": msg["content"]}]})
 
     try:
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            async with client.stream(
-                "POST",
-                f"{GEMINI_STREAM_URL}?key={GEMINI_API_KEY}&alt=sse",
-                headers={"content-type": "application/json"},
-                json={
-                    "system_instruction": {"parts": [{"text": system}]},
-                    "contents": gemini_contents,
-                    "generationConfig": {
-                        "maxOutputTokens": MAX_TOKENS_CHAT,
-                        "temperature": 0.4,
-                    },
+        client = get_client("llm")
+        async with client.stream(
+            "POST",
+            f"{GEMINI_STREAM_URL}?key={GEMINI_API_KEY}&alt=sse",
+            headers={"content-type": "application/json"},
+            json={
+                "system_instruction": {"parts": [{"text": system}]},
+                "contents": gemini_contents,
+                "generationConfig": {
+                    "maxOutputTokens": MAX_TOKENS_CHAT,
+                    "temperature": 0.4,
                 },
-            ) as resp:
-                if resp.status_code != 200:
-                    error_body = await resp.aread()
-                    logger.error("Gemini stream error %s: %s", resp.status_code, error_body[:500])
-                    yield f"data: {json.dumps({'type': 'error', 'error': 'Error al procesar tu mensaje. Intenta de nuevo.'})}\n\n"
+            },
+        ) as resp:
+            if resp.status_code != 200:
+                error_body = await resp.aread()
+                logger.error("Gemini stream error %s: %s", resp.status_code, error_body[:500])
+                yield f"data: {json.dumps({'type': 'error', 'error': 'Error al procesar tu mensaje. Intenta de nuevo.'})}\n\n"
+                return
+
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data_str = line[6:].strip()
+                if not data_str:
+                    continue
+
+                try:
+                    event = json.loads(data_str)
+                except json.JSONDecodeError:
+                    continue
+
+                # Gemini streaming format: {"candidates":[{"content":{"parts":[{"text":"..."}]}}]}
+                candidates = event.get("candidates", [])
+                if not candidates:
+                    continue
+
+                parts = candidates[0].get("content", {}).get("parts", [])
+                for part in parts:
+                    text = part.get("text", "")
+                    if text:
+                        yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
+
+                # Check if finished
+                finish = candidates[0].get("finishReason", "")
+                if finish in ("STOP", "MAX_TOKENS"):
+                    yield f"data: {json.dumps({'type': 'done'})}\n\n"
                     return
 
-                async for line in resp.aiter_lines():
-                    if not line.startswith("data: "):
-                        continue
-                    data_str = line[6:].strip()
-                    if not data_str:
-                        continue
-
-                    try:
-                        event = json.loads(data_str)
-                    except json.JSONDecodeError:
-                        continue
-
-                    # Gemini streaming format: {"candidates":[{"content":{"parts":[{"text":"..."}]}}]}
-                    candidates = event.get("candidates", [])
-                    if not candidates:
-                        continue
-
-                    parts = candidates[0].get("content", {}).get("parts", [])
-                    for part in parts:
-                        text = part.get("text", "")
-                        if text:
-                            yield f"data: {json.dumps({'type': 'text', 'text': text})}\n\n"
-
-                    # Check if finished
-                    finish = candidates[0].get("finishReason", "")
-                    if finish in ("STOP", "MAX_TOKENS"):
-                        yield f"data: {json.dumps({'type': 'done'})}\n\n"
-                        return
-
         # Si el stream terminó sin finishReason, enviar done
         yield f"data: {json.dumps({'type': 'done'})}\n\n"
 
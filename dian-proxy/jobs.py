@@ -0,0 +1,445 @@
+"""
+Trabajos masivos asíncronos (POST /api/nit/bulk/jobs).
+
+Cada trabajo y cada resultado por NIT se guardan en SQLite local
+(JOBS_FILE), así que un trabajo sobrevive reinicios de la instancia: al
+arrancar se reencolan los que quedaron a medias y solo se procesan los NITs
+sin resultado guardado. Un NIT ya resuelto por la DIAN no vuelve a consultarse
+ni a gastar crédito.
+
+La clave PRO no se guarda en disco, solo su hash (para verificar a quien
+consulta el trabajo). La clave en claro vive en memoria mientras el proceso
+corre; un trabajo PRO que se reanuda tras un reinicio queda en
+"waiting_key" hasta que su dueño lo consulte con la clave, que se vuelve a
+validar antes de seguir gastando créditos.
+
+Con varios procesos sobre el mismo JOBS_FILE (uvicorn --workers N) cada
+trabajo lo corre un solo proceso: lo toma con un UPDATE atómico que lo deja a
+su nombre (owner) con un lease de JOB_LEASE_SECONDS que renueva mientras lo
+tiene. Otro proceso solo retoma un trabajo cuyo lease venció (su dueño murió).
+
+El procesamiento real lo hace la función de eventos del flujo masivo
+(main._bulk_eventos), que se inyecta en JobRunner.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from pathlib import Path
+
+logger = logging.getLogger("exogenadian.jobs")
+
+JOBS_FILE = Path(os.getenv("JOBS_FILE", str(Path(__file__).parent / "jobs_data.db")))
+BULK_JOB_WORKERS = int(os.getenv("BULK_JOB_WORKERS", "1"))
+JOB_RETENTION_DAYS = 7
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))  # Sin renovar en este tiempo → otro proceso lo retoma
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulk_jobs (
+    id             TEXT PRIMARY KEY,
+    key_hash       TEXT NOT NULL,
+    is_pro         INTEGER NOT NULL,
+    status         TEXT NOT NULL,
+    total          INTEGER NOT NULL,
+    dian_consulted INTEGER NOT NULL DEFAULT 0,
+    summary        TEXT,
+    error          TEXT,
+    created_at     REAL NOT NULL,
+    updated_at     REAL NOT NULL,
+    owner          TEXT,
+    lease_until    REAL
+);
+CREATE INDEX IF NOT EXISTS idx_bulk_jobs_status ON bulk_jobs (status);
+CREATE TABLE IF NOT EXISTS bulk_job_nits (
+    job_id TEXT NOT NULL,
+    idx    INTEGER NOT NULL,
+    nit    TEXT NOT NULL,
+    seq    INTEGER,
+    phase  TEXT,
+    result TEXT,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS idx_bulk_job_nits_seq ON bulk_job_nits (job_id, seq);
+"""
+
+# Estados de un trabajo
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+WAITING_KEY = "waiting_key"  # PRO reanudado tras un reinicio: falta la clave del dueño
+
+
+def hash_clave(key: str | None) -> str:
+    return hashlib.sha256((key or "").strip().encode()).hexdigest()
+
+
+def clave_corresponde(job: dict, key: str | None) -> bool:
+    """¿La clave de quien consulta es la del trabajo? (comparación en tiempo constante)"""
+    return hmac.compare_digest(job["key_hash"], hash_clave(key))
+
+
+class JobStore:
+    """Persistencia de trabajos y resultados en SQLite (WAL, autocommit)."""
+
+    def __init__(self, path: Path | str = JOBS_FILE):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        try:
+            self._db = self._connect(self.path)
+        except sqlite3.Error:
+            self.path = ":memory:"
+            self._db = self._connect(self.path)
+
+    @staticmethod
+    def _connect(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+        db.executescript(_SCHEMA)
+        JobStore._migrar(db)
+        return db
+
+    @staticmethod
+    def _migrar(db: sqlite3.Connection):
+        """Bases de versiones anteriores: clave PRO en claro → hash; columnas del lease."""
+        columnas = {r[1] for r in db.execute("PRAGMA table_info(bulk_jobs)")}
+        db.execute("BEGIN IMMEDIATE")
+        if "pro_key" in columnas:
+            db.execute("ALTER TABLE bulk_jobs ADD COLUMN key_hash TEXT NOT NULL DEFAULT ''")
+            for job_id, key in db.execute("SELECT id, pro_key FROM bulk_jobs").fetchall():
+                db.execute("UPDATE bulk_jobs SET key_hash = ? WHERE id = ?", (hash_clave(key), job_id))
+            db.execute("ALTER TABLE bulk_jobs DROP COLUMN pro_key")
+        if "owner" not in columnas:
+            db.execute("ALTER TABLE bulk_jobs ADD COLUMN owner TEXT")
+            db.execute("ALTER TABLE bulk_jobs ADD COLUMN lease_until REAL")
+        db.execute("COMMIT")
+
+    def create(self, nits: list[str], pro_key: str, is_pro: bool, owner: str | None = None) -> str:
+        """Crear el trabajo; con owner queda reservado para ese proceso (lo encola él mismo)."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT INTO bulk_jobs (id, key_hash, is_pro, status, total, created_at, updated_at, "
+                "owner, lease_until) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, hash_clave(pro_key), int(is_pro), QUEUED, len(nits), now, now,
+                 owner, now + JOB_LEASE_SECONDS if owner else None),
+            )
+            self._db.executemany(
+                "INSERT INTO bulk_job_nits (job_id, idx, nit) VALUES (?, ?, ?)",
+                [(job_id, i, nit) for i, nit in enumerate(nits)],
+            )
+            self._db.execute("COMMIT")
+        return job_id
+
+    def get(self, job_id: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT id, key_hash, is_pro, status, total, dian_consulted, summary, error, "
+                "created_at, updated_at FROM bulk_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if not row:
+                return None
+            done = self._db.execute(
+                "SELECT COUNT(*) FROM bulk_job_nits WHERE job_id = ? AND seq IS NOT NULL", (job_id,)
+            ).fetchone()[0]
+        return {
+            "job_id": row[0],
+            "key_hash": row[1],
+            "is_pro": bool(row[2]),
+            "status": row[3],
+            "total": row[4],
+            "done": done,
+            "dian_consulted": row[5],
+            "summary": json.loads(row[6]) if row[6] else None,
+            "error": row[7] or "",
+            "created_at": row[8],
+            "updated_at": row[9],
+        }
+
+    def pending(self, job_id: str) -> list[tuple[int, str]]:
+        """Filas sin resultado: [(idx, nit)] en el orden del trabajo."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT idx, nit FROM bulk_job_nits WHERE job_id = ? AND seq IS NULL ORDER BY idx", (job_id,)
+            ).fetchall()
+
+    def pending_nits(self, job_id: str) -> list[str]:
+        return [nit for _, nit in self.pending(job_id)]
+
+    def save_result(self, job_id: str, idx: int, phase: str, result: dict, owner: str | None = None) -> bool:
+        """
+        Guardar el resultado de una fila. Una fila que ya tiene resultado conserva su seq
+        (los pollers con after= no lo reciben dos veces). Con owner, solo si el trabajo
+        sigue a su nombre. Retorna si se guardó.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            if owner is not None and not self._db.execute(
+                "SELECT 1 FROM bulk_jobs WHERE id = ? AND owner = ?", (job_id, owner)
+            ).fetchone():
+                self._db.execute("COMMIT")
+                return False
+            seq = self._db.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM bulk_job_nits WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+            guardado = self._db.execute(
+                "UPDATE bulk_job_nits SET seq = ?, phase = ?, result = ? WHERE job_id = ? AND idx = ? AND seq IS NULL",
+                (seq, phase, json.dumps(result, ensure_ascii=False), job_id, idx),
+            ).rowcount == 1
+            if guardado:
+                self._db.execute(
+                    "UPDATE bulk_jobs SET updated_at = ?, dian_consulted = dian_consulted + ? WHERE id = ?",
+                    (time.time(), int(phase == "dian"), job_id),
+                )
+            self._db.execute("COMMIT")
+        return guardado
+
+    def results(self, job_id: str, after: int = 0, limit: int = 500) -> list[dict]:
+        """Resultados en orden de resolución con seq > after (paginación incremental)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT seq, phase, result FROM bulk_job_nits WHERE job_id = ? AND seq > ? "
+                "ORDER BY seq LIMIT ?", (job_id, after, limit),
+            ).fetchall()
+        return [{"seq": r[0], "phase": r[1], "result": json.loads(r[2])} for r in rows]
+
+    def count_cached(self, job_id: str) -> int:
+        with self._lock:
+            return self._db.execute(
+                "SELECT COUNT(*) FROM bulk_job_nits WHERE job_id = ? AND phase = 'cache'", (job_id,)
+            ).fetchone()[0]
+
+    def set_pro(self, job_id: str, is_pro: bool):
+        with self._lock:
+            self._db.execute("UPDATE bulk_jobs SET is_pro = ? WHERE id = ?", (int(is_pro), job_id))
+
+    def set_status(self, job_id: str, status: str, summary: dict | None = None, error: str = ""):
+        """Cambiar el estado. Fuera de queued/running el trabajo ya no tiene dueño ni lease."""
+        suelta = status not in (QUEUED, RUNNING)
+        with self._lock:
+            self._db.execute(
+                "UPDATE bulk_jobs SET status = ?, summary = COALESCE(?, summary), error = ?, updated_at = ?, "
+                "owner = CASE WHEN ? THEN NULL ELSE owner END, "
+                "lease_until = CASE WHEN ? THEN NULL ELSE lease_until END WHERE id = ?",
+                (status, json.dumps(summary) if summary else None, error, time.time(), suelta, suelta, job_id),
+            )
+
+    def claim(self, job_id: str, owner: str, desde: tuple[str, ...] = (QUEUED, RUNNING)) -> bool:
+        """
+        Tomar el trabajo para este proceso (UPDATE atómico). Se puede si está en
+        `desde` y no tiene dueño, ya es de `owner` o el lease de su dueño venció.
+        """
+        now = time.time()
+        marcas = ",".join("?" * len(desde))
+        with self._lock:
+            return self._db.execute(
+                f"UPDATE bulk_jobs SET status = ?, owner = ?, lease_until = ?, updated_at = ? "
+                f"WHERE id = ? AND status IN ({marcas}) "
+                f"AND (owner IS NULL OR owner = ? OR lease_until IS NULL OR lease_until < ?)",
+                (RUNNING, owner, now + JOB_LEASE_SECONDS, now, job_id, *desde, owner, now),
+            ).rowcount == 1
+
+    def renew(self, owner: str) -> int:
+        """Extender el lease de todos los trabajos de este proceso."""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE bulk_jobs SET lease_until = ? WHERE owner = ? AND status IN (?, ?)",
+                (time.time() + JOB_LEASE_SECONDS, owner, QUEUED, RUNNING),
+            ).rowcount
+
+    def unfinished(self) -> list[str]:
+        """Trabajos a medias sin dueño vivo (sin owner o con el lease vencido)."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id FROM bulk_jobs WHERE status IN (?, ?) "
+                "AND (owner IS NULL OR lease_until IS NULL OR lease_until < ?) ORDER BY created_at",
+                (QUEUED, RUNNING, time.time()),
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def purge_old(self, days: int = JOB_RETENTION_DAYS) -> int:
+        cutoff = time.time() - days * 24 * 3600
+        with self._lock:
+            self._db.execute("BEGIN")
+            old = [r[0] for r in self._db.execute(
+                "SELECT id FROM bulk_jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+                (DONE, FAILED, WAITING_KEY, cutoff),
+            ).fetchall()]
+            for job_id in old:
+                self._db.execute("DELETE FROM bulk_job_nits WHERE job_id = ?", (job_id,))
+                self._db.execute("DELETE FROM bulk_jobs WHERE id = ?", (job_id,))
+            self._db.execute("COMMIT")
+        return len(old)
+
+
+class JobRunner:
+    """
+    Cola local de trabajos masivos con N workers.
+    procesar(nits, pro_key, is_pro) es un generador async de eventos
+    {"type": "result" | "progress" | "summary", ...} como main._bulk_eventos.
+    validar_pro(key) (main.is_pro) revalida la clave al arrancar cada trabajo PRO.
+    Cada proceso tiene su owner; un trabajo solo corre aquí si claim() lo dejó a
+    su nombre, y _renovar() extiende el lease y retoma trabajos huérfanos.
+    """
+
+    def __init__(self, store: JobStore, procesar, workers: int = BULK_JOB_WORKERS, validar_pro=None):
+        self.store = store
+        self.procesar = procesar
+        self.validar_pro = validar_pro
+        self.n_workers = workers
+        self.queue: asyncio.Queue | None = None
+        self.workers: list[asyncio.Task] = []
+        self.running: set[str] = set()
+        self.encolados: set[str] = set()
+        self._claves: dict[str, str] = {}  # job_id → clave PRO en claro (solo en memoria)
+        self.owner = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._renovador: asyncio.Task | None = None
+
+    def submit(self, job_id: str, pro_key: str = ""):
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        if pro_key:
+            self._claves[job_id] = pro_key
+        self.encolados.add(job_id)
+        self.queue.put_nowait(job_id)
+
+    def reanudar(self, job_id: str, pro_key: str) -> bool:
+        """
+        El dueño de un trabajo en WAITING_KEY volvió con su clave (ya verificada contra el hash).
+        Si varios procesos reciben el GET a la vez, solo uno lo toma.
+        """
+        if not self.store.claim(job_id, self.owner, desde=(WAITING_KEY,)):
+            return False
+        self.submit(job_id, pro_key)
+        return True
+
+    async def run_job(self, job_id: str):
+        if job_id in self.running or not self.store.claim(job_id, self.owner):
+            return  # Terminado, en espera de clave o de otro proceso con lease vigente
+        self.running.add(job_id)
+        try:
+            await self._run(job_id, self.store.get(job_id))
+        finally:
+            self.running.discard(job_id)
+
+    async def _revalidar_pro(self, job_id: str, job: dict) -> bool | None:
+        """
+        Estado PRO con el que corre el trabajo, o None si hay que esperar la
+        clave (trabajo PRO reanudado tras un reinicio: la clave no está en disco).
+        """
+        if not job["is_pro"]:
+            return False
+        key = self._claves.get(job_id)
+        if key is None:
+            return None
+        if self.validar_pro is not None and not await self.validar_pro(key):
+            logger.warning("[Job %s] La clave ya no es PRO: sigue sin consultas DIAN", job_id)
+            self.store.set_pro(job_id, False)
+            return False
+        return True
+
+    async def _run(self, job_id: str, job: dict):
+        is_pro = await self._revalidar_pro(job_id, job)
+        if is_pro is None:
+            logger.info("[Job %s] PRO reanudado sin clave en memoria: esperando a su dueño", job_id)
+            self.store.set_status(job_id, WAITING_KEY)
+            return
+        pending = self.store.pending(job_id)
+        if job["done"]:
+            logger.info("[Job %s] Reanudando: %d de %d NITs pendientes", job_id, len(pending), job["total"])
+        # Cada resultado va a su fila (idx); el NIT del resultado puede venir normalizado
+        sin_asignar = dict(pending)  # idx → nit, en orden
+        filas: dict[str, deque[int]] = {}
+        for idx, nit in pending:
+            filas.setdefault(nit, deque()).append(idx)
+        summary = {"credits_remaining": 0}
+        eventos = self.procesar([nit for _, nit in pending], self._claves.get(job_id, ""), is_pro) if pending else None
+        try:
+            if eventos is not None:
+                async for ev in eventos:
+                    if ev["type"] == "result":
+                        r = ev["result"]
+                        idx, cola = None, filas.get(r.get("nit", ""))
+                        while cola and idx is None:
+                            i = cola.popleft()
+                            idx = i if i in sin_asignar else None
+                        if idx is None and sin_asignar:
+                            idx = next(iter(sin_asignar))
+                            logger.warning("[Job %s] Resultado con NIT %r sin fila propia: va a la fila %d",
+                                           job_id, r.get("nit"), idx)
+                        if idx is None:
+                            continue
+                        del sin_asignar[idx]
+                        if not self.store.save_result(job_id, idx, ev["phase"], r, owner=self.owner):
+                            # El lease venció y otro proceso lo retomó: que lo termine él
+                            logger.warning("[Job %s] Lo tomó otro proceso: se deja de procesar aquí", job_id)
+                            self._claves.pop(job_id, None)
+                            return
+                    elif ev["type"] == "summary":
+                        summary = ev
+        except Exception as e:
+            logger.error("[Job %s] Error: %s", job_id, str(e)[:200])
+            self._claves.pop(job_id, None)
+            self.store.set_status(job_id, FAILED, error=str(e)[:200])
+            return
+        finally:
+            if eventos is not None:
+                await eventos.aclose()
+        self._claves.pop(job_id, None)
+        job = self.store.get(job_id)
+        self.store.set_status(job_id, DONE, summary={
+            "total": job["done"],
+            "cached": self.store.count_cached(job_id),
+            "dian_consulted": job["dian_consulted"],
+            "credits_remaining": summary.get("credits_remaining", 0),
+            "is_pro": job["is_pro"],
+        })
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            self.encolados.discard(job_id)
+            try:
+                await self.run_job(job_id)
+            finally:
+                self.queue.task_done()
+
+    def _retomar_huerfanos(self):
+        for job_id in self.store.unfinished():
+            if job_id not in self.running and job_id not in self.encolados:
+                self.submit(job_id)  # run_job lo toma solo si nadie más lo tiene
+
+    async def _renovar(self):
+        """Mantener vivo el lease de lo que tiene este proceso y retomar trabajos de procesos caídos."""
+        while True:
+            await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+            self.store.renew(self.owner)
+            self._retomar_huerfanos()
+
+    def start(self):
+        """Reencolar trabajos a medias (reinicio) y lanzar los workers."""
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+        self.store.purge_old()
+        self._retomar_huerfanos()
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.n_workers)]
+        if self._renovador is None:
+            self._renovador = asyncio.create_task(self._renovar())
+
+    async def stop(self):
+        tareas = self.workers + ([self._renovador] if self._renovador else [])
+        for t in tareas:
+            t.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self.workers = []
+        self._renovador = None
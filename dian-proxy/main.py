@@ -9,29 +9,36 @@ Límites:
 Endpoints:
   GET  /api/nit/{nit}         — Consulta individual
   POST /api/nit/bulk          — Consulta masiva (PRO: hasta 2,000)
+  POST /api/nit/bulk/stream   — Consulta masiva en streaming (NDJSON / SSE)
+  POST /api/nit/bulk/jobs     — Consulta masiva como trabajo asíncrono (retorna job_id)
+  GET  /api/nit/bulk/jobs/{id} — Estado y resultados del trabajo (polling o streaming)
   GET  /api/health            — Health check + estado circuit breaker
   GET  /api/stats             — Estadísticas
 """
 import asyncio
+import json
 import os
+import re
 import time
 from collections import defaultdict
 from datetime import datetime, timezone
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi import FastAPI, HTTPException, Request, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 from pydantic import BaseModel
 
-import httpx
-
 from cache import get_cache
 from chat import router as chat_router
 from ia import router as ia_router
-from dian_scraper import consultar_dian, circuit_breaker, browser_pool
-from fallback import consultar_fallback, _calc_dv
+from dian_scraper import consultar_dian, circuit_breaker, browser_pool, token_prefetcher, SesionMuisca, sesion_actual
+import http_clients
+from http_clients import get_client
+from fallback import consultar_fallback, buscar_datos_gov_lote, estado_fuentes, fallback_stats, _calc_dv, NO_ENCONTRADO
+from jobs import JobRunner, JobStore, DONE, FAILED, WAITING_KEY, clave_corresponde
+from scraper_queue import SCRAPER_MODE, ScrapeQueue, consultar_remoto
 
 import logging
 logger = logging.getLogger("exogenadian.main")
@@ -41,6 +48,8 @@ load_dotenv()
 # ─── Config ───
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "https://exogenadian.com").split(",")
 CACHE_TTL_DAYS = int(os.getenv("CACHE_TTL_DAYS", "30"))
+SWR_QUEUE_MAX = int(os.getenv("SWR_QUEUE_MAX", "200"))  # Refrescos pendientes máximos
+SWR_WORKERS = int(os.getenv("SWR_WORKERS", "2"))
 PORT = int(os.getenv("PORT", "8080"))
 
 # Claves PRO válidas — en producción esto vendría de tu base de datos/Google Sheet
@@ -52,6 +61,8 @@ FREE_DIAN_QUERIES_PER_DAY = 10
 FREE_MAX_BULK = 10
 PRO_MAX_BULK = 2000
 PRO_DIAN_CREDITS_PER_MONTH = 500  # Consultas DIAN en vivo incluidas con PRO
+BULK_PROGRESS_EVERY = 25  # Evento de progreso cada N resultados (streaming)
+JOB_POLL_SECONDS = 1.0  # Intervalo del streaming de un trabajo
 
 # ─── App ───
 app = FastAPI(
@@ -163,6 +174,126 @@ class ProCredits:
 
 pro_credits = ProCredits(PRO_DIAN_CREDITS_PER_MONTH)
 
+# ═══════════════════════════════════════════════════════════════
+#  SINGLE-FLIGHT (una sola consulta en vuelo por NIT)
+# ═══════════════════════════════════════════════════════════════
+
+class SingleFlight:
+    """
+    Agrupa consultas concurrentes de la misma llave: el primero lanza la
+    tarea y los demás esperan ese mismo resultado, en vez de abrir otra
+    sesión Playwright, otro captcha y otro fan-out de fallback.
+    """
+    def __init__(self):
+        self.inflight: dict[str, asyncio.Task] = {}
+        self.leaders = 0
+        self.coalesced = 0  # Consultas duplicadas ahorradas
+
+    async def do(self, key: str, fn):
+        task = self.inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(fn())
+            self.inflight[key] = task
+            task.add_done_callback(lambda _t: self.inflight.pop(key, None))
+        # shield: si un cliente se desconecta, la consulta sigue para los demás
+        return await asyncio.shield(task)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.inflight),
+            "lookups": self.leaders,
+            "coalesced": self.coalesced,
+        }
+
+
+nit_flight = SingleFlight()
+
+
+def _flight_key(nit: str, use_dian: bool, skip_fallback: bool = False, skip_datos_gov: bool = False) -> str:
+    """Solo comparten consulta las llamadas que resolverían igual (mismo modo y mismas fuentes)."""
+    return f"{nit}:{'dian' if use_dian else 'offline'}:{int(skip_fallback)}{int(skip_datos_gov)}"
+
+# SCRAPER_MODE=worker: la DIAN se consulta en procesos scraper_worker.py vía cola local
+scrape_queue = ScrapeQueue() if SCRAPER_MODE == "worker" else None
+SCRAPER_BULK_INFLIGHT = int(os.getenv("SCRAPER_BULK_INFLIGHT", "10"))  # NITs encolados a la vez por consulta masiva
+
+
+async def _consultar_dian(nit: str) -> dict:
+    """DIAN MUISCA en este proceso (inline) o a través de los workers de scraping."""
+    if scrape_queue is not None:
+        return await consultar_remoto(scrape_queue, nit)
+    return await consultar_dian(nit)
+
+
+# ═══════════════════════════════════════════════════════════════
+#  REFRESCO EN SEGUNDO PLANO (stale-while-revalidate)
+# ═══════════════════════════════════════════════════════════════
+
+class StaleRefresher:
+    """
+    Cola acotada de NITs servidos como stale que hay que volver a consultar.
+    Unos pocos workers la consumen a través del single-flight; si la cola
+    está llena el refresco se descarta (la entrada stale sigue sirviendo).
+    """
+    def __init__(self, maxsize: int = SWR_QUEUE_MAX, workers: int = SWR_WORKERS):
+        self.maxsize = maxsize
+        self.n_workers = workers
+        self.queue: asyncio.Queue | None = None
+        self.pending: set[str] = set()
+        self.workers: list[asyncio.Task] = []
+        self.counters = {"queued": 0, "refreshed": 0, "failed": 0, "dropped": 0}
+
+    def schedule(self, nit: str, use_dian: bool):
+        if nit in self.pending:
+            return
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.maxsize)
+        try:
+            self.queue.put_nowait((nit, use_dian))
+        except asyncio.QueueFull:
+            self.counters["dropped"] += 1
+            return
+        self.pending.add(nit)
+        self.counters["queued"] += 1
+
+    async def _worker(self):
+        while True:
+            nit, use_dian = await self.queue.get()
+            try:
+                result = await nit_flight.do(_flight_key(nit, use_dian), lambda: _resolver_nit(nit, use_dian))
+                self.counters["refreshed" if result.get("razon_social") else "failed"] += 1
+            except Exception as e:
+                self.counters["failed"] += 1
+                logger.warning("[SWR %s] Error refrescando: %s", nit, str(e)[:200])
+            finally:
+                self.pending.discard(nit)
+                self.queue.task_done()
+
+    def start(self):
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.maxsize)
+        if not self.workers:
+            self.workers = [asyncio.create_task(self._worker()) for _ in range(self.n_workers)]
+
+    async def stop(self):
+        for w in self.workers:
+            w.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self.pending),
+            "workers": len(self.workers),
+            **self.counters,
+        }
+
+
+stale_refresher = StaleRefresher()
+
 # Cache de claves PRO validadas: key → (valid: bool, timestamp: float)
 pro_keys_cache: dict[str, tuple[bool, float]] = {}
 PRO_KEY_CACHE_TTL = 3600
@@ -186,15 +317,16 @@ async def is_pro(key: str | None) -> bool:
             return valid
     # Validate against Google Sheets
     try:
-        async with httpx.AsyncClient(timeout=10.0, follow_redirects=True) as client:
-            resp = await client.get(
-                PRO_VALIDATION_URL,
-                params={"action": "validateKey", "key": key},
-            )
-            data = resp.json()
-            valid = data.get("valid", False)
-            pro_keys_cache[key] = (valid, time.time())
-            return valid
+        client = get_client("google")
+        resp = await client.get(
+            PRO_VALIDATION_URL,
+            follow_redirects=True,
+            params={"action": "validateKey", "key": key},
+        )
+        data = resp.json()
+        valid = data.get("valid", False)
+        pro_keys_cache[key] = (valid, time.time())
+        return valid
     except Exception as e:
         logger.warning("PRO validation error: %s", e)
         # On error, trust cache if available
@@ -253,40 +385,87 @@ def _build_response(raw: dict) -> dict:
         "cached": raw.get("cached", False),
         "error": raw.get("error", ""),
         "timestamp": datetime.now(timezone.utc).isoformat(),
+        **({"stale": True, "age_seconds": raw.get("age_seconds", 0)} if raw.get("stale") else {}),
     }
 
 
-async def _consultar_nit(nit: str, use_dian: bool = True) -> dict:
+async def _cache_get(nit: str, use_dian: bool) -> dict | None:
+    """Leer del caché; si la entrada es stale, encolar su refresco y servirla igual."""
+    cached = await cache.aget(nit, allow_stale=True)
+    if cached and cached.get("stale"):
+        stale_refresher.schedule(nit, use_dian)
+    return cached
+
+
+# Llamadas upstream evitadas gracias al caché negativo
+negative_stats = {"fallback_skipped": 0, "dian_skipped": 0}
+
+# Mensajes de la DIAN que confirman que el NIT no existe en el RUT
+_RE_DIAN_NO_INSCRITO = re.compile(r"no\s+est[aá]\s+inscrit|no\s+registrad", re.IGNORECASE)
+
+
+async def _consultar_nit(nit: str, use_dian: bool = True, skip_datos_gov: bool = False) -> dict:
     """Flujo completo: caché → DIAN → fallback."""
     nit = _clean_nit(nit)
     if not nit or not nit.isdigit() or len(nit) < 6 or len(nit) > 15:
         return _build_response({"nit": nit, "error": "NIT inválido (debe tener 6-15 dígitos)"})
 
-    # 1. Caché
-    cached = cache.get(nit)
+    # 1. Caché (stale-while-revalidate + negativo)
+    cached = await _cache_get(nit, use_dian)
+    skip_fallback = False
     if cached:
-        return _build_response(cached)
+        if not cached.get("negative"):
+            return _build_response(cached)
+        negative_stats["fallback_skipped"] += 1
+        if not use_dian or cached.get("dian_checked"):
+            negative_stats["dian_skipped"] += use_dian
+            return _build_response(cached)
+        # Negativo solo offline: falta preguntar a la DIAN, pero el fallback ya se sabe vacío
+        skip_fallback = True
+
+    # Si ya hay una consulta en vuelo para este NIT (mismo modo y fuentes), esperarla.
+    # Copia por llamador: los endpoints agregan campos propios al resultado.
+    key = _flight_key(nit, use_dian, skip_fallback, skip_datos_gov)
+    return dict(await nit_flight.do(key, lambda: _resolver_nit(nit, use_dian, skip_fallback, skip_datos_gov)))
+
+
+async def _resolver_nit(nit: str, use_dian: bool, skip_fallback: bool = False,
+                        skip_datos_gov: bool = False) -> dict:
+    """DIAN → fallback para un NIT ya limpio que no está en caché."""
+    dian_no_inscrito = False
 
     # 2. DIAN MUISCA (si permitido)
     if use_dian:
         try:
-            dian_result = await consultar_dian(nit)
+            dian_result = await _consultar_dian(nit)
             if dian_result:
                 dian_error = dian_result.get("error", "")
                 if dian_error:
                     logger.warning("[NIT %s] DIAN error: %s", nit, dian_error[:200])
+                    dian_no_inscrito = bool(_RE_DIAN_NO_INSCRITO.search(dian_error))
                 if not dian_error and not dian_result.get("_circuit_open"):
                     dian_result["dv"] = _calc_dv(nit)
-                    cache.set(nit, dian_result)
+                    await cache.aset(nit, dian_result)
                     return _build_response(dian_result)
         except Exception as e:
             logger.error("[NIT %s] DIAN exception: %s", nit, str(e)[:200])
 
     # 3. Fallback (RUES, datos.gov.co, Einforma, web)
     try:
-        fb_result = await consultar_fallback(nit)
+        if skip_fallback:
+            fb_result = {
+                "nit": nit,
+                "dv": _calc_dv(nit),
+                "fuente": NO_ENCONTRADO,
+                "error": "NIT no encontrado en ninguna fuente",
+            }
+        else:
+            fb_result = await consultar_fallback(nit, skip_datos_gov=skip_datos_gov)
         if fb_result and fb_result.get("razon_social"):
-            cache.set(nit, fb_result)
+            await cache.aset(nit, fb_result)
+        elif fb_result and fb_result.get("fuente") == NO_ENCONTRADO and (not skip_fallback or dian_no_inscrito):
+            # Solo si alguna fuente contestó sin el NIT; "Sin respuesta" (caída) no se cachea
+            await cache.aset_negative(nit, fb_result, dian_checked=dian_no_inscrito)
         return _build_response(fb_result)
     except Exception as e:
         return _build_response({"nit": nit, "error": f"Error: {str(e)[:200]}", "fuente": "Error"})
@@ -329,22 +508,14 @@ async def consultar_nit_individual(
             return result
 
 
-@app.post("/api/nit/bulk")
-async def consultar_nit_masivo(req: BulkRequest, request: Request):
-    """
-    Consulta masiva de NITs.
-    Gratis: máximo 10 NITs, solo offline.
-    PRO: hasta 2,000 NITs. DIAN en vivo usa créditos mensuales (500/mes incluidos).
-    Flujo PRO: caché → listas/fallback → DIAN (solo los no encontrados, gasta créditos).
-    """
-    user_is_pro = await is_pro(req.pro_key)
-
-    if not req.nits:
+def _validar_bulk(nits: list[str], user_is_pro: bool) -> list[str]:
+    """Validar límites del plan y retornar los NITs limpios y sin duplicados."""
+    if not nits:
         raise HTTPException(status_code=400, detail="Lista de NITs vacía")
 
     max_allowed = PRO_MAX_BULK if user_is_pro else FREE_MAX_BULK
 
-    if len(req.nits) > max_allowed:
+    if len(nits) > max_allowed:
         if user_is_pro:
             raise HTTPException(status_code=400, detail=f"Máximo {PRO_MAX_BULK} NITs por consulta")
         else:
@@ -359,58 +530,156 @@ async def consultar_nit_masivo(req: BulkRequest, request: Request):
             )
 
     # Deduplicar y limpiar
-    clean_nits = list(dict.fromkeys(_clean_nit(n) for n in req.nits if _clean_nit(n)))
+    return list(dict.fromkeys(_clean_nit(n) for n in nits if _clean_nit(n)))
+
+
+async def _consultar_concurrente(nits: list[str], use_dian: bool, limite: int, skip_datos_gov: bool = False,
+                                 con_datos_gov: set[str] = frozenset()):
+    """
+    Consultar NITs con concurrencia limitada, entregando cada resultado apenas termina.
+    con_datos_gov: NITs que consultan datos.gov.co aunque skip_datos_gov (su lote falló).
+    """
+    semaphore = asyncio.Semaphore(limite)
+
+    async def _uno(nit):
+        async with semaphore:
+            return await _consultar_nit(nit, use_dian=use_dian,
+                                        skip_datos_gov=skip_datos_gov and nit not in con_datos_gov)
+
+    tasks = [asyncio.ensure_future(_uno(n)) for n in nits]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        # Si el cliente se desconecta, no dejar consultas huérfanas
+        for t in tasks:
+            t.cancel()
+
+
+async def _consultar_en_sesiones(nits: list[str], limite: int):
+    """
+    Consultar NITs en la DIAN con `limite` sesiones MUISCA: cada worker toma
+    NITs de una cola y los consulta en la misma página (sin navegar ni, si el
+    formulario no lo vuelve a pedir, resolver CAPTCHA por NIT).
+    """
+    pendientes: asyncio.Queue = asyncio.Queue()
+    for nit in nits:
+        pendientes.put_nowait(nit)
+    salida: asyncio.Queue = asyncio.Queue()
+
+    async def _worker():
+        async with SesionMuisca() as sesion:
+            sesion_actual.set(sesion)
+            while not pendientes.empty():
+                nit = pendientes.get_nowait()
+                try:
+                    r = await _consultar_nit(nit, use_dian=True)
+                except Exception as e:
+                    logger.error("[Bulk] Error consultando %s en DIAN: %s", nit, str(e)[:200])
+                    r = _build_response({"nit": nit, "error": "Error consultando DIAN"})
+                await salida.put(r)
+
+    workers = [asyncio.ensure_future(_worker()) for _ in range(min(limite, len(nits)))]
+    try:
+        for _ in nits:
+            yield await salida.get()
+    finally:
+        # Si el cliente se desconecta, no dejar consultas huérfanas
+        for t in workers:
+            t.cancel()
+
+
+async def _bulk_eventos(clean_nits: list[str], pro_key: str, user_is_pro: bool):
+    """
+    Flujo masivo como eventos, en el orden en que se resuelven:
+      {"type": "result", "phase": ..., "result": {...}}  — un NIT resuelto
+      {"type": "progress", "phase": ..., "done": n, "total": N}
+      {"type": "summary", "total", "cached", "dian_consulted", "credits_remaining", "is_pro"}
+    Flujo PRO: caché → listas/fallback → DIAN (solo los no encontrados, gasta créditos).
+    """
+    total = len(clean_nits)
+    done = 0
+    cached_count = 0
+    dian_consulted = 0
+
+    def _resultado(fase: str, r: dict) -> dict:
+        nonlocal done, cached_count
+        done += 1
+        cached_count += bool(r.get("cached"))
+        return {"type": "result", "phase": fase, "result": r}
+
+    def _progreso(fase: str) -> dict:
+        return {"type": "progress", "phase": fase, "done": done, "total": total}
 
-    results = []
     pending_offline = []
+    pending_dian = []
 
-    # Fase 1: buscar en caché
+    # Fase 1: buscar en caché (una sola lectura del nivel frío para todo el lote)
+    en_cache = await cache.aget_many(clean_nits, allow_stale=True)
     for nit in clean_nits:
-        cached = cache.get(nit)
-        if cached:
-            results.append(_build_response(cached))
-        else:
+        cached = en_cache.get(nit)
+        if cached and cached.get("stale"):
+            stale_refresher.schedule(nit, False)
+        if not cached:
             pending_offline.append(nit)
+        elif cached.get("negative") and not cached.get("dian_checked"):
+            # Ya se sabe que el fallback no lo tiene: pasa directo a la fase DIAN
+            negative_stats["fallback_skipped"] += 1
+            pending_dian.append(nit)
+        else:
+            yield _resultado("cache", _build_response(cached))
+    yield _progreso("cache")
 
-    # Fase 2: consultar faltantes por fallback offline (gratis, no gasta créditos)
-    pending_dian = []
+    # Fase 2: consultar faltantes por fallback offline (gratis, no gasta créditos).
+    # Primero datos.gov.co por lotes para todo el conjunto; luego las fuentes
+    # por NIT solo para lo que falte, sin repetir datos.gov.co salvo para los
+    # NITs cuyo bloque falló (datos.gov.co no respondió por ellos).
     if pending_offline:
-        semaphore = asyncio.Semaphore(50)
-
-        async def _offline(nit):
-            async with semaphore:
-                return await _consultar_nit(nit, use_dian=False)
-
-        offline_results = await asyncio.gather(*[_offline(n) for n in pending_offline])
-        for r in offline_results:
+        try:
+            lote, lote_sin_respuesta = await buscar_datos_gov_lote(pending_offline)
+        except Exception as e:
+            logger.warning("[Bulk] datos.gov.co por lote falló: %s", str(e)[:200])
+            lote, lote_sin_respuesta = {}, set(pending_offline)
+        await cache.aset_many(lote)
+        for nit, info in lote.items():
+            yield _resultado("offline", _build_response(info))
+        yield _progreso("offline")
+        restantes = [n for n in pending_offline if n not in lote]
+        async for r in _consultar_concurrente(restantes, use_dian=False, limite=50, skip_datos_gov=True,
+                                              con_datos_gov=lote_sin_respuesta):
             if r.get("razon_social"):
-                results.append(r)
+                yield _resultado("offline", r)
+                if done % BULK_PROGRESS_EVERY == 0:
+                    yield _progreso("offline")
             else:
                 pending_dian.append(r["nit"])
+        yield _progreso("offline")
 
     # Fase 3: PRO — consultar DIAN en vivo los que no se encontraron (gasta créditos)
-    dian_consulted = 0
     if user_is_pro and pending_dian:
-        credits_available = pro_credits.get_remaining(req.pro_key)
+        credits_available = pro_credits.get_remaining(pro_key)
         # Limitar a créditos disponibles
         nits_for_dian = pending_dian[:credits_available]
         skipped = pending_dian[credits_available:]
 
         if nits_for_dian:
-            semaphore = asyncio.Semaphore(3)
-
-            async def _dian(nit):
-                async with semaphore:
-                    return await _consultar_nit(nit, use_dian=True)
-
-            dian_results = await asyncio.gather(*[_dian(n) for n in nits_for_dian])
-            results.extend(dian_results)
-            dian_consulted = len(nits_for_dian)
-            pro_credits.consume(req.pro_key, dian_consulted)
+            if scrape_queue is not None:
+                # Las sesiones MUISCA y la pre-resolución de tokens viven en los workers
+                consultas = _consultar_concurrente(nits_for_dian, use_dian=True, limite=SCRAPER_BULK_INFLIGHT)
+            else:
+                # Que haya tokens Turnstile pre-resueltos desde el primer NIT
+                token_prefetcher.anticipar(len(nits_for_dian))
+                consultas = _consultar_en_sesiones(nits_for_dian, limite=3)
+            async for r in consultas:
+                # Crédito por consulta terminada: si el cliente corta, solo se cobra lo hecho
+                pro_credits.consume(pro_key, 1)
+                dian_consulted += 1
+                yield _resultado("dian", r)
+                yield _progreso("dian")
 
         # Los que no se pudieron consultar por falta de créditos
         for nit in skipped:
-            results.append(_build_response({
+            yield _resultado("sin_creditos", _build_response({
                 "nit": nit,
                 "dv": _calc_dv(nit),
                 "error": "Sin créditos DIAN disponibles este mes",
@@ -419,24 +688,141 @@ async def consultar_nit_masivo(req: BulkRequest, request: Request):
     elif not user_is_pro and pending_dian:
         # Free: agregar los no encontrados sin DIAN
         for nit in pending_dian:
-            results.append(_build_response({
+            yield _resultado("no_encontrado", _build_response({
                 "nit": nit,
                 "dv": _calc_dv(nit),
                 "fuente": "No encontrado (activa PRO para consultar DIAN)",
             }))
 
-    credits_remaining = pro_credits.get_remaining(req.pro_key) if user_is_pro else 0
-
-    return {
-        "total": len(results),
-        "cached": sum(1 for r in results if r.get("cached")),
+    yield {
+        "type": "summary",
+        "total": done,
+        "cached": cached_count,
         "dian_consulted": dian_consulted,
-        "credits_remaining": credits_remaining,
+        "credits_remaining": pro_credits.get_remaining(pro_key) if user_is_pro else 0,
         "is_pro": user_is_pro,
-        "results": results,
     }
 
 
+@app.post("/api/nit/bulk")
+async def consultar_nit_masivo(req: BulkRequest, request: Request):
+    """
+    Consulta masiva de NITs.
+    Gratis: máximo 10 NITs, solo offline.
+    PRO: hasta 2,000 NITs. DIAN en vivo usa créditos mensuales (500/mes incluidos).
+    Flujo PRO: caché → listas/fallback → DIAN (solo los no encontrados, gasta créditos).
+    """
+    user_is_pro = await is_pro(req.pro_key)
+    clean_nits = _validar_bulk(req.nits, user_is_pro)
+
+    results = []
+    summary = {}
+    async for ev in _bulk_eventos(clean_nits, req.pro_key, user_is_pro):
+        if ev["type"] == "result":
+            results.append(ev["result"])
+        elif ev["type"] == "summary":
+            summary = {k: v for k, v in ev.items() if k != "type"}
+
+    return {**summary, "results": results}
+
+
+@app.post("/api/nit/bulk/stream")
+async def consultar_nit_masivo_stream(req: BulkRequest, request: Request):
+    """
+    Igual que /api/nit/bulk pero en streaming: cada NIT se envía apenas se
+    resuelve (primero los de caché), con eventos de progreso y un resumen final.
+    Formato NDJSON (una línea JSON por evento); con Accept: text/event-stream, SSE.
+    """
+    user_is_pro = await is_pro(req.pro_key)
+    clean_nits = _validar_bulk(req.nits, user_is_pro)
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def _cuerpo():
+        async for ev in _bulk_eventos(clean_nits, req.pro_key, user_is_pro):
+            line = json.dumps(ev, ensure_ascii=False)
+            yield f"event: {ev['type']}\ndata: {line}\n\n" if sse else line + "\n"
+
+    return StreamingResponse(
+        _cuerpo(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# ─── Trabajos masivos asíncronos ───
+job_runner = JobRunner(JobStore(), _bulk_eventos, validar_pro=is_pro)
+
+
+def _job_publico(job: dict) -> dict:
+    return {k: v for k, v in job.items() if k != "key_hash"}
+
+
+@app.post("/api/nit/bulk/jobs", status_code=202)
+async def crear_trabajo_masivo(req: BulkRequest):
+    """
+    Encolar una consulta masiva y retornar su job_id de inmediato.
+    El trabajo se guarda en disco: sobrevive reinicios y se reanuda sin
+    volver a consultar (ni cobrar) los NITs ya resueltos.
+    """
+    user_is_pro = await is_pro(req.pro_key)
+    clean_nits = _validar_bulk(req.nits, user_is_pro)
+    job_id = job_runner.store.create(clean_nits, req.pro_key, user_is_pro, owner=job_runner.owner)
+    job_runner.submit(job_id, req.pro_key)
+    return {"job_id": job_id, "status": "queued", "total": len(clean_nits)}
+
+
+@app.get("/api/nit/bulk/jobs/{job_id}")
+async def consultar_trabajo_masivo(
+    job_id: str,
+    after: int = Query(0, ge=0),
+    stream: bool = False,
+    x_pro_key: str | None = Header(None),
+):
+    """
+    Estado del trabajo y resultados con seq > after (polling incremental).
+    Con stream=true: NDJSON con cada resultado a medida que se guarda y un
+    resumen final cuando el trabajo termina.
+    X-Pro-Key debe ser la misma clave con la que se creó el trabajo (vacía si
+    se creó sin clave). Un trabajo PRO en espera tras un reinicio se reanuda
+    con esa clave.
+    """
+    job = job_runner.store.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if not clave_corresponde(job, x_pro_key):
+        raise HTTPException(status_code=403, detail="La clave no corresponde a este trabajo")
+    if job["status"] == WAITING_KEY:
+        job_runner.reanudar(job_id, x_pro_key.strip())
+        job = job_runner.store.get(job_id)
+
+    if not stream:
+        results = job_runner.store.results(job_id, after)
+        return {
+            **_job_publico(job),
+            "next_after": results[-1]["seq"] if results else after,
+            "results": results,
+        }
+
+    async def _cuerpo():
+        cursor = after
+        while True:
+            job = job_runner.store.get(job_id)
+            for r in job_runner.store.results(job_id, cursor):
+                cursor = r["seq"]
+                yield json.dumps({"type": "result", **r}, ensure_ascii=False) + "\n"
+            if job["status"] in (DONE, FAILED):
+                yield json.dumps({"type": "summary", **_job_publico(job)}, ensure_ascii=False) + "\n"
+                return
+            yield json.dumps({"type": "progress", "done": job["done"], "total": job["total"]}) + "\n"
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(
+        _cuerpo(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.get("/api/remaining")
 async def get_remaining(request: Request, x_pro_key: str | None = Header(None)):
     """Consultar cuántas consultas DIAN quedan (gratis por día, PRO por mes)."""
@@ -459,7 +845,7 @@ async def health_check(x_debug_key: str | None = Header(None)):
     debug_secret = os.getenv("DEBUG_KEY", "")
     is_admin = debug_secret and x_debug_key == debug_secret
 
-    cb_status = circuit_breaker.get_status()
+    cb_status = _circuit_breaker_status()
     dian_ok = cb_status["state"] != "OPEN"
 
     # Respuesta pública: solo status
@@ -489,26 +875,55 @@ async def health_check(x_debug_key: str | None = Header(None)):
         "dian_available": dian_ok,
         "services": services,
         "circuit_breaker": cb_status,
+        "fallback_sources": estado_fuentes(),
         "timestamp": datetime.now(timezone.utc).isoformat(),
-        "cache": cache.stats(),
+        "cache": await cache.astats(),
+        "single_flight": nit_flight.stats(),
+        "stale_refresh": stale_refresher.stats(),
+        "negative_cache": negative_stats,
+        "http_pools": http_clients.stats(),
+        "fallback": fallback_stats,
+        "browser_pool": browser_pool.stats(),
+        "turnstile_prefetch": token_prefetcher.stats(),
+        "scraper": _scraper_stats(),
     }
 
 
+def _scraper_stats() -> dict:
+    return {"mode": SCRAPER_MODE, **(scrape_queue.stats() if scrape_queue is not None else {})}
+
+
+def _circuit_breaker_status() -> dict:
+    """En modo worker la DIAN la consultan los workers: su breaker (heartbeats) es el que cuenta."""
+    if scrape_queue is not None:
+        return scrape_queue.circuit_breaker()
+    return circuit_breaker.get_status()
+
+
 @app.get("/api/stats")
 async def stats(x_debug_key: str | None = Header(None)):
     """Stats protegido — requiere DEBUG_KEY."""
     debug_secret = os.getenv("DEBUG_KEY", "")
     if not debug_secret or x_debug_key != debug_secret:
         raise HTTPException(status_code=404, detail="Not found")
-    from captcha_solver import get_balance
+    from captcha_solver import get_balance, stats as captcha_stats
     try:
         balance = await get_balance()
     except Exception:
         balance = -1
     return {
-        "cache": cache.stats(),
+        "cache": await cache.astats(),
+        "single_flight": nit_flight.stats(),
+        "stale_refresh": stale_refresher.stats(),
+        "negative_cache": negative_stats,
+        "http_pools": http_clients.stats(),
+        "fallback": fallback_stats,
+        "browser_pool": browser_pool.stats(),
+        "turnstile_prefetch": token_prefetcher.stats(),
+        "capsolver_polling": captcha_stats(),
+        "scraper": _scraper_stats(),
         "capsolver_balance": balance,
-        "circuit_breaker": circuit_breaker.get_status(),
+        "circuit_breaker": _circuit_breaker_status(),
         "timestamp": datetime.now(timezone.utc).isoformat(),
     }
 
@@ -524,7 +939,7 @@ async def debug_nit(nit: str, x_debug_key: str | None = Header(None)):
 
     # 1. DIAN
     try:
-        dian_result = await consultar_dian(nit)
+        dian_result = await _consultar_dian(nit)
         results["dian"] = dian_result
     except Exception as e:
         results["dian"] = {"error": str(e), "traceback": traceback.format_exc()[-500:]}
@@ -554,9 +969,21 @@ async def debug_nit(nit: str, x_debug_key: str | None = Header(None)):
     return results
 
 
+@app.on_event("startup")
+async def startup_event():
+    cache.start_sweeper()
+    stale_refresher.start()
+    job_runner.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_event():
+    await job_runner.stop()
+    await http_clients.cerrar_clientes()
+    await stale_refresher.stop()
+    await cache.stop_sweeper()
     cache.flush()
+    await token_prefetcher.stop()
     await browser_pool.shutdown()
 
 
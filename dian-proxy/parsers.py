@@ -0,0 +1,154 @@
+"""
+Extracción de texto y datos desde el HTML de las fuentes de fallback.
+
+Compartido por fallback.py y por buscar_info_terceros de la app Streamlit
+(1_Generar_Formatos.py), que lo importa desde esta carpeta.
+
+- Los patrones se compilan una sola vez al importar el módulo; los que
+  dependen del NIT se compilan una vez por NIT (lru_cache).
+- Los patrones anclados al NIT solo se prueban alrededor de cada aparición
+  del NIT (primera_cerca_del_nit), no sobre la página entera.
+- html_a_texto() usa un parser en C: selectolax (lexbor) si está instalado,
+  si no lxml, y como último recurso la sustitución por regex de siempre.
+  Con parser se descartan <script>/<style> (menos texto que recorrer y sin
+  falsos positivos de CSS/JS) y se decodifican entidades (&amp; → &).
+
+Benchmark sobre páginas guardadas: python -m tests.bench_parsers
+"""
+import logging
+import re
+from functools import lru_cache
+
+logger = logging.getLogger("exogenadian.parsers")
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as _SelectolaxParser
+except ImportError:  # pragma: no cover - depende del entorno
+    _SelectolaxParser = None
+try:
+    import lxml.html as _lxml_html
+    from lxml import etree as _lxml_etree
+except ImportError:  # pragma: no cover
+    _lxml_html = None
+
+# Backends disponibles, en orden de preferencia
+BACKENDS = [
+    nombre for nombre, disponible in (
+        ("selectolax", _SelectolaxParser is not None),
+        ("lxml", _lxml_html is not None),
+        ("regex", True),
+    ) if disponible
+]
+BACKEND = BACKENDS[0]
+
+# ── Patrones sobre el HTML crudo ──
+RE_TAG = re.compile(r"<[^>]+>")
+RE_NO_DIGITOS = re.compile(r"[^0-9]")
+RE_H1 = re.compile(r"<h1[^>]*>([^<]+)</h1>", re.IGNORECASE)
+RE_H1_NOMBRE = re.compile(r'<h1[^>]*class="[^"]*nombre[^"]*"[^>]*>([^<]+)</h1>', re.IGNORECASE)
+RE_TITLE = re.compile(r"<title>([^<]+?)[\s\-|]")
+RE_DIR_ETIQUETA = re.compile(r"(?:Direcci[oó]n|Domicilio)[:\s]*</[^>]+>\s*<[^>]+>([^<]+)", re.IGNORECASE)
+
+# ── Patrones sobre el texto plano ──
+RE_DIR_COMERCIAL = re.compile(r"[Dd]irecci[oó]n\s+comercial\s+es\s+([^.]{5,100})")
+RE_ESTADO = re.compile(r"en\s+estado\s+(ACTIVA|CANCELADA|INACTIVA)", re.IGNORECASE)
+RE_SUFIJO_SITIO = re.compile(r"\s*[-–]\s*(edirectorio|registronit|einforma|empresite).*$", re.IGNORECASE)
+RE_DIRECCIONES = (
+    re.compile(
+        r"(?:Direcci[oó]n|Dir\.?|Ubicaci[oó]n)[:\s]+([A-Za-z]{2,3}[\s.]*(?:No\.?\s*)?\d+[\w\s#\-.,No°]+?\d)",
+        re.IGNORECASE,
+    ),
+    re.compile(
+        r"((?:CL|CR|KR|TV|DG|CALLE|CARRERA|AV|AVENIDA|TRANSVERSAL|DIAGONAL)[\s.]*(?:No\.?\s*)?\d+[\w\s#\-.,No°]*\d)",
+        re.IGNORECASE,
+    ),
+)
+
+_LETRA = "A-Za-záéíóúñÁÉÍÓÚÑ"
+_MAYUS = "A-ZÁÉÍÓÚÑ"
+
+
+@lru_cache(maxsize=4096)
+def patrones_razon_social(nit: str) -> tuple[re.Pattern, ...]:
+    """Razón social junto al NIT en resultados de búsqueda (fallback.buscar_web)."""
+    n = re.escape(str(nit))
+    return (
+        re.compile(r"(?:NIT|Nit|nit)[\s.:]*" + n + rf"[\s\-–—:,.]+([{_LETRA}][{_LETRA}\s&.,]+)"),
+        re.compile(rf"([{_LETRA}][{_LETRA}\s&.,]{{5,50}}?)[\s\-–—:,.]+(?:NIT|Nit|nit)[\s.:]*" + n),
+        re.compile(rf"([{_LETRA}][{_LETRA}\s&.,]{{3,60}}?)\s*-\s*" + n),
+    )
+
+
+@lru_cache(maxsize=4096)
+def patrones_razon_social_mayusculas(nit: str) -> tuple[re.Pattern, ...]:
+    """Variante solo en mayúsculas que usa la app Streamlit (extraer_info_web)."""
+    n = re.escape(str(nit))
+    return (
+        re.compile(r"(?:NIT|Nit|nit)[\s.:]*" + n + rf"[\s\-–—:,.]+([{_MAYUS}][{_MAYUS}\s&.,]+)"),
+        re.compile(rf"([{_MAYUS}][{_MAYUS}\s&.,]{{5,50}}?)[\s\-–—:,.]+(?:NIT|Nit|nit)[\s.:]*" + n),
+        re.compile(rf"([{_MAYUS}][{_MAYUS}\s&.,]{{5,50}}?)\s*[-–—]\s*NIT[\s.:]*" + n),
+    )
+
+
+# Caracteres alrededor de cada aparición del NIT donde buscar la razón social.
+# Cubre el grupo más largo de los patrones (61) más separadores, y el límite de
+# 80/120 caracteres con que los llamadores descartan candidatas.
+MARGEN_NIT = 150
+
+
+def primera_cerca_del_nit(patron: re.Pattern, texto: str, nit: str) -> str | None:
+    """
+    Primer grupo de `patron` (uno de patrones_razon_social*) en `texto`.
+    Los patrones exigen el NIT literal, así que en vez de recorrer la página
+    entera (cuantificadores perezosos probados desde cada letra) se prueban
+    solo ventanas alrededor de cada aparición del NIT, en orden.
+    """
+    inicio = texto.find(nit)
+    while inicio != -1:
+        desde = max(0, inicio - MARGEN_NIT)
+        m = patron.search(texto, desde, inicio + len(nit) + MARGEN_NIT)
+        if m:
+            return m.group(1)
+        inicio = texto.find(nit, inicio + 1)
+    return None
+
+
+def _colapsar(texto: str) -> str:
+    # str.split() colapsa espacios Unicode (incluido &nbsp;) varias veces más rápido que \s+
+    return " ".join(texto.split())
+
+
+def _texto_regex(html: str) -> str:
+    return _colapsar(RE_TAG.sub(" ", html))
+
+
+def _texto_selectolax(html: str) -> str:
+    tree = _SelectolaxParser(html)
+    tree.strip_tags(["script", "style", "noscript"])
+    root = tree.root
+    return _colapsar(root.text(separator=" ")) if root is not None else ""
+
+
+def _texto_lxml(html: str) -> str:
+    doc = _lxml_html.document_fromstring(html)
+    _lxml_etree.strip_elements(doc, "script", "style", "noscript", with_tail=False)
+    return _colapsar(" ".join(doc.itertext()))
+
+
+_FUNCIONES = {"selectolax": _texto_selectolax, "lxml": _texto_lxml, "regex": _texto_regex}
+
+
+def html_a_texto(html: str, backend: str | None = None) -> str:
+    """
+    Texto visible de una página con los espacios colapsados. Cada etiqueta
+    cuenta como separador, igual que la sustitución por regex original.
+    """
+    if not html:
+        return ""
+    backend = backend or BACKEND
+    try:
+        return _FUNCIONES[backend](html)
+    except Exception as e:
+        # HTML que el parser no acepta (p. ej. declaración XML con str): regex
+        logger.debug("html_a_texto con %s falló: %s", backend, e)
+        return _texto_regex(html)
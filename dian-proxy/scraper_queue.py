@@ -0,0 +1,229 @@
+"""
+Cola local de consultas DIAN entre la API y los procesos scraper_worker.py.
+
+Con SCRAPER_MODE=worker la API no abre Chromium: encola el NIT en SQLite
+(SCRAPER_QUEUE_FILE, compartido por los procesos de la instancia) y espera
+el resultado. Uno o varios workers (python scraper_worker.py) toman tareas,
+consultan MUISCA con su propio BrowserPool y escriben el resultado, así la
+capacidad de scraping escala con el número de workers y no compite con la
+latencia de la API.
+
+Una tarea tomada por un worker que murió vuelve a la cola tras
+SCRAPER_TASK_TIMEOUT, hasta SCRAPER_MAX_ATTEMPTS intentos: un NIT que tumba
+al worker cada vez se cierra con error en vez de reencolarse para siempre.
+Con SCRAPER_MODE=inline (por defecto) nada de esto se
+usa y la API consulta la DIAN en su propio proceso, como siempre.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+
+logger = logging.getLogger("exogenadian.scraper_queue")
+
+SCRAPER_MODE = os.getenv("SCRAPER_MODE", "inline").lower()  # inline | worker
+SCRAPER_QUEUE_FILE = Path(os.getenv("SCRAPER_QUEUE_FILE", str(Path(__file__).parent / "scraper_queue.db")))
+SCRAPER_TASK_TIMEOUT = int(os.getenv("SCRAPER_TASK_TIMEOUT", "180"))  # Tarea tomada sin resultado → se reencola
+SCRAPER_MAX_ATTEMPTS = int(os.getenv("SCRAPER_MAX_ATTEMPTS", "3"))  # Tomas antes de cerrar la tarea con error
+SCRAPER_RESULT_TIMEOUT = int(os.getenv("SCRAPER_RESULT_TIMEOUT", "150"))  # Espera máxima de la API
+SCRAPER_WORKER_VIGENCIA = 30  # Segundos sin heartbeat para dar un worker por caído
+SCRAPER_RETENCION = 3600  # Resultados entregados que se guardan (segundos)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrape_tasks (
+    id          TEXT PRIMARY KEY,
+    nit         TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    worker      TEXT,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    result      TEXT,
+    created_at  REAL NOT NULL,
+    claimed_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_tasks_status ON scrape_tasks (status, created_at);
+CREATE INDEX IF NOT EXISTS idx_scrape_tasks_nit ON scrape_tasks (nit, status);
+CREATE TABLE IF NOT EXISTS scrape_workers (
+    worker  TEXT PRIMARY KEY,
+    pid     INTEGER NOT NULL,
+    seen_at REAL NOT NULL,
+    stats   TEXT
+);
+"""
+
+# Estados de una tarea
+PENDING, CLAIMED, DONE = "pending", "claimed", "done"
+
+
+def _resultado_fallido(nit: str, intentos: int) -> dict:
+    return {
+        "nit": nit,
+        "error": f"La consulta DIAN no terminó tras {intentos} intentos (el worker se cayó)",
+        "fuente": "DIAN MUISCA (worker)",
+    }
+
+
+class ScrapeQueue:
+    """Tareas NIT → resultado en SQLite (WAL), seguras entre procesos."""
+
+    def __init__(self, path: Path | str = SCRAPER_QUEUE_FILE):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        self.counters = {"submitted": 0, "deduplicated": 0, "requeued": 0, "abandoned": 0, "timeouts": 0}
+
+    def submit(self, nit: str) -> str:
+        """Encolar un NIT. Si ya hay una tarea sin resultado para ese NIT, se comparte."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            row = self._db.execute(
+                "SELECT id FROM scrape_tasks WHERE nit = ? AND status IN (?, ?) LIMIT 1", (nit, PENDING, CLAIMED)
+            ).fetchone()
+            if row:
+                self._db.execute("COMMIT")
+                self.counters["deduplicated"] += 1
+                return row[0]
+            task_id = uuid.uuid4().hex
+            self._db.execute(
+                "INSERT INTO scrape_tasks (id, nit, status, created_at) VALUES (?, ?, ?, ?)",
+                (task_id, nit, PENDING, time.time()),
+            )
+            self._db.execute("COMMIT")
+        self.counters["submitted"] += 1
+        return task_id
+
+    def claim(self, worker: str, n: int = 1) -> list[tuple[str, str]]:
+        """Tomar hasta n tareas pendientes (las más antiguas). Retorna [(task_id, nit)]."""
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            # Tareas de un worker que murió sin escribir resultado: las que ya
+            # agotaron sus intentos se cierran con error, el resto se reencola
+            agotadas = self._db.execute(
+                "SELECT id, nit, attempts FROM scrape_tasks WHERE status = ? AND claimed_at < ? AND attempts >= ?",
+                (CLAIMED, now - SCRAPER_TASK_TIMEOUT, SCRAPER_MAX_ATTEMPTS),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE scrape_tasks SET status = ?, worker = NULL, result = ?, finished_at = ? WHERE id = ?",
+                [(DONE, json.dumps(_resultado_fallido(nit, intentos), ensure_ascii=False), now, task_id)
+                 for task_id, nit, intentos in agotadas],
+            )
+            requeued = self._db.execute(
+                "UPDATE scrape_tasks SET status = ?, worker = NULL WHERE status = ? AND claimed_at < ?",
+                (PENDING, CLAIMED, now - SCRAPER_TASK_TIMEOUT),
+            ).rowcount
+            rows = self._db.execute(
+                "SELECT id, nit FROM scrape_tasks WHERE status = ? ORDER BY created_at LIMIT ?", (PENDING, n)
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE scrape_tasks SET status = ?, worker = ?, claimed_at = ?, attempts = attempts + 1 WHERE id = ?",
+                [(CLAIMED, worker, now, task_id) for task_id, _ in rows],
+            )
+            self._db.execute("COMMIT")
+        if requeued:
+            self.counters["requeued"] += requeued
+            logger.warning("[ScrapeQueue] %d tareas reencoladas (worker sin respuesta)", requeued)
+        if agotadas:
+            self.counters["abandoned"] += len(agotadas)
+            logger.error("[ScrapeQueue] %d tareas cerradas con error tras %d intentos: %s", len(agotadas),
+                         SCRAPER_MAX_ATTEMPTS, ", ".join(nit for _, nit, _ in agotadas)[:200])
+        return rows
+
+    def complete(self, task_id: str, result: dict):
+        with self._lock:
+            self._db.execute(
+                "UPDATE scrape_tasks SET status = ?, result = ?, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result, ensure_ascii=False), time.time(), task_id),
+            )
+
+    def result(self, task_id: str) -> dict | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result FROM scrape_tasks WHERE id = ? AND status = ?", (task_id, DONE)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def heartbeat(self, worker: str, stats: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO scrape_workers (worker, pid, seen_at, stats) VALUES (?, ?, ?, ?)",
+                (worker, os.getpid(), time.time(), json.dumps(stats)),
+            )
+
+    def retire(self, worker: str):
+        with self._lock:
+            self._db.execute("DELETE FROM scrape_workers WHERE worker = ?", (worker,))
+
+    def purge_old(self, seconds: int = SCRAPER_RETENCION) -> int:
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM scrape_tasks WHERE status = ? AND finished_at < ?", (DONE, time.time() - seconds)
+            ).rowcount
+
+    def circuit_breaker(self) -> dict:
+        """
+        Estado del circuit breaker DIAN según los heartbeats de los workers vivos
+        (cada proceso tiene el suyo). CLOSED si algún worker puede consultar,
+        HALF_OPEN si alguno está probando, OPEN si todos están abiertos o no hay workers.
+        """
+        por_worker = {w: st.get("circuit_breaker") or {} for w, st in self.stats()["workers"].items()}
+        estados = [cb.get("state") for cb in por_worker.values()]
+        if "CLOSED" in estados:
+            state = "CLOSED"
+        elif "HALF_OPEN" in estados:
+            state = "HALF_OPEN"
+        else:
+            state = "OPEN"
+        info = {"state": state, "workers": {w: cb.get("state", "") for w, cb in por_worker.items()}}
+        if not por_worker:
+            info["last_error"] = "Sin workers de scraping activos"
+        elif state == "OPEN":
+            info["retry_in_seconds"] = min(cb.get("retry_in_seconds", 0) for cb in por_worker.values())
+        return info
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            por_estado = dict(self._db.execute(
+                "SELECT status, COUNT(*) FROM scrape_tasks GROUP BY status"
+            ).fetchall())
+            workers = self._db.execute(
+                "SELECT worker, pid, seen_at, stats FROM scrape_workers WHERE seen_at > ?",
+                (now - SCRAPER_WORKER_VIGENCIA,),
+            ).fetchall()
+        return {
+            **self.counters,
+            "pending": por_estado.get(PENDING, 0),
+            "claimed": por_estado.get(CLAIMED, 0),
+            "workers": {
+                w: {"pid": pid, "seen_seconds_ago": round(now - seen, 1), **json.loads(st or "{}")}
+                for w, pid, seen, st in workers
+            },
+        }
+
+
+async def consultar_remoto(queue: ScrapeQueue, nit: str, timeout: float = SCRAPER_RESULT_TIMEOUT) -> dict:
+    """Encolar un NIT para los workers y esperar su resultado (mismo formato que consultar_dian)."""
+    task_id = queue.submit(nit)
+    deadline = time.monotonic() + timeout
+    espera = 0.1
+    while time.monotonic() < deadline:
+        result = queue.result(task_id)
+        if result is not None:
+            return result
+        await asyncio.sleep(espera)
+        espera = min(espera * 1.5, 1.0)
+    queue.counters["timeouts"] += 1
+    return {
+        "nit": nit,
+        "error": "Sin respuesta de los workers de scraping DIAN",
+        "fuente": "DIAN MUISCA (worker)",
+    }
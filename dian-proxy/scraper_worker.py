@@ -0,0 +1,142 @@
+"""
+Worker de scraping DIAN: consume la cola de scraper_queue.py (SCRAPER_MODE=worker en la API).
+
+    cd dian-proxy && python scraper_worker.py
+
+Cada proceso tiene su propio Chromium (BrowserPool) y atiende hasta
+SCRAPER_WORKER_CONCURRENCY sesiones MUISCA a la vez; mientras haya tareas,
+cada sesión consulta sus NITs en la misma página (SesionMuisca). Se pueden
+lanzar varios procesos sobre la misma SCRAPER_QUEUE_FILE para escalar.
+El estado del pool, del circuit breaker y de la cola de tokens se publica en
+el heartbeat y la API lo muestra en /api/stats; /api/health toma el estado
+de la DIAN del circuit breaker de los workers.
+"""
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+import uuid
+
+from dotenv import load_dotenv
+
+from dian_scraper import (
+    SesionMuisca, browser_pool, circuit_breaker, consultar_dian, sesion_actual, token_prefetcher,
+)
+from scraper_queue import ScrapeQueue
+
+load_dotenv()
+
+logger = logging.getLogger("exogenadian.scraper_worker")
+
+SCRAPER_WORKER_CONCURRENCY = int(os.getenv("SCRAPER_WORKER_CONCURRENCY", "3"))
+SCRAPER_IDLE_POLL = 0.2  # Segundos entre consultas a la cola vacía (máximo, con backoff)
+HEARTBEAT_SECONDS = 5
+
+
+class ScraperWorker:
+    """
+    Sesiones que toman NITs de la cola mientras haya trabajo. Sin tareas, la
+    sesión se cierra y su página vuelve al pool tibio (que la revisa antes de
+    reusarla), así una página no queda vieja esperando.
+    """
+
+    def __init__(self, queue: ScrapeQueue, concurrency: int = SCRAPER_WORKER_CONCURRENCY,
+                 consultar=consultar_dian, sesion=SesionMuisca):
+        self.queue = queue
+        self.concurrency = concurrency
+        self.consultar = consultar
+        self.sesion = sesion
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.stopping = asyncio.Event()
+        self.counters = {"processed": 0, "errors": 0}
+
+    async def _tomar(self) -> tuple[str, str] | None:
+        espera = 0.02
+        while not self.stopping.is_set():
+            tareas = self.queue.claim(self.worker_id, 1)
+            if tareas:
+                return tareas[0]
+            try:
+                await asyncio.wait_for(self.stopping.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+            espera = min(espera * 2, SCRAPER_IDLE_POLL)
+        return None
+
+    async def _procesar(self, task_id: str, nit: str):
+        try:
+            result = await self.consultar(nit)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.error("[Worker] Error consultando %s: %s", nit, str(e)[:200])
+            result = {"nit": nit, "error": f"Error al consultar DIAN: {str(e)[:200]}", "fuente": "DIAN MUISCA"}
+        self.queue.complete(task_id, result)
+        self.counters["processed"] += 1
+
+    async def _sesion(self):
+        while not self.stopping.is_set():
+            tarea = await self._tomar()
+            if tarea is None:
+                return
+            async with self.sesion() as sesion:
+                sesion_actual.set(sesion)
+                while tarea is not None:
+                    await self._procesar(*tarea)
+                    if self.stopping.is_set():
+                        break
+                    siguiente = self.queue.claim(self.worker_id, 1)
+                    tarea = siguiente[0] if siguiente else None
+            sesion_actual.set(None)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "concurrency": self.concurrency,
+            "browser_pool": browser_pool.stats(),
+            "circuit_breaker": circuit_breaker.get_status(),
+            "turnstile_prefetch": token_prefetcher.stats(),
+        }
+
+    async def _heartbeat(self):
+        ultima_purga = 0.0
+        while not self.stopping.is_set():
+            self.queue.heartbeat(self.worker_id, self.stats())
+            if time.time() - ultima_purga > 600:
+                self.queue.purge_old()
+                ultima_purga = time.time()
+            try:
+                await asyncio.wait_for(self.stopping.wait(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        logger.info("[Worker %s] Iniciando con %d sesiones", self.worker_id, self.concurrency)
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await asyncio.gather(*(self._sesion() for _ in range(self.concurrency)))
+        finally:
+            self.stopping.set()
+            await heartbeat
+            self.queue.retire(self.worker_id)
+
+    def stop(self):
+        self.stopping.set()
+
+
+async def main():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    worker = ScraperWorker(ScrapeQueue(), concurrency=SCRAPER_WORKER_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, worker.stop)
+    try:
+        await worker.run()
+    finally:
+        await token_prefetcher.stop()
+        await browser_pool.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""
+Benchmark de extracción sobre las páginas guardadas en tests/fixtures.
+
+Compara el camino anterior (patrones compilados en cada llamada, re.sub de
+etiquetas y findall sobre la página completa) con parsers.py en cada backend
+disponible (patrones precompilados, búsqueda solo alrededor del NIT).
+Cada iteración usa un NIT distinto, como una consulta masiva.
+
+    cd dian-proxy && python -m tests.bench_parsers [iteraciones]
+"""
+import re
+import sys
+import time
+from pathlib import Path
+
+import parsers
+
+FIXTURES = Path(__file__).parent / "fixtures"
+NIT = "800197268"
+
+
+def _anterior(html: str, nit: str):
+    """Copia de buscar_web/extraer_info_web originales: todo por llamada y sobre la página entera."""
+    texto = re.sub(r"<[^>]+>", " ", html)
+    texto = re.sub(r"\s+", " ", texto)
+    patrones = [
+        r'(?:NIT|Nit|nit)[\s.:]*' + re.escape(str(nit)) + r'[\s\-–—:,.]+([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]+)',
+        r'([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]{5,50}?)[\s\-–—:,.]+(?:NIT|Nit|nit)[\s.:]*' + re.escape(str(nit)),
+        r'([A-Za-záéíóúñÁÉÍÓÚÑ][A-Za-záéíóúñÁÉÍÓÚÑ\s&.,]{3,60}?)\s*-\s*' + re.escape(str(nit)),
+    ]
+    rs = [(re.findall(p, texto) or [None])[0] for p in patrones]
+    direccion = re.findall(
+        r'((?:CL|CR|KR|TV|DG|CALLE|CARRERA|AV|AVENIDA|TRANSVERSAL|DIAGONAL)[\s.]*(?:No\.?\s*)?\d+[\w\s#\-.,No°]*\d)',
+        texto, re.IGNORECASE,
+    )
+    return rs, direccion[:1]
+
+
+def _nuevo(html: str, nit: str, backend: str):
+    texto = parsers.html_a_texto(html, backend)
+    rs = [parsers.primera_cerca_del_nit(p, texto, nit) for p in parsers.patrones_razon_social(nit)]
+    m = parsers.RE_DIRECCIONES[1].search(texto)
+    return rs, [m.group(1)] if m else []
+
+
+def _medir(fn, paginas: list[tuple[str, str]]) -> float:
+    fn(*paginas[0])  # calentamiento (imports perezosos del parser)
+    t0 = time.perf_counter()
+    for html, nit in paginas:
+        fn(html, nit)
+    return (time.perf_counter() - t0) / len(paginas) * 1e6
+
+
+def main(iteraciones: int = 600):
+    base = (FIXTURES / f"duckduckgo_{NIT}.html").read_text(encoding="utf-8")
+    # La misma página con un NIT distinto en cada iteración (más que la caché interna de re)
+    paginas = [(base.replace(NIT, nit), nit) for nit in (str(800000000 + i) for i in range(iteraciones))]
+
+    print(f"Página: {len(base) / 1024:.0f} KB · {iteraciones} NITs · backend por defecto: {parsers.BACKEND}")
+    anterior = _medir(_anterior, paginas)
+    print(f"{'anterior':<22} {anterior:9.0f} µs/página")
+    for backend in parsers.BACKENDS:
+        us = _medir(lambda html, nit, b=backend: _nuevo(html, nit, b), paginas)
+        print(f"{'parsers [' + backend + ']':<22} {us:9.0f} µs/página  ({anterior / us:4.1f}x)")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 600)
@@ -0,0 +1,118 @@
+"""
+Benchmark de carga del formulario MUISCA con y sin bloqueo de recursos.
+
+Sirve tests/fixtures/muisca_formulario.html en un servidor local que simula
+la latencia del portal (cada recurso tarda LATENCIA segundos; imágenes y
+fuentes pesan lo de verdad) y abre la página en contexts del BrowserPool
+real, primero cargando todo y luego con DIAN_BLOCK_RESOURCES/DIAN_BLOCK_HOSTS.
+Mide lo que espera el scraper: goto(domcontentloaded) + campo NIT visible,
+y aparte el evento load.
+
+Requiere Chromium de Playwright (playwright install chromium).
+
+    cd dian-proxy && python -m tests.bench_recursos [iteraciones]
+"""
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import dian_scraper
+from dian_scraper import SEL_NIT_INPUT, BrowserPool
+
+FORMULARIO = (Path(__file__).parent / "fixtures" / "muisca_formulario.html").read_bytes()
+LATENCIA = 0.08  # segundos por petición
+
+# ruta → (content-type, tamaño en bytes)
+RECURSOS = {
+    "/css/muisca.css": ("text/css", 40_000),
+    "/css/jsf-componentes.css": ("text/css", 25_000),
+    "/js/jsf.js": ("application/javascript", 60_000),
+    "/js/analytics.js": ("application/javascript", 45_000),
+    "/js/turnstile-api.js": ("application/javascript", 30_000),
+    "/img/logo-dian.png": ("image/png", 35_000),
+    "/img/banner-muisca.jpg": ("image/jpeg", 180_000),
+    "/img/icono-nit.gif": ("image/gif", 2_000),
+    "/img/boton-buscar.png": ("image/png", 6_000),
+    "/img/pie-gobierno.png": ("image/png", 50_000),
+    "/img/sellos.png": ("image/png", 70_000),
+}
+
+
+def _cuerpo(ruta: str, tamano: int) -> bytes:
+    if ruta.endswith(".css"):
+        return (b"/* css */ .x{color:#000}\n" * (tamano // 24 + 1))[:tamano]
+    if ruta.endswith(".js"):
+        relleno = b"var _=0;\n" * (tamano // 9 + 1)
+        if "analytics" in ruta:
+            # Tracker: además dispara un beacon
+            relleno += b"(new Image()).src='/collect?v=1';\n"
+        return relleno
+    return bytes(tamano)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(LATENCIA)
+        ruta = self.path.split("?")[0]
+        if ruta == "/WebRutMuisca/DefConsultaEstadoRUT.faces":
+            tipo, cuerpo = "text/html; charset=utf-8", FORMULARIO
+        elif ruta in RECURSOS:
+            tipo, tamano = RECURSOS[ruta]
+            cuerpo = _cuerpo(ruta, tamano)
+        else:
+            tipo, cuerpo = "image/gif", b"GIF89a"
+        self.send_response(200)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+async def _medir(pool: BrowserPool, url: str, iteraciones: int) -> tuple[list[float], list[float]]:
+    formulario, load = [], []
+    for _ in range(iteraciones):
+        pagina = await pool.new_page()
+        try:
+            t0 = time.perf_counter()
+            await pagina.page.goto(url, wait_until="domcontentloaded")
+            await pagina.page.wait_for_selector(SEL_NIT_INPUT, state="visible")
+            formulario.append((time.perf_counter() - t0) * 1000)
+            await pagina.page.wait_for_load_state("load")
+            load.append((time.perf_counter() - t0) * 1000)
+        finally:
+            await pagina.context.close()
+    return formulario, load
+
+
+async def main(iteraciones: int = 10):
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{servidor.server_port}/WebRutMuisca/DefConsultaEstadoRUT.faces"
+    bloqueo = (dian_scraper.DIAN_BLOCK_RESOURCES, dian_scraper.DIAN_BLOCK_HOSTS)
+    pool = BrowserPool(max_concurrent=1, warm_pages=0)
+    try:
+        print(f"{len(RECURSOS)} recursos · {LATENCIA * 1000:.0f} ms de latencia · {iteraciones} cargas")
+        resultados = {}
+        for nombre, (tipos, hosts) in (("sin bloqueo", (frozenset(), ())), ("con bloqueo", bloqueo)):
+            dian_scraper.DIAN_BLOCK_RESOURCES, dian_scraper.DIAN_BLOCK_HOSTS = tipos, hosts
+            formulario, load = await _medir(pool, url, iteraciones)
+            resultados[nombre] = statistics.median(formulario)
+            print(f"{nombre:<12} formulario {resultados[nombre]:7.0f} ms  load {statistics.median(load):7.0f} ms (medianas)")
+        print(f"bloqueadas: {pool.resource_stats['blocked']} peticiones · "
+              f"{resultados['sin bloqueo'] / resultados['con bloqueo']:.1f}x hasta el formulario")
+    finally:
+        dian_scraper.DIAN_BLOCK_RESOURCES, dian_scraper.DIAN_BLOCK_HOSTS = bloqueo
+        await pool.shutdown()
+        servidor.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 10))
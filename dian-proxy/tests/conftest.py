@@ -10,4 +10,5 @@ sys.modules["playwright.async_api"] = playwright_mock
 # Mock captcha_solver
 captcha_mock = MagicMock()
 captcha_mock.get_balance = MagicMock(return_value=-1)
+captcha_mock.stats = MagicMock(return_value={})
 sys.modules["captcha_solver"] = captcha_mock
@@ -8,7 +8,7 @@ from unittest.mock import AsyncMock, patch
 import pytest
 from httpx import ASGITransport, AsyncClient
 
-from main import app, _clean_nit, _build_response, RateLimiter, ProCredits
+from main import app, _clean_nit, _build_response, RateLimiter, ProCredits, SingleFlight, StaleRefresher
 
 
 # ═══════════════════════════════════════════════════════════════
@@ -101,6 +101,140 @@ class TestProCredits:
         assert pc.get_remaining("KEY-B") == 10
 
 
+class TestSingleFlight:
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_lookup(self):
+        import asyncio
+        sf = SingleFlight()
+        calls = 0
+
+        async def lookup():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"razon_social": "TEST"}
+
+        results = await asyncio.gather(*[sf.do("800197268:dian", lookup) for _ in range(5)])
+        assert calls == 1
+        assert all(r["razon_social"] == "TEST" for r in results)
+        assert sf.stats() == {"in_flight": 0, "lookups": 1, "coalesced": 4}
+
+    @pytest.mark.asyncio
+    async def test_errors_propagate_and_next_call_retries(self):
+        sf = SingleFlight()
+
+        async def falla():
+            raise RuntimeError("DIAN caída")
+
+        with pytest.raises(RuntimeError):
+            await sf.do("k", falla)
+
+        async def ok():
+            return {"ok": True}
+
+        assert await sf.do("k", ok) == {"ok": True}
+        assert sf.stats()["lookups"] == 2
+
+    @pytest.mark.asyncio
+    async def test_key_separates_skip_flags(self):
+        """Una consulta con skip_datos_gov no se comparte con otra que sí debe preguntar a datos.gov.co."""
+        import asyncio
+        from cache import NITCache
+        from main import _consultar_nit
+
+        async def lento(nit, skip_datos_gov=False):
+            await asyncio.sleep(0.05)
+            return {"nit": nit, "razon_social": "EMPRESA", "fuente": "RegistroNIT"}
+
+        fallback = AsyncMock(side_effect=lento)
+        with patch("main.cache", NITCache(ttl_days=1, path=":memory:")), \
+             patch("main.consultar_fallback", fallback):
+            await asyncio.gather(
+                _consultar_nit("800197268", use_dian=False),
+                _consultar_nit("800197268", use_dian=False, skip_datos_gov=True),
+                _consultar_nit("800197268", use_dian=False, skip_datos_gov=True),
+            )
+        assert sorted(c.kwargs["skip_datos_gov"] for c in fallback.await_args_list) == [False, True]
+
+
+class TestStaleRefresher:
+    @pytest.mark.asyncio
+    async def test_dedupes_and_bounds_queue(self):
+        sr = StaleRefresher(maxsize=2, workers=1)
+        sr.schedule("111111", False)
+        sr.schedule("111111", False)
+        sr.schedule("222222", False)
+        sr.schedule("333333", False)
+        stats = sr.stats()
+        assert stats["queued"] == 2
+        assert stats["dropped"] == 1
+        assert stats["pending"] == 2
+
+    @pytest.mark.asyncio
+    async def test_workers_refresh_queued_nits(self):
+        sr = StaleRefresher(maxsize=10, workers=1)
+        resolver = AsyncMock(return_value={"nit": "111111", "razon_social": "NUEVA"})
+        with patch("main._resolver_nit", resolver):
+            sr.start()
+            sr.schedule("111111", False)
+            await sr.queue.join()
+            await sr.stop()
+        resolver.assert_awaited_once_with("111111", False)
+        assert sr.stats()["refreshed"] == 1
+        assert sr.stats()["pending"] == 0
+
+
+class TestNegativeCache:
+    NO_ENCONTRADO = {
+        "nit": "999999", "fuente": "No encontrado",
+        "error": "NIT no encontrado en ninguna fuente",
+    }
+
+    @pytest.mark.asyncio
+    async def test_not_found_is_cached_and_skips_fallback(self):
+        from cache import NITCache
+        from main import _consultar_nit
+        fallback = AsyncMock(return_value=dict(self.NO_ENCONTRADO))
+        with patch("main.cache", NITCache(ttl_days=1, path=":memory:")), \
+             patch("main.consultar_fallback", fallback):
+            first = await _consultar_nit("999999", use_dian=False)
+            second = await _consultar_nit("999999", use_dian=False)
+        assert fallback.await_count == 1
+        assert first["fuente"] == second["fuente"] == "No encontrado"
+        assert second["cached"] is True
+
+    @pytest.mark.asyncio
+    async def test_fallback_outage_is_not_negative_cached(self):
+        from cache import NITCache
+        from main import _consultar_nit
+        sin_respuesta = {
+            "nit": "999999", "fuente": "Sin respuesta",
+            "error": "Ninguna fuente de fallback respondió (caídas o en pausa)",
+        }
+        fallback = AsyncMock(return_value=dict(sin_respuesta))
+        with patch("main.cache", NITCache(ttl_days=1, path=":memory:")), \
+             patch("main.consultar_fallback", fallback):
+            await _consultar_nit("999999", use_dian=False)
+            second = await _consultar_nit("999999", use_dian=False)
+        assert fallback.await_count == 2
+        assert not second["cached"]
+
+    @pytest.mark.asyncio
+    async def test_offline_negative_still_asks_dian_once(self):
+        from cache import NITCache
+        from main import _consultar_nit
+        fallback = AsyncMock(return_value=dict(self.NO_ENCONTRADO))
+        dian = AsyncMock(return_value={"nit": "999999", "error": "El NIT no está inscrito en el RUT"})
+        with patch("main.cache", NITCache(ttl_days=1, path=":memory:")), \
+             patch("main.consultar_fallback", fallback), \
+             patch("main.consultar_dian", dian):
+            await _consultar_nit("999999", use_dian=False)
+            await _consultar_nit("999999", use_dian=True)
+            await _consultar_nit("999999", use_dian=True)
+        assert fallback.await_count == 1
+        assert dian.await_count == 1
+
+
 # ═══════════════════════════════════════════════════════════════
 #  Integration tests — endpoints del API
 # ═══════════════════════════════════════════════════════════════
@@ -227,3 +361,53 @@ async def test_stats_endpoint(transport):
     data = resp.json()
     assert "cache" in data
     assert "circuit_breaker" in data
+
+
+@pytest.mark.asyncio
+async def test_bulk_stream_ndjson(transport):
+    """El streaming emite primero los de caché, progreso y un resumen final."""
+    import json
+    from cache import NITCache
+    mem_cache = NITCache(ttl_days=1, path=":memory:")
+    mem_cache.set("800197268", {"nit": "800197268", "razon_social": "EN CACHE"})
+    fallback = AsyncMock(return_value={"nit": "900123456", "razon_social": "DE FALLBACK", "fuente": "RUES"})
+    with patch("main.cache", mem_cache), patch("main.consultar_fallback", fallback), \
+         patch("main.buscar_datos_gov_lote", AsyncMock(return_value=({}, set()))):
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/api/nit/bulk/stream", json={"nits": ["900123456", "800197268"]})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in resp.text.splitlines()]
+    results = [e for e in events if e["type"] == "result"]
+    assert results[0]["phase"] == "cache"
+    assert results[0]["result"]["razon_social"] == "EN CACHE"
+    assert results[1]["result"]["razon_social"] == "DE FALLBACK"
+    assert any(e["type"] == "progress" for e in events)
+    assert events[-1]["type"] == "summary"
+    assert events[-1]["total"] == 2
+    assert events[-1]["cached"] == 1
+    assert "credits_remaining" in events[-1]
+
+
+@pytest.mark.asyncio
+async def test_bulk_stream_free_limit(transport):
+    nits = [str(100000 + i) for i in range(15)]
+    async with AsyncClient(transport=transport, base_url="http://test") as client:
+        resp = await client.post("/api/nit/bulk/stream", json={"nits": nits})
+    assert resp.status_code == 403
+
+
+@pytest.mark.asyncio
+async def test_bulk_retries_datos_gov_for_failed_chunks(transport):
+    """Un NIT cuyo bloque de datos.gov.co falló se consulta por NIT incluyendo datos.gov.co."""
+    from cache import NITCache
+    fallback = AsyncMock(side_effect=lambda nit, skip_datos_gov=False: {
+        "nit": nit, "razon_social": "DE FALLBACK", "fuente": "RUES",
+    })
+    with patch("main.cache", NITCache(ttl_days=1, path=":memory:")), patch("main.consultar_fallback", fallback), \
+         patch("main.buscar_datos_gov_lote", AsyncMock(return_value=({}, {"900123456"}))):
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/api/nit/bulk/stream", json={"nits": ["900123456", "800197268"]})
+    assert resp.status_code == 200
+    skips = {c.args[0]: c.kwargs["skip_datos_gov"] for c in fallback.await_args_list}
+    assert skips == {"900123456": False, "800197268": True}
@@ -1,14 +1,17 @@
 """Tests para el sistema de caché de NIT."""
+import asyncio
+import json
 import time
 from unittest.mock import patch
 
-from cache import NITCache
+import pytest
+
+from cache import NITCache, RedisStore
 
 
 class TestNITCache:
     def setup_method(self):
-        self.cache = NITCache(ttl_days=1)
-        self.cache.data = {}  # Start clean
+        self.cache = NITCache(ttl_days=1, path=":memory:")
 
     def test_set_and_get(self):
         self.cache.set("800197268", {"razon_social": "TEST S.A.S", "fuente": "DIAN"})
@@ -27,8 +30,9 @@ class TestNITCache:
     def test_expired_returns_none(self):
         self.cache.set("800197268", {"razon_social": "TEST"})
         # Forzar expiración
-        self.cache.data["800197268"]["_cached_at"] = time.time() - 200000
-        assert self.cache.get("800197268") is None
+        with patch("cache.time.time", return_value=time.time() + 200000):
+            assert self.cache.get("800197268") is None
+        assert self.cache.stats()["total_entries"] == 0
 
     def test_internal_fields_excluded(self):
         self.cache.set("800197268", {"razon_social": "TEST"})
@@ -40,15 +44,215 @@ class TestNITCache:
         self.cache.set("222222", {"razon_social": "B"})
         stats = self.cache.stats()
         assert stats["total_entries"] == 2
-        assert stats["valid_entries"] == 2
+        assert stats["writes"] == 2
+        self.cache.get("111111")
+        self.cache.get("333333")
+        stats = self.cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
 
     def test_stats_expired_entries(self):
-        self.cache.set("111111", {"razon_social": "A"})
-        self.cache.data["111111"]["_cached_at"] = 0  # Expired
+        with patch("cache.time.time", return_value=time.time() - 200000):
+            self.cache.set("111111", {"razon_social": "A"})  # Expired
         self.cache.set("222222", {"razon_social": "B"})
+        assert self.cache.stats()["total_entries"] == 2
+        self.cache.sweep()
         stats = self.cache.stats()
-        assert stats["total_entries"] == 2
-        assert stats["valid_entries"] == 1
+        assert stats["total_entries"] == 1
+        assert stats["expirations"] == 1
+
+    def test_set_overwrites(self):
+        self.cache.set("800197268", {"razon_social": "VIEJO"})
+        self.cache.set("800197268", {"razon_social": "NUEVO"})
+        assert self.cache.get("800197268")["razon_social"] == "NUEVO"
+        assert self.cache.stats()["total_entries"] == 1
+
+    def test_purge_expired(self):
+        with patch("cache.time.time", return_value=time.time() - 200000):
+            self.cache.set("111111", {"razon_social": "A"})
+        self.cache.set("222222", {"razon_social": "B"})
+        assert self.cache.purge_expired() == 1
+        assert self.cache.stats()["total_entries"] == 1
+
+    def test_hot_tier_is_bounded_lru(self):
+        cache = NITCache(ttl_days=1, path=":memory:", max_hot=2)
+        cache.set("111111", {"razon_social": "A"})
+        cache.set("222222", {"razon_social": "B"})
+        cache.get("111111")  # 111111 pasa a ser el más reciente
+        cache.set("333333", {"razon_social": "C"})
+        stats = cache.stats()
+        assert stats["hot_entries"] == 2
+        assert stats["evictions"] == 1
+        assert stats["total_entries"] == 3
+        # El desalojado sigue en el nivel frío y vuelve a subir al caliente
+        assert cache.get("222222")["razon_social"] == "B"
+        assert cache.stats()["hot_hits"] == 1
+
+    def test_stale_while_revalidate(self):
+        cache = NITCache(ttl_days=1, path=":memory:", stale_days=1)
+        cache.set("800197268", {"razon_social": "TEST"})
+        dia = 24 * 3600
+        with patch("cache.time.time", return_value=time.time() + 1.5 * dia):
+            assert cache.get("800197268") is None
+            result = cache.get("800197268", allow_stale=True)
+        assert result["stale"] is True
+        assert result["age_seconds"] >= 1.5 * dia - 1
+        assert cache.stats()["stale_hits"] == 1
+        # Pasado el límite duro ya no se sirve ni como stale
+        with patch("cache.time.time", return_value=time.time() + 2.5 * dia):
+            assert cache.get("800197268", allow_stale=True) is None
+        assert cache.stats()["total_entries"] == 0
+
+    def test_fresh_entry_not_flagged_stale(self):
+        cache = NITCache(ttl_days=1, path=":memory:", stale_days=1)
+        cache.set("800197268", {"razon_social": "TEST"})
+        assert "stale" not in cache.get("800197268", allow_stale=True)
+
+    def test_negative_entries_use_short_ttl(self):
+        cache = NITCache(ttl_days=30, path=":memory:", negative_hours=1)
+        cache.set_negative("999999", {"fuente": "No encontrado"})
+        result = cache.get("999999")
+        assert result["negative"] is True
+        assert result["dian_checked"] is False
+        assert cache.stats()["negative_hits"] == 1
+        with patch("cache.time.time", return_value=time.time() + 7200):
+            assert cache.get("999999") is None
+
+    def test_negative_never_overwrites_positive(self):
+        self.cache.set("800197268", {"razon_social": "TEST"})
+        self.cache.set_negative("800197268", {"fuente": "No encontrado"})
+        result = self.cache.get("800197268")
+        assert result["razon_social"] == "TEST"
+        assert "negative" not in result
+
+    def test_sweeper_runs_in_background(self):
+        import asyncio
+
+        async def run():
+            with patch("cache.time.time", return_value=time.time() - 200000):
+                self.cache.set("111111", {"razon_social": "A"})
+            self.cache.start_sweeper(interval=0.01)
+            await asyncio.sleep(0.05)
+            await self.cache.stop_sweeper()
+
+        asyncio.run(run())
+        stats = self.cache.stats()
+        assert stats["total_entries"] == 0
+        assert stats["hot_entries"] == 0
+
+
+class TestNITCachePersistence:
+    def test_survives_restart(self, tmp_path):
+        path = tmp_path / "cache.db"
+        NITCache(ttl_days=1, path=path).set("800197268", {"razon_social": "TEST"})
+        assert NITCache(ttl_days=1, path=path).get("800197268")["razon_social"] == "TEST"
+
+    def test_migrates_legacy_json(self, tmp_path):
+        legacy = tmp_path / "cache.json"
+        legacy.write_text(json.dumps({
+            "800197268": {"razon_social": "TEST", "_cached_at": time.time()},
+            "111111": {"razon_social": "VIEJO", "_cached_at": 0},
+        }), encoding="utf-8")
+        cache = NITCache(ttl_days=1, path=tmp_path / "cache.db")
+        assert cache.get("800197268")["razon_social"] == "TEST"
+        assert cache.get("111111") is None
+        assert not legacy.exists()
+
+
+class TestNITCacheRedis:
+    """Nivel frío compartido, probado contra fakeredis (mismo protocolo que Redis)."""
+
+    def setup_method(self):
+        fakeredis = pytest.importorskip("fakeredis")
+        self.server = fakeredis.FakeServer()
+        self.new_client = lambda: fakeredis.FakeRedis(server=self.server)
+
+    def _cache(self):
+        return NITCache(ttl_days=1, store=RedisStore(self.new_client()))
+
+    def test_shared_between_instances(self):
+        self._cache().set("800197268", {"razon_social": "TEST"})
+        other = self._cache()
+        assert other.get("800197268")["razon_social"] == "TEST"
+        assert other.stats()["backend"] == "redis"
+        assert other.stats()["total_entries"] == 1
+
+    def test_count_ignores_other_keys_in_db(self):
+        client = self.new_client()
+        client.set("sesion:abc", "x")
+        client.set("otro:1", "y")
+        self._cache().set_many({"800197268": {"razon_social": "UNO"}, "900123456": {"razon_social": "DOS"}})
+        assert self._cache().stats()["total_entries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_astats_counts_off_event_loop(self):
+        self._cache().set("800197268", {"razon_social": "TEST"})
+        client = self.new_client()
+        scan_iter = client.scan_iter
+        client.scan_iter = lambda **kw: time.sleep(0.2) or scan_iter(**kw)
+        cache = NITCache(ttl_days=1, store=RedisStore(client))
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        t = asyncio.create_task(ticker())
+        stats = await cache.astats()
+        t.cancel()
+        assert stats["total_entries"] == 1
+        assert ticks >= 5
+
+    def test_native_expiry(self):
+        self._cache().set("800197268", {"razon_social": "TEST"})
+        ttl = self.new_client().ttl("nit:800197268")
+        assert 0 < ttl <= 24 * 3600
+
+    def test_redis_down_is_a_miss(self):
+        cache = self._cache()
+        self.server.connected = False
+        cache.set("800197268", {"razon_social": "TEST"})  # No lanza
+        assert self._cache().get("800197268") is None
+        assert cache.store.errors == 1
+        # El L1 local sigue sirviendo lo que esta instancia escribió
+        assert cache.get("800197268")["razon_social"] == "TEST"
+
+    def test_get_many_uses_one_mget(self):
+        cache = self._cache()
+        cache.set_many({"800197268": {"razon_social": "UNO"}, "900123456": {"razon_social": "DOS"}})
+        client = self.new_client()
+        llamadas = []
+        mget = client.mget
+        client.mget = lambda keys: llamadas.append(keys) or mget(keys)
+        other = NITCache(ttl_days=1, store=RedisStore(client))
+        hits = other.get_many(["800197268", "900123456", "111111"])
+        assert set(hits) == {"800197268", "900123456"}
+        assert len(llamadas) == 1
+        assert other.stats()["misses"] == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_redis_does_not_block_event_loop(self):
+        self._cache().set("800197268", {"razon_social": "TEST"})
+        client = self.new_client()
+        get = client.get
+        client.get = lambda key: time.sleep(0.2) or get(key)
+        cache = NITCache(ttl_days=1, store=RedisStore(client))
+        ticks = 0
+
+        async def reloj():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        tarea = asyncio.create_task(reloj())
+        result = await cache.aget("800197268")
+        tarea.cancel()
+        assert result["razon_social"] == "TEST"
+        assert ticks >= 5  # El event loop siguió atendiendo mientras Redis respondía
 
 
 class TestDVCalculation:
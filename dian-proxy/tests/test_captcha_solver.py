@@ -0,0 +1,98 @@
+"""Tests del planificador de polling de CapSolver (API simulada con httpx.MockTransport)."""
+import asyncio
+import importlib.util
+import json
+from pathlib import Path
+
+import httpx
+import pytest
+
+import http_clients
+
+# conftest reemplaza captcha_solver por un mock: cargar el módulo real con otro nombre
+_spec = importlib.util.spec_from_file_location(
+    "captcha_solver_real", Path(__file__).parent.parent / "captcha_solver.py"
+)
+captcha_solver = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(captcha_solver)
+
+
+@pytest.fixture
+def capsolver(monkeypatch):
+    """CapSolver simulado: cada tarea queda lista tras `polls_hasta_listo` consultas."""
+    monkeypatch.setenv("CAPSOLVER_API_KEY", "test-key")
+    monkeypatch.setattr(captcha_solver, "CAPTCHA_POLL_INICIAL", 0.01)
+    monkeypatch.setattr(captcha_solver, "CAPTCHA_POLL_MIN", 0.01)
+    monkeypatch.setattr(captcha_solver, "CAPTCHA_POLL_MAX", 0.02)
+    scheduler = captcha_solver.PollScheduler()
+    monkeypatch.setattr(captcha_solver, "poll_scheduler", scheduler)
+    estado = {"creadas": 0, "polls": {}, "polls_hasta_listo": 3, "falla": False}
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        if request.url.path == "/createTask":
+            estado["creadas"] += 1
+            return httpx.Response(200, json={"errorId": 0, "taskId": f"t{estado['creadas']}"})
+        task_id = body["taskId"]
+        estado["polls"][task_id] = estado["polls"].get(task_id, 0) + 1
+        if estado["falla"]:
+            return httpx.Response(200, json={"errorId": 1, "status": "failed", "errorDescription": "ERROR_CAPTCHA_UNSOLVABLE"})
+        if estado["polls"][task_id] < estado["polls_hasta_listo"]:
+            return httpx.Response(200, json={"errorId": 0, "status": "processing"})
+        return httpx.Response(200, json={"errorId": 0, "status": "ready", "solution": {"token": f"token-{task_id}"}})
+
+    http_clients.usar_transporte(httpx.MockTransport(handler))
+    estado["scheduler"] = scheduler
+    yield estado
+    http_clients.usar_transporte(None)
+
+
+@pytest.mark.asyncio
+async def test_solve_polls_until_ready(capsolver):
+    token = await captcha_solver.solve_turnstile("0x4AAAAAAA-sitekey", "https://muisca.dian.gov.co", timeout=5)
+    assert token == "token-t1"
+    stats = capsolver["scheduler"].stats()
+    assert stats["solved"] == 1
+    assert stats["polls"] == 3
+    assert sum(stats["solve_time_histogram"].values()) == 1
+    assert stats["pending"] == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_tasks_share_poll_rounds(capsolver):
+    tokens = await asyncio.gather(*(
+        captcha_solver.solve_turnstile("0x4AAAAAAA-sitekey", "https://muisca.dian.gov.co", timeout=5)
+        for _ in range(5)
+    ))
+    assert sorted(tokens) == [f"token-t{i}" for i in range(1, 6)]
+    stats = capsolver["scheduler"].stats()
+    assert stats["polls"] == 15
+    assert stats["rounds"] < stats["polls"]  # Varias tareas por ronda
+
+
+@pytest.mark.asyncio
+async def test_failed_task_returns_none(capsolver):
+    capsolver["falla"] = True
+    token = await captcha_solver.solve_turnstile("0x4AAAAAAA-sitekey", "https://muisca.dian.gov.co", timeout=5)
+    assert token is None
+    assert capsolver["scheduler"].stats()["failed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_timeout_drops_pending_task(capsolver):
+    capsolver["polls_hasta_listo"] = 10_000
+    token = await captcha_solver.solve_turnstile("0x4AAAAAAA-sitekey", "https://muisca.dian.gov.co", timeout=0.1)
+    assert token is None
+    stats = capsolver["scheduler"].stats()
+    assert stats["timeouts"] == 1
+    assert stats["pending"] == 0
+
+
+def test_initial_delay_follows_observed_solve_times():
+    scheduler = captcha_solver.PollScheduler()
+    assert scheduler.retraso_inicial() == captcha_solver.CAPTCHA_POLL_INICIAL  # Sin historial
+    for segundos in (6, 7, 8, 9, 10, 11, 12, 13):
+        scheduler.registrar(segundos)
+    assert scheduler.retraso_inicial() == 8
+    histograma = scheduler.stats()["solve_time_histogram"]
+    assert histograma["<=6s"] == 1 and histograma["<=10s"] == 2 and histograma["<=15s"] == 3
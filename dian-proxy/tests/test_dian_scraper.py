@@ -0,0 +1,354 @@
+"""Tests del pool de páginas tibias del scraper MUISCA (páginas Playwright simuladas)."""
+import asyncio
+import time
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+import pytest_asyncio
+
+import dian_scraper
+from dian_scraper import BrowserPool, CircuitBreaker, PaginaMuisca, TokenPrefetcher
+
+
+def _pagina_falsa() -> PaginaMuisca:
+    """Página que responde como el formulario MUISCA con Turnstile."""
+    page = MagicMock()
+    page.goto = AsyncMock(return_value=MagicMock(status=200))
+    page.content = AsyncMock(return_value="<html><form>Consulta RUT</form></html>")
+    page.title = AsyncMock(return_value="DIAN - Consulta de estado RUT")
+    page.evaluate = AsyncMock(return_value="0x4AAAAAAA-sitekey")
+    page.query_selector = AsyncMock(return_value=MagicMock())
+    page.wait_for_selector = AsyncMock()
+    page.fill = AsyncMock()
+    page.keyboard.press = AsyncMock()
+    page.is_closed = MagicMock(return_value=False)
+    page.input_value = AsyncMock(return_value="")
+    context = MagicMock()
+    context.close = AsyncMock()
+    return PaginaMuisca(context=context, page=page)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    """Pool con browser simulado; solve_turnstile y el parser de resultado parcheados."""
+    pool = BrowserPool(max_concurrent=2, warm_pages=1)
+    creadas = []
+
+    async def new_page():
+        pagina = _pagina_falsa()
+        pagina.generation = pool._generation
+        creadas.append(pagina)
+        return pagina
+
+    pool.new_page = new_page
+    pool.creadas = creadas
+    solver = AsyncMock(return_value="token-turnstile")
+    pool.solver = solver
+    monkeypatch.setattr(dian_scraper, "browser_pool", pool)
+    monkeypatch.setattr(dian_scraper, "circuit_breaker", CircuitBreaker())
+    monkeypatch.setattr(dian_scraper, "solve_turnstile", solver)
+    monkeypatch.setattr(dian_scraper, "TURNSTILE_ESPERA", 0)
+    monkeypatch.setattr(dian_scraper, "token_prefetcher", TokenPrefetcher(max_tokens=0))
+    monkeypatch.setattr(dian_scraper, "_parse_resultado", AsyncMock(
+        side_effect=lambda page: {"razon_social": "EMPRESA", "estado_rut": "ACTIVO"}
+    ))
+    yield pool
+    if pool._refill_task:
+        pool._refill_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_warm_page_is_reused_without_navigation(pool):
+    r1 = await dian_scraper.consultar_dian("800197268")
+    assert pool._refill_task is None  # La página en uso vuelve al pool: no hace falta calentar otra
+    r2 = await dian_scraper.consultar_dian("900123456")
+
+    assert r1["estado_rut"] == r2["estado_rut"] == "ACTIVO"
+    assert len(pool.creadas) == 1
+    assert pool.creadas[0].page.goto.await_count == 1
+    assert pool.creadas[0].uses == 2
+    assert pool.solver.await_count == 2  # Un token por submit
+    stats = pool.stats()
+    assert stats["cold_starts"] == 1
+    assert stats["warm_hits"] == 1
+    assert stats["recycled"] == 2
+    assert stats["in_use"] == 0
+
+
+@pytest.mark.asyncio
+async def test_refill_prewarms_page_with_turnstile(pool):
+    pool.warm_pages = 2
+    dian_scraper.token_prefetcher.anticipar(5)  # Hay demanda: el token de la página tibia se usará
+    await dian_scraper.consultar_dian("800197268")
+    await pool._refill_task
+
+    assert pool.stats()["warmed"] == 1
+    tibia = pool.creadas[1]
+    assert tibia.navigated and tibia.token_vigente
+    # La siguiente consulta usa el token ya resuelto: no llama al solver
+    pool._warm.remove(tibia)
+    pool._warm.appendleft(tibia)
+    llamadas = pool.solver.await_count
+    await dian_scraper.consultar_dian("900123456")
+    assert pool.solver.await_count == llamadas
+
+
+@pytest.mark.asyncio
+async def test_refill_without_demand_does_not_pay_turnstile(pool):
+    """Tráfico escaso: la página tibia queda sobre el formulario, sin gastar un token que vencería."""
+    pool.warm_pages = 2
+    await dian_scraper.consultar_dian("800197268")
+    await pool._refill_task
+
+    tibia = pool.creadas[1]
+    assert tibia.navigated and not tibia.token_vigente
+    assert pool.solver.await_count == 1  # Solo el de la consulta
+    assert pool.stats()["warm_token_skipped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_page_with_error_is_evicted(pool):
+    dian_scraper._parse_resultado.side_effect = lambda page: {"error": "Timeout esperando respuesta de la DIAN"}
+    await dian_scraper.consultar_dian("800197268")
+    assert pool.stats()["evicted"] == 1
+    assert pool.creadas[0].context.close.await_count == 1
+    assert len(pool._warm) == 0
+
+
+@pytest.mark.asyncio
+async def test_unhealthy_warm_page_is_replaced(pool):
+    await dian_scraper.consultar_dian("800197268")
+    pool.creadas[0].page.is_closed.return_value = True  # La página murió en espera
+
+    await dian_scraper.consultar_dian("900123456")
+    assert len(pool.creadas) == 2
+    assert pool.creadas[1].page.goto.await_count == 1
+    assert pool.stats()["evicted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_browser_restart_drops_warm_pages(pool):
+    await dian_scraper.consultar_dian("800197268")
+    pool._generation += 1  # Lo que hace _start_playwright
+
+    await dian_scraper.consultar_dian("900123456")
+    assert len(pool.creadas) == 2
+    assert pool.creadas[0].context.close.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_reuses_one_session_page(pool):
+    resultados = await dian_scraper.consultar_dian_batch(["800197268", "900123456", "860034313"], max_concurrent=1)
+
+    assert [r["nit"] for r in resultados] == ["800197268", "900123456", "860034313"]
+    assert len(pool.creadas) == 1
+    assert pool.creadas[0].page.goto.await_count == 1
+    stats = pool.stats()
+    assert stats["session_lookups"] == 3
+    assert stats["session_renewals"] == 0
+    assert stats["in_use"] == 0
+    assert len(pool._warm) == 1  # Al cerrar la sesión la página vuelve al pool
+
+
+@pytest.mark.asyncio
+async def test_session_skips_captcha_when_form_no_longer_asks(pool):
+    async def sin_turnstile_tras_submit():
+        pagina = _pagina_falsa()
+        pagina.generation = pool._generation
+        # Primera lectura del sitekey (al abrir) lo encuentra; tras el postback ya no
+        pagina.page.evaluate = AsyncMock(side_effect=["0x4AAAAAAA-sitekey", None, None, None, None, None, None])
+        pool.creadas.append(pagina)
+        return pagina
+
+    pool.new_page = sin_turnstile_tras_submit
+    await dian_scraper.consultar_dian_batch(["800197268", "900123456", "860034313"], max_concurrent=1)
+    assert pool.solver.await_count == 1  # Un CAPTCHA por sesión, no por NIT
+    assert pool.stats()["captcha_reused"] >= 2
+
+
+@pytest.mark.asyncio
+async def test_session_uses_auto_solved_widget_token(pool):
+    await dian_scraper.consultar_dian("800197268")
+    pagina = pool.creadas[0]
+    pagina.page.input_value.return_value = "token-renovado-por-el-widget"
+
+    async with dian_scraper.SesionMuisca() as sesion:
+        sesion.pagina = await pool.acquire_page()
+        await sesion.consultar("900123456")
+        llamadas = pool.solver.await_count
+        await sesion.consultar("860034313")
+    assert pool.solver.await_count == llamadas
+
+
+@pytest.mark.asyncio
+async def test_session_renews_page_after_block(pool):
+    bloqueos = iter([{"error": "Acceso bloqueado", "_blocked": True}])
+    dian_scraper._parse_resultado.side_effect = lambda page: next(
+        bloqueos, {"razon_social": "EMPRESA", "estado_rut": "ACTIVO"}
+    )
+    resultados = await dian_scraper.consultar_dian_batch(["800197268", "900123456"], max_concurrent=1)
+
+    assert resultados[0]["error"] and resultados[1]["estado_rut"] == "ACTIVO"
+    assert len(pool.creadas) == 2
+    assert pool.creadas[0].context.close.await_count == 1
+    assert pool.stats()["session_renewals"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_session_does_not_return_busy_page(pool):
+    """Worker cancelado con la consulta aún en curso (single-flight): la página no vuelve al pool."""
+    liberar = asyncio.Event()
+    ocupado = asyncio.Event()
+
+    async def parse_lento(page):
+        ocupado.set()
+        await liberar.wait()
+        return {"razon_social": "EMPRESA", "estado_rut": "ACTIVO"}
+
+    dian_scraper._parse_resultado.side_effect = parse_lento
+    sesion = dian_scraper.SesionMuisca()
+    await sesion.__aenter__()
+    consulta = asyncio.ensure_future(sesion.consultar("800197268"))  # Como la tarea del single-flight
+    await ocupado.wait()
+
+    await sesion.__aexit__(asyncio.CancelledError, asyncio.CancelledError(), None)
+    pagina = pool.creadas[0]
+    assert len(pool._warm) == 0
+    assert pagina.context.close.await_count == 0  # Sigue en uso por la consulta
+    assert pool.semaphore._value == 1  # El cupo sigue tomado
+
+    liberar.set()
+    assert (await consulta)["estado_rut"] == "ACTIVO"
+    assert len(pool._warm) == 0
+    assert pagina.context.close.await_count == 1
+    assert pool.semaphore._value == 2
+    assert pool.stats()["in_use"] == 0
+
+
+@pytest.mark.asyncio
+async def test_session_closed_by_error_discards_page(pool):
+    with pytest.raises(RuntimeError):
+        async with dian_scraper.SesionMuisca() as sesion:
+            await sesion.consultar("800197268")
+            raise RuntimeError("cliente desconectado")
+    assert len(pool._warm) == 0
+    assert pool.creadas[0].context.close.await_count == 1
+    assert pool.semaphore._value == 2
+
+
+@pytest_asyncio.fixture
+async def prefetcher(monkeypatch):
+    solver = AsyncMock(side_effect=lambda sitekey, url: f"token-{solver.await_count}")
+    monkeypatch.setattr(dian_scraper, "solve_turnstile", solver)
+    monkeypatch.setattr(dian_scraper, "circuit_breaker", CircuitBreaker())
+    prefetcher = TokenPrefetcher(max_tokens=3)
+    prefetcher.solver = solver
+    yield prefetcher
+    await prefetcher.stop()
+
+
+@pytest.mark.asyncio
+async def test_prefetch_idle_spends_nothing(prefetcher):
+    prefetcher.sitekey = "0x4AAAAAAA-sitekey"
+    assert prefetcher.objetivo() == 0
+    prefetcher._programar()
+    assert prefetcher._task is None
+    assert prefetcher.solver.await_count == 0
+
+
+@pytest.mark.asyncio
+async def test_prefetch_sparse_traffic_spends_nothing(prefetcher):
+    """Una consulta suelta (o muy pocas para la vigencia del token) no dispara pre-resoluciones."""
+    prefetcher.sitekey = "0x4AAAAAAA-sitekey"
+    assert prefetcher.tomar("0x4AAAAAAA-sitekey") is None
+    assert prefetcher.objetivo() == 0
+    assert prefetcher._task is None
+    assert prefetcher.solver.await_count == 0
+
+    # Demanda sostenida: ya se espera usar el token antes de que venza
+    for _ in range(20):
+        prefetcher.tomar("0x4AAAAAAA-sitekey")
+    assert prefetcher.objetivo() >= 1
+    await prefetcher._task
+    assert prefetcher.solver.await_count >= 1
+
+
+@pytest.mark.asyncio
+async def test_prefetch_anticipated_bulk_is_served_from_queue(prefetcher):
+    prefetcher.sitekey = "0x4AAAAAAA-sitekey"
+    prefetcher.anticipar(10)
+    await prefetcher._task
+    assert prefetcher.stats()["queued"] == 3  # Tope max_tokens
+
+    token, resuelto_en = prefetcher.tomar("0x4AAAAAAA-sitekey")
+    assert token.startswith("token-")
+    stats = prefetcher.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 0
+    assert stats["hit_rate"] == 1.0
+
+
+@pytest.mark.asyncio
+async def test_prefetch_expired_tokens_count_as_wasted(prefetcher):
+    prefetcher.sitekey = "0x4AAAAAAA-sitekey"
+    prefetcher._tokens.append(("viejo", time.time() - dian_scraper.TURNSTILE_TOKEN_TTL - 1))
+    assert prefetcher.tomar("0x4AAAAAAA-sitekey") is None
+    stats = prefetcher.stats()
+    assert stats["wasted"] == 1
+    assert stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lookup_uses_prefetched_token(pool, monkeypatch):
+    prefetcher = TokenPrefetcher(max_tokens=0)
+    prefetcher.sitekey = "0x4AAAAAAA-sitekey"
+    resuelto_en = time.time() - 10
+    prefetcher._tokens.append(("pre-resuelto", resuelto_en))
+    monkeypatch.setattr(dian_scraper, "token_prefetcher", prefetcher)
+
+    await dian_scraper.consultar_dian("800197268")
+    assert pool.solver.await_count == 0
+    inyectados = [c.args[1] for c in pool.creadas[0].page.evaluate.await_args_list if len(c.args) > 1]
+    assert inyectados == ["pre-resuelto"]
+    assert prefetcher.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("url, tipo, bloqueado", [
+    ("https://muisca.dian.gov.co/WebRutMuisca/DefConsultaEstadoRUT.faces", "document", False),
+    ("https://muisca.dian.gov.co/WebRutMuisca/jsf.js", "script", False),
+    ("https://muisca.dian.gov.co/WebRutMuisca/img/logo.png", "image", True),
+    ("https://muisca.dian.gov.co/WebRutMuisca/css/muisca.css", "stylesheet", True),
+    ("https://www.google-analytics.com/analytics.js", "script", True),
+    ("https://challenges.cloudflare.com/turnstile/v0/api.js", "script", False),
+    ("https://challenges.cloudflare.com/cdn-cgi/challenge-platform/logo.png", "image", False),
+    ("https://notchallenges.cloudflare.com.evil.net/x.js", "script", False),
+])
+def test_resource_filter(url, tipo, bloqueado):
+    assert dian_scraper.recurso_bloqueado(url, tipo) is bloqueado
+
+
+@pytest.mark.asyncio
+async def test_pooled_context_routes_requests(monkeypatch):
+    pool = BrowserPool(max_concurrent=1, warm_pages=0)
+    context = MagicMock()
+    context.route = AsyncMock()
+    pool._browser = MagicMock()
+    pool._browser.new_context = AsyncMock(return_value=context)
+
+    assert await pool._crear_context() is context
+    patron, handler = context.route.await_args.args
+    assert patron == "**/*"
+    route = MagicMock(abort=AsyncMock(), continue_=AsyncMock())
+    route.request.url, route.request.resource_type = "https://muisca.dian.gov.co/fuente.woff2", "font"
+    await handler(route)
+    route.request.url, route.request.resource_type = "https://challenges.cloudflare.com/turnstile/v0/api.js", "script"
+    await handler(route)
+    assert route.abort.await_count == 1 and route.continue_.await_count == 1
+    assert pool.stats()["requests_blocked"] == 1
+
+    # Sin tipos ni hosts configurados no se intercepta nada
+    monkeypatch.setattr(dian_scraper, "DIAN_BLOCK_RESOURCES", frozenset())
+    monkeypatch.setattr(dian_scraper, "DIAN_BLOCK_HOSTS", ())
+    context.route.reset_mock()
+    await pool._crear_context()
+    assert context.route.await_count == 0
@@ -0,0 +1,313 @@
+"""Tests para las fuentes de fallback (sin red: httpx.MockTransport)."""
+import asyncio
+import time
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+import fallback
+import http_clients
+
+
+@pytest.fixture(autouse=True)
+def salud_limpia(monkeypatch):
+    """Cada test arranca con todas las fuentes sanas."""
+    monkeypatch.setattr(fallback, "salud_fuentes", fallback._nueva_salud())
+
+
+@pytest.fixture
+def simular_red():
+    """Hacer que los clientes compartidos respondan con un handler en vez de salir a la red."""
+    def _usar(handler):
+        http_clients.usar_transporte(httpx.MockTransport(handler))
+    yield _usar
+    http_clients.usar_transporte(None)
+
+
+@pytest.mark.asyncio
+async def test_datos_gov_lote_uses_chunked_in_queries(simular_red):
+    consultas = []
+
+    def handler(request):
+        where = request.url.params["$where"]
+        consultas.append((request.url.path, where))
+        if "rtt5-cgkk" in request.url.path:
+            return httpx.Response(200, json=[
+                {"nit": "800197268", "razon_social": "Dian"},
+                {"nit": "900123456", "razon_social": "Empresa Uno"},
+            ])
+        if "gskn-y6cz" in request.url.path:
+            return httpx.Response(200, json=[{"identificacion": "111111", "nombre": "Pyme"}])
+        return httpx.Response(200, json=[])
+
+    nits = ["800197268", "900123456", "111111", "222222"]
+    simular_red(handler)
+    with patch("fallback.DATOS_GOV_LOTE", 2):
+        encontrados, sin_respuesta = await fallback.buscar_datos_gov_lote(nits)
+
+    assert set(encontrados) == {"800197268", "900123456", "111111"}
+    assert sin_respuesta == set()
+    assert encontrados["800197268"]["razon_social"] == "DIAN"
+    assert encontrados["111111"]["dv"] == fallback._calc_dv("111111")
+    # 2 bloques en el primer dataset; los siguientes solo con los que faltan
+    por_dataset = [path for path, _ in consultas]
+    assert por_dataset.count("/resource/rtt5-cgkk.json") == 2
+    assert por_dataset.count("/resource/cas9-r54x.json") == 1
+    assert all(" in (" in where for _, where in consultas)
+    assert "800197268" not in consultas[-1][1]
+
+
+@pytest.mark.asyncio
+async def test_datos_gov_lote_tolerates_errors(simular_red):
+    simular_red(lambda request: httpx.Response(500))
+    assert await fallback.buscar_datos_gov_lote(["800197268"]) == ({}, {"800197268"})
+
+
+@pytest.mark.asyncio
+async def test_datos_gov_lote_reports_failed_chunks(simular_red):
+    def handler(request):
+        where = request.url.params["$where"]
+        if "900123456" in where:
+            return httpx.Response(400, json={"message": "query.soql.invalid"})
+        filas = [{"nit": "800197268", "razon_social": "Dian"}] if "800197268" in where else []
+        return httpx.Response(200, json=filas)
+
+    simular_red(handler)
+    with patch("fallback.DATOS_GOV_LOTE", 1):
+        encontrados, sin_respuesta = await fallback.buscar_datos_gov_lote(["800197268", "900123456", "111111"])
+    assert set(encontrados) == {"800197268"}
+    assert sin_respuesta == {"900123456"}  # 111111: datos.gov.co contestó que no está
+
+
+@pytest.mark.asyncio
+async def test_datos_gov_probes_run_concurrently_first_hit_wins(simular_red):
+    canceladas = []
+
+    async def handler(request):
+        if "gskn-y6cz" in request.url.path:
+            await asyncio.sleep(0.01)
+            return httpx.Response(200, json=[{"identificacion": "800197268", "nombre": "Pyme"}])
+        try:
+            await asyncio.sleep(10)  # datasets lentos
+        except asyncio.CancelledError:
+            canceladas.append(request.url.path)
+            raise
+        return httpx.Response(200, json=[])
+
+    simular_red(handler)
+    canceladas_carrera = fallback.fallback_stats["cancelled"]
+    t0 = time.monotonic()
+    result = await fallback.buscar_datos_gov("800197268")
+    await asyncio.sleep(0)
+    assert result["razon_social"] == "PYME"
+    assert time.monotonic() - t0 < 1
+    assert len(canceladas) == 2
+    assert fallback.fallback_stats["cancelled"] == canceladas_carrera  # las sondas no cuentan como carrera de fuentes
+
+
+def test_schema_cache_learns_aliases_per_dataset(monkeypatch):
+    monkeypatch.setattr(fallback, "_esquemas", {})
+    fila = {"identificacion": "111111", "nombre": "Pyme", "digito_verificacion": "0", "ciudad": "Cali"}
+    info = fallback._extraer_info_dict(fila, "datos.gov.co", "gskn-y6cz")
+    assert info["razon_social"] == "PYME"
+    assert info["dv"] == "0"
+    assert fallback._esquemas["gskn-y6cz"] == {
+        "razon_social": "nombre", "dv": "digito_verificacion", "municipio": "ciudad",
+    }
+    # Registros siguientes usan el alias aprendido, y siguen tolerando columnas distintas
+    assert fallback._extraer_info_dict({"nombre": "Otra"}, "datos.gov.co", "gskn-y6cz")["razon_social"] == "OTRA"
+    assert fallback._extraer_info_dict({"razon_social": "Tercera"}, "datos.gov.co", "gskn-y6cz")["razon_social"] == "TERCERA"
+
+
+@pytest.mark.asyncio
+async def test_shared_client_is_reused_and_measured(simular_red):
+    simular_red(lambda request: httpx.Response(200, text="<h1>EMPRESA DE PRUEBA</h1>"))
+    r1 = await fallback.buscar_registronit("800197268")
+    r2 = await fallback.buscar_registronit("900123456")
+    assert r1["razon_social"] == r2["razon_social"] == "EMPRESA DE PRUEBA"
+    assert http_clients.get_client("registronit") is http_clients.get_client("registronit")
+    assert http_clients.get_client("registronit") is not http_clients.get_client("einforma")
+    pool = http_clients.stats()["pools"]["registronit"]
+    assert pool["requests"] == 2
+    assert pool["in_flight"] == 0
+    await http_clients.cerrar_clientes()
+    assert http_clients.stats()["pools"] == {}
+
+
+@pytest.mark.asyncio
+async def test_consultar_fallback_can_skip_datos_gov():
+    llamadas = []
+
+    def fuente(nombre):
+        async def _f(nit):
+            llamadas.append(nombre)
+            fallback.marcar_respuesta(nombre)  # Contestó, pero sin el NIT
+            return None
+        return _f
+
+    with patch("fallback.buscar_registronit", fuente("registronit")), \
+         patch("fallback.buscar_datos_gov", fuente("datos_gov")), \
+         patch("fallback.buscar_einforma", fuente("einforma")), \
+         patch("fallback.buscar_web", fuente("web")):
+        result = await fallback.consultar_fallback("800197268", skip_datos_gov=True)
+    assert "datos_gov" not in llamadas
+    assert result["fuente"] == "No encontrado"
+
+
+@pytest.mark.asyncio
+async def test_consultar_fallback_not_found_needs_an_answer(simular_red):
+    simular_red(lambda request: httpx.Response(404, text="<html>No existe</html>"))
+    result = await fallback.consultar_fallback("800197268")
+    assert result["fuente"] == fallback.NO_ENCONTRADO
+
+
+@pytest.mark.asyncio
+async def test_consultar_fallback_outage_is_not_a_miss(simular_red):
+    def caida(request):
+        raise httpx.ConnectTimeout("timeout", request=request)
+
+    simular_red(caida)
+    result = await fallback.consultar_fallback("800197268")
+    assert result["fuente"] == fallback.SIN_RESPUESTA
+    assert not result["razon_social"]
+
+    # Con todos los circuitos abiertos no se llama a nadie y tampoco es "No encontrado"
+    for salud in fallback.salud_fuentes.values():
+        salud.state, salud.opened_at = "OPEN", time.time()
+    result = await fallback.consultar_fallback("900123456")
+    assert result["fuente"] == fallback.SIN_RESPUESTA
+
+
+def _fuente(nombre, demora, razon_social=None, canceladas=None):
+    async def _f(nit):
+        try:
+            await asyncio.sleep(demora)
+        except asyncio.CancelledError:
+            if canceladas is not None:
+                canceladas.append(nombre)
+            raise
+        return {"nit": nit, "razon_social": razon_social, "fuente": nombre} if razon_social else None
+    return _f
+
+
+def _fuentes(registronit, datos_gov, einforma, web):
+    return patch.multiple(
+        fallback,
+        buscar_registronit=registronit,
+        buscar_datos_gov=datos_gov,
+        buscar_einforma=einforma,
+        buscar_web=web,
+    )
+
+
+@pytest.mark.asyncio
+async def test_race_waits_for_higher_priority_within_hedge():
+    with _fuentes(_fuente("registronit", 0.05, "ALTA"), _fuente("datos_gov", 0.0),
+                  _fuente("einforma", 0.0), _fuente("web", 0.0, "BAJA")), \
+         patch("fallback.FALLBACK_HEDGE_DELAY", 5.0):
+        result = await fallback.consultar_fallback("800197268")
+    assert result["fuente"] == "registronit"
+
+
+@pytest.mark.asyncio
+async def test_race_returns_early_and_cancels_losers():
+    canceladas = []
+    with _fuentes(_fuente("registronit", 0.01, "ALTA"), _fuente("datos_gov", 10, "X", canceladas),
+                  _fuente("einforma", 10, "Y", canceladas), _fuente("web", 10, "Z", canceladas)), \
+         patch("fallback.FALLBACK_HEDGE_DELAY", 5.0):
+        t0 = time.monotonic()
+        result = await fallback.consultar_fallback("800197268")
+        await asyncio.sleep(0)
+    assert result["fuente"] == "registronit"
+    assert time.monotonic() - t0 < 1
+    assert sorted(canceladas) == ["datos_gov", "einforma", "web"]
+
+
+@pytest.mark.asyncio
+async def test_race_hedge_lets_lower_priority_win():
+    with _fuentes(_fuente("registronit", 10, "ALTA"), _fuente("datos_gov", 10),
+                  _fuente("einforma", 10), _fuente("web", 0.01, "BAJA")), \
+         patch("fallback.FALLBACK_HEDGE_DELAY", 0.1):
+        t0 = time.monotonic()
+        result = await fallback.consultar_fallback("800197268")
+    assert result["fuente"] == "web"
+    assert time.monotonic() - t0 < 1
+
+
+@pytest.mark.asyncio
+async def test_failing_source_opens_circuit_and_is_skipped(simular_red):
+    """Replay: RegistroNIT responde 403 siempre; tras 5 fallos deja de consultarse."""
+    hosts = []
+
+    def handler(request):
+        hosts.append(request.url.host)
+        if request.url.host == "www.registronit.com":
+            return httpx.Response(403)
+        if request.url.host == "www.datos.gov.co":
+            return httpx.Response(200, json=[])
+        return httpx.Response(404)
+
+    simular_red(handler)
+    for _ in range(5):
+        await fallback.consultar_fallback("800197268")
+    estado = fallback.estado_fuentes()
+    assert estado["registronit"]["state"] == "OPEN"
+    assert estado["registronit"]["last_error"] == "HTTP 403"
+    assert estado["einforma"]["state"] == "CLOSED"  # 404 = no encontrado, es sano
+
+    hosts.clear()
+    await fallback.consultar_fallback("800197268")
+    assert "www.registronit.com" not in hosts
+    assert fallback.estado_fuentes()["registronit"]["skipped"] == 1
+
+
+def test_half_open_recovers_after_cooldown():
+    salud = fallback.SaludFuente("web", failure_threshold=2)
+    salud.record_failure(0.1, "timeout")
+    salud.record_failure(0.1, "timeout")
+    assert salud.can_request() is False
+    with patch("fallback.time.time", return_value=time.time() + salud.cooldown_seconds + 1):
+        assert salud.can_request() is True   # prueba
+        assert salud.can_request() is False  # solo una a la vez
+    salud.record_success(0.05)
+    assert salud.state == "CLOSED"
+    assert salud.can_request() is True
+
+
+def test_degraded_source_loses_priority():
+    salud = fallback.SaludFuente("registronit", failure_threshold=100)
+    for _ in range(5):
+        salud.record_failure(1.0, "HTTP 500")
+    assert salud.degraded is True
+    assert salud.state == "CLOSED"
+
+
+@pytest.mark.asyncio
+async def test_pool_timeout_is_not_a_source_failure(simular_red):
+    def saturado(request):
+        raise httpx.PoolTimeout("sin conexiones libres", request=request)
+
+    simular_red(saturado)
+    for _ in range(fallback.salud_fuentes["registronit"].failure_threshold + 1):
+        assert await fallback.buscar_registronit("800197268") is None
+    salud = fallback.salud_fuentes["registronit"]
+    assert salud.state == "CLOSED"
+    assert salud.failures == 0
+    assert fallback.fallback_stats["pool_timeouts"] >= salud.failure_threshold
+
+
+@pytest.mark.asyncio
+async def test_datos_gov_probes_keep_short_timeout(simular_red):
+    """Las sondas por NIT esperan 15 s (peor caso de un NIT que no está); solo los lotes piden 30 s."""
+    timeouts = {}
+
+    def handler(request):
+        tipo = "lote" if " in (" in request.url.params.get("$where", "") else "sonda"
+        timeouts.setdefault(tipo, set()).add(request.extensions["timeout"]["read"])
+        return httpx.Response(200, json=[])
+
+    simular_red(handler)
+    await fallback.buscar_datos_gov("800197268")
+    await fallback.buscar_datos_gov_lote(["800197268"])
+    assert timeouts == {"sonda": {15.0}, "lote": {30.0}}
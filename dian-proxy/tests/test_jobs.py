@@ -0,0 +1,220 @@
+"""Tests para los trabajos masivos asíncronos (cola local en SQLite)."""
+from unittest.mock import AsyncMock, patch
+
+import sqlite3
+
+import pytest
+
+import jobs
+from httpx import ASGITransport, AsyncClient
+
+from jobs import _SCHEMA, clave_corresponde
+from jobs import DONE, RUNNING, WAITING_KEY, JobRunner, JobStore
+
+
+def _procesador(llamadas: list):
+    """Procesador falso: resuelve cada NIT en fase 'dian' y termina con resumen."""
+    async def procesar(nits, pro_key, is_pro):
+        llamadas.append(list(nits))
+        for nit in nits:
+            yield {"type": "result", "phase": "dian", "result": {"nit": nit, "razon_social": f"R{nit}"}}
+        yield {"type": "summary", "credits_remaining": 42}
+    return procesar
+
+
+class TestJobStore:
+    def test_create_and_pending(self):
+        store = JobStore(":memory:")
+        job_id = store.create(["111111", "222222"], "KEY", True)
+        job = store.get(job_id)
+        assert job["status"] == "queued"
+        assert job["total"] == 2
+        assert job["done"] == 0
+        store.save_result(job_id, 0, "cache", {"nit": "111111"})
+        assert store.pending_nits(job_id) == ["222222"]
+        assert store.results(job_id)[0]["seq"] == 1
+        assert store.results(job_id, after=1) == []
+
+    def test_unknown_job(self):
+        assert JobStore(":memory:").get("nope") is None
+
+    def test_pro_key_is_not_stored_in_clear(self, tmp_path):
+        path = tmp_path / "jobs.db"
+        store = JobStore(path)
+        job_id = store.create(["111111"], "CLAVE-SECRETA", True)
+        assert b"CLAVE-SECRETA" not in path.read_bytes()
+        assert "pro_key" not in store.get(job_id)
+        assert clave_corresponde(store.get(job_id), "CLAVE-SECRETA")
+        assert not clave_corresponde(store.get(job_id), "OTRA")
+
+    def test_migrates_clear_keys_to_hash(self, tmp_path):
+        path = tmp_path / "jobs.db"
+        db = sqlite3.connect(path, isolation_level=None)
+        db.executescript(_SCHEMA.replace("key_hash       TEXT NOT NULL", "pro_key        TEXT NOT NULL"))
+        db.execute(
+            "INSERT INTO bulk_jobs (id, pro_key, is_pro, status, total, created_at, updated_at) "
+            "VALUES ('j1', 'CLAVE', 1, 'running', 1, 0, 0)"
+        )
+        db.close()
+        job = JobStore(path).get("j1")
+        assert clave_corresponde(job, "CLAVE")
+
+
+class TestJobRunner:
+    @pytest.mark.asyncio
+    async def test_runs_job_to_completion(self):
+        llamadas = []
+        runner = JobRunner(JobStore(":memory:"), _procesador(llamadas))
+        job_id = runner.store.create(["111111", "222222"], "KEY", True)
+        runner.submit(job_id, "KEY")
+        await runner.run_job(job_id)
+        job = runner.store.get(job_id)
+        assert job["status"] == DONE
+        assert job["summary"]["total"] == 2
+        assert job["summary"]["dian_consulted"] == 2
+        assert job["summary"]["credits_remaining"] == 42
+
+    @pytest.mark.asyncio
+    async def test_resumes_after_restart_without_repeating_dian(self, tmp_path):
+        path = tmp_path / "jobs.db"
+        store = JobStore(path)
+        job_id = store.create(["111111", "222222", "333333"], "KEY", True)
+        # Instancia anterior: alcanzó a resolver un NIT por DIAN y se cayó
+        store.set_status(job_id, RUNNING)
+        store.save_result(job_id, 0, "dian", {"nit": "111111", "razon_social": "R"})
+
+        llamadas = []
+        validar = AsyncMock(return_value=True)
+        runner = JobRunner(JobStore(path), _procesador(llamadas), validar_pro=validar)
+        runner.start()
+        await runner.queue.join()
+        # La clave no está en disco: el trabajo PRO espera a su dueño
+        assert runner.store.get(job_id)["status"] == WAITING_KEY
+        assert llamadas == []
+
+        runner.reanudar(job_id, "KEY")
+        await runner.queue.join()
+        await runner.stop()
+
+        validar.assert_awaited_with("KEY")
+        assert llamadas == [["222222", "333333"]]
+        job = runner.store.get(job_id)
+        assert job["status"] == DONE
+        assert job["done"] == 3
+        assert job["summary"]["dian_consulted"] == 3
+
+    @pytest.mark.asyncio
+    async def test_revoked_pro_key_resumes_as_free(self):
+        vistos = []
+
+        async def procesar(nits, pro_key, is_pro):
+            vistos.append(is_pro)
+            yield {"type": "summary", "credits_remaining": 0}
+
+        runner = JobRunner(JobStore(":memory:"), procesar, validar_pro=AsyncMock(return_value=False))
+        job_id = runner.store.create(["111111"], "KEY", True)
+        runner.submit(job_id, "KEY")
+        await runner.run_job(job_id)
+        assert vistos == [False]
+        assert runner.store.get(job_id)["is_pro"] is False
+
+    @pytest.mark.asyncio
+    async def test_results_are_keyed_by_row_not_nit(self):
+        """Un resultado cuyo NIT viene distinto al pedido no se pierde."""
+        async def procesar(nits, pro_key, is_pro):
+            yield {"type": "result", "phase": "offline", "result": {"nit": "0111111", "razon_social": "A"}}
+            yield {"type": "result", "phase": "offline", "result": {"nit": "222222", "razon_social": "B"}}
+            yield {"type": "summary", "credits_remaining": 0}
+
+        runner = JobRunner(JobStore(":memory:"), procesar)
+        job_id = runner.store.create(["111111", "222222"], "", False)
+        await runner.run_job(job_id)
+        assert runner.store.pending_nits(job_id) == []
+        assert runner.store.get(job_id)["done"] == 2
+
+
+class TestVariosProcesos:
+    """Varios procesos (uvicorn --workers N) sobre el mismo JOBS_FILE."""
+
+    @pytest.mark.asyncio
+    async def test_job_runs_in_one_process_only(self, tmp_path):
+        path = tmp_path / "jobs.db"
+        job_id = JobStore(path).create(["111111", "222222", "333333"], "", False)
+        llamadas = []
+        runners = [JobRunner(JobStore(path), _procesador(llamadas)) for _ in range(2)]
+        for runner in runners:
+            runner.start()
+        for runner in runners:
+            await runner.queue.join()
+            await runner.stop()
+
+        assert llamadas == [["111111", "222222", "333333"]]
+        job = runners[0].store.get(job_id)
+        assert job["status"] == DONE
+        assert job["dian_consulted"] == 3
+        assert [r["seq"] for r in runners[0].store.results(job_id)] == [1, 2, 3]
+
+    def test_saved_row_keeps_its_seq(self):
+        store = JobStore(":memory:")
+        job_id = store.create(["111111", "222222"], "", False)
+        assert store.save_result(job_id, 0, "dian", {"nit": "111111"})
+        assert not store.save_result(job_id, 0, "dian", {"nit": "111111"})
+        assert [r["seq"] for r in store.results(job_id)] == [1]
+        assert store.get(job_id)["dian_consulted"] == 1
+
+    def test_live_lease_blocks_other_process_until_it_expires(self, tmp_path, monkeypatch):
+        path = tmp_path / "jobs.db"
+        a, b = JobStore(path), JobStore(path)
+        job_id = a.create(["111111"], "", False, owner="proceso-a")
+        assert b.unfinished() == []
+        assert not b.claim(job_id, "proceso-b")
+        monkeypatch.setattr(jobs, "JOB_LEASE_SECONDS", -1)
+        assert a.renew("proceso-a") == 1  # Lease ya vencido: el dueño "murió"
+        assert b.unfinished() == [job_id]
+        assert b.claim(job_id, "proceso-b")
+        assert not a.save_result(job_id, 0, "dian", {"nit": "111111"}, owner="proceso-a")
+
+    def test_waiting_job_is_resumed_by_one_process(self, tmp_path):
+        path = tmp_path / "jobs.db"
+        store = JobStore(path)
+        job_id = store.create(["111111"], "KEY", True)
+        store.set_status(job_id, WAITING_KEY)
+        r1, r2 = JobRunner(JobStore(path), _procesador([])), JobRunner(JobStore(path), _procesador([]))
+        assert r1.reanudar(job_id, "KEY") is True
+        assert r2.reanudar(job_id, "KEY") is False
+
+
+@pytest.mark.asyncio
+async def test_job_endpoints_roundtrip():
+    from main import app, job_runner
+    runner = JobRunner(JobStore(":memory:"), _procesador([]))
+    transport = ASGITransport(app=app)
+    with patch.object(job_runner, "store", runner.store), \
+         patch.object(job_runner, "submit", lambda job_id, pro_key="": None), \
+         patch.object(job_runner, "owner", runner.owner), \
+         patch("main.is_pro", AsyncMock(return_value=False)):
+        async with AsyncClient(transport=transport, base_url="http://test") as client:
+            resp = await client.post("/api/nit/bulk/jobs", json={"nits": ["800197268", "900123456"]})
+            assert resp.status_code == 202
+            job_id = resp.json()["job_id"]
+
+            resp = await client.get(f"/api/nit/bulk/jobs/{job_id}")
+            assert resp.json()["status"] == "queued"
+
+            await runner.run_job(job_id)
+            resp = await client.get(f"/api/nit/bulk/jobs/{job_id}")
+            data = resp.json()
+            assert data["status"] == "done"
+            assert len(data["results"]) == 2
+            assert "pro_key" not in data
+            assert "key_hash" not in data
+
+            resp = await client.get(f"/api/nit/bulk/jobs/{job_id}", headers={"X-Pro-Key": "AJENA"})
+            assert resp.status_code == 403
+
+            resp = await client.get(f"/api/nit/bulk/jobs/{job_id}", params={"stream": "true"})
+            lines = resp.text.strip().splitlines()
+            assert len(lines) == 3  # 2 resultados + resumen
+
+            resp = await client.get("/api/nit/bulk/jobs/no-existe")
+            assert resp.status_code == 404
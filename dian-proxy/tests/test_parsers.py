@@ -0,0 +1,71 @@
+"""Tests para parsers.py y los parsers de fallback sobre páginas guardadas (tests/fixtures)."""
+from pathlib import Path
+
+import httpx
+import pytest
+
+import fallback
+import http_clients
+import parsers
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+
+def _fixture(nombre: str) -> str:
+    return (FIXTURES / nombre).read_text(encoding="utf-8")
+
+
+@pytest.fixture
+def servir_fixture():
+    """Responder cualquier petición de los clientes compartidos con una página guardada."""
+    def _usar(nombre):
+        html = _fixture(nombre)
+        http_clients.usar_transporte(httpx.MockTransport(lambda request: httpx.Response(200, text=html)))
+    yield _usar
+    http_clients.usar_transporte(None)
+
+
+@pytest.mark.parametrize("backend", parsers.BACKENDS)
+def test_html_a_texto_backends(backend):
+    html = '<p>NIT&nbsp;900123456 - <b>Pérez</b><i>&amp;</i>Cía</p><script>var x="<b>no</b>"</script>'
+    texto = parsers.html_a_texto(html, backend)
+    assert "900123456 - Pérez" in texto
+    assert "  " not in texto
+    if backend != "regex":
+        assert "Pérez & Cía" in texto
+        assert "var x" not in texto
+
+
+def test_html_a_texto_tolerates_bad_input():
+    assert parsers.html_a_texto("") == ""
+    assert "hola" in parsers.html_a_texto('<?xml version="1.0" encoding="utf-8"?><p>hola</p>')
+
+
+def test_nit_patterns_are_compiled_once():
+    assert parsers.patrones_razon_social("800197268") is parsers.patrones_razon_social("800197268")
+
+
+@pytest.mark.asyncio
+async def test_registronit_fixture(servir_fixture):
+    servir_fixture("registronit_800197268.html")
+    info = await fallback.buscar_registronit("800197268")
+    assert info["razon_social"] == "DIRECCION DE IMPUESTOS Y ADUANAS NACIONALES"
+    assert info["direccion"] == "CR 8 6C 38 EDIFICIO SAN AGUSTIN"
+    assert info["estado_rut"] == "ACTIVO"
+
+
+@pytest.mark.asyncio
+async def test_einforma_fixture(servir_fixture):
+    servir_fixture("einforma_800197268.html")
+    info = await fallback.buscar_einforma("800197268")
+    assert info["razon_social"] == "DIRECCION DE IMPUESTOS Y ADUANAS NACIONALES"
+    assert info["direccion"] == "CARRERA 8 6 C 38"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", parsers.BACKENDS)
+async def test_web_fixture(servir_fixture, monkeypatch, backend):
+    monkeypatch.setattr(parsers, "BACKEND", backend)
+    servir_fixture("duckduckgo_800197268.html")
+    info = await fallback.buscar_web("800197268")
+    assert info["razon_social"] == "DIRECCION DE IMPUESTOS Y ADUANAS NACIONALES"
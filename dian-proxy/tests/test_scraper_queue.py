@@ -0,0 +1,145 @@
+"""Tests de la cola de scraping y del worker (SCRAPER_MODE=worker), con consultas DIAN simuladas."""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+import scraper_queue
+from scraper_queue import ScrapeQueue, consultar_remoto
+from scraper_worker import ScraperWorker
+
+
+@pytest.fixture
+def queue(tmp_path):
+    return ScrapeQueue(tmp_path / "scraper_queue.db")
+
+
+@asynccontextmanager
+async def _sesion_falsa():
+    yield object()
+
+
+def test_claim_is_exclusive_and_fifo(queue):
+    a = queue.submit("800197268")
+    b = queue.submit("900123456")
+    assert queue.claim("w1", 1) == [(a, "800197268")]
+    assert queue.claim("w2", 5) == [(b, "900123456")]
+    assert queue.claim("w1", 1) == []
+
+
+def test_pending_nit_is_shared(queue):
+    assert queue.submit("800197268") == queue.submit("800197268")
+    assert queue.stats()["deduplicated"] == 1
+    assert queue.stats()["pending"] == 1
+
+
+def test_task_of_dead_worker_is_requeued(queue, monkeypatch):
+    task_id = queue.submit("800197268")
+    queue.claim("w-muerto", 1)
+    monkeypatch.setattr(scraper_queue, "SCRAPER_TASK_TIMEOUT", -1)
+    assert queue.claim("w-vivo", 1) == [(task_id, "800197268")]
+    assert queue.stats()["requeued"] == 1
+
+
+def test_task_that_keeps_killing_workers_fails(queue, monkeypatch):
+    task_id = queue.submit("800197268")
+    monkeypatch.setattr(scraper_queue, "SCRAPER_TASK_TIMEOUT", -1)
+    monkeypatch.setattr(scraper_queue, "SCRAPER_MAX_ATTEMPTS", 2)
+    assert queue.claim("w1", 1) == [(task_id, "800197268")]
+    assert queue.claim("w2", 1) == [(task_id, "800197268")]  # Segundo intento
+    assert queue.claim("w3", 1) == []  # Agotó los intentos: no vuelve a la cola
+    r = queue.result(task_id)
+    assert r["nit"] == "800197268" and "2 intentos" in r["error"]
+    assert queue.stats()["abandoned"] == 1
+
+
+def test_circuit_breaker_comes_from_worker_heartbeats(queue):
+    assert queue.circuit_breaker()["state"] == "OPEN"  # Sin workers no hay DIAN
+    queue.heartbeat("w1", {"circuit_breaker": {"state": "OPEN", "retry_in_seconds": 90}})
+    queue.heartbeat("w2", {"circuit_breaker": {"state": "OPEN", "retry_in_seconds": 30}})
+    cb = queue.circuit_breaker()
+    assert cb["state"] == "OPEN" and cb["retry_in_seconds"] == 30
+    queue.heartbeat("w2", {"circuit_breaker": {"state": "CLOSED"}})
+    assert queue.circuit_breaker() == {"state": "CLOSED", "workers": {"w1": "OPEN", "w2": "CLOSED"}}
+
+
+def test_queue_is_shared_between_connections(queue):
+    """Otro proceso (aquí otra conexión al mismo archivo) ve las tareas y resultados."""
+    otra = ScrapeQueue(queue.path)
+    task_id = queue.submit("800197268")
+    assert otra.claim("w1", 1) == [(task_id, "800197268")]
+    otra.complete(task_id, {"nit": "800197268", "estado_rut": "ACTIVO"})
+    assert queue.result(task_id)["estado_rut"] == "ACTIVO"
+
+
+@pytest.mark.asyncio
+async def test_worker_serves_api_lookups(queue):
+    consultados = []
+
+    async def consultar(nit):
+        consultados.append(nit)
+        await asyncio.sleep(0.01)
+        return {"nit": nit, "razon_social": f"EMPRESA {nit}", "fuente": "DIAN MUISCA"}
+
+    worker = ScraperWorker(queue, concurrency=2, consultar=consultar, sesion=_sesion_falsa)
+    corriendo = asyncio.create_task(worker.run())
+    try:
+        nits = ["800197268", "900123456", "860034313", "800197268"]
+        resultados = await asyncio.gather(*(consultar_remoto(queue, nit, timeout=5) for nit in nits))
+    finally:
+        worker.stop()
+        await corriendo
+
+    assert [r["razon_social"] for r in resultados] == [f"EMPRESA {nit}" for nit in nits]
+    assert sorted(consultados) == sorted(set(nits))  # El NIT repetido se consultó una vez
+    assert worker.counters["processed"] == 3
+    assert queue.stats()["workers"] == {}  # Se retiró al parar
+
+
+@pytest.mark.asyncio
+async def test_worker_reports_heartbeat_and_errors(queue):
+    async def consultar(nit):
+        raise RuntimeError("Chromium caído")
+
+    worker = ScraperWorker(queue, concurrency=1, consultar=consultar, sesion=_sesion_falsa)
+    corriendo = asyncio.create_task(worker.run())
+    try:
+        r = await consultar_remoto(queue, "800197268", timeout=5)
+        # El primer heartbeat sale al arrancar, con el estado del scraper del worker
+        stats = queue.stats()["workers"][worker.worker_id]
+        assert stats["concurrency"] == 1
+        assert "browser_pool" in stats and "circuit_breaker" in stats
+    finally:
+        worker.stop()
+        await corriendo
+    assert "Chromium caído" in r["error"]
+    assert worker.counters["errors"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lookup_without_workers_times_out(queue):
+    t0 = time.monotonic()
+    r = await consultar_remoto(queue, "800197268", timeout=0.2)
+    assert time.monotonic() - t0 < 2
+    assert r["error"] and r["nit"] == "800197268"
+    assert queue.stats()["timeouts"] == 1
+
+
+@pytest.mark.asyncio
+async def test_health_uses_worker_breaker_in_worker_mode(queue, monkeypatch):
+    from unittest.mock import patch
+    from httpx import ASGITransport, AsyncClient
+    import main
+    from dian_scraper import CircuitBreaker
+
+    monkeypatch.setenv("DEBUG_KEY", "secreto")
+    queue.heartbeat("w1", {"circuit_breaker": {"state": "OPEN", "retry_in_seconds": 60}})
+    # El breaker propio de la API está cerrado: no es el que consulta la DIAN
+    with patch.object(main, "scrape_queue", queue), patch.object(main, "circuit_breaker", CircuitBreaker()):
+        async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+            publico = (await client.get("/api/health")).json()
+            admin = (await client.get("/api/health", headers={"X-Debug-Key": "secreto"})).json()
+    assert publico["status"] == "degraded"
+    assert admin["dian_available"] is False
+    assert admin["circuit_breaker"]["workers"] == {"w1": "OPEN"}
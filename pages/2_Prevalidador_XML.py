@@ -10,11 +10,18 @@ Version: 2.0
 import streamlit as st
 import pandas as pd
 import numpy as np
-import io, os, re, zipfile, copy, json
+import openpyxl
+import io, os, re, sys, zipfile, json, argparse, unicodedata, difflib
 from datetime import datetime
 from collections import defaultdict
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from xml.etree.ElementTree import Element, SubElement, tostring
 from xml.dom.minidom import parseString
+try:
+    from lxml import etree as lxml_etree  # Validacion XSD (opcional)
+except ImportError:
+    lxml_etree = None
 
 NM = "222222222"
 TDM = "43"
@@ -53,6 +60,75 @@ try:
 except Exception:
     MPIOS_VALIDOS = {}
 
+def _normalizar_nombre(nombre):
+    """Nombre de municipio/dpto sin tildes ni signos, en mayusculas: 'Bogotá D.C.' → 'BOGOTA D C'."""
+    nombre = unicodedata.normalize("NFKD", str(nombre)).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^A-Z0-9]+", " ", nombre.upper()).strip()
+
+# Indices DIVIPOLA precalculados (O(1) por registro):
+# - _MPIO_DPTO[int(codigo)] = dpto del municipio (0 si el codigo no existe)
+# - _MPIO_POR_NOMBRE[(dpto, nombre)] / _MPIO_POR_NOMBRE[nombre] = codigo (solo nombres sin ambiguedad)
+# - _NOMBRES_POR_DPTO[dpto] = nombres normalizados, para el emparejamiento aproximado
+_MPIO_DPTO = bytearray(100000)
+_MPIO_POR_NOMBRE = {}
+_NOMBRES_POR_DPTO = defaultdict(list)
+_nombres_repetidos = set()
+for _cod, _nombre in MPIOS_VALIDOS.items():
+    if len(_cod) != 5 or not _cod.isdigit(): continue
+    _MPIO_DPTO[int(_cod)] = int(_cod[:2])
+    _norm = _normalizar_nombre(_nombre)
+    for _n in {_norm, re.sub(r" D C$", "", _norm)}:
+        _MPIO_POR_NOMBRE[(_cod[:2], _n)] = _cod
+        _NOMBRES_POR_DPTO[_cod[:2]].append(_n)
+        if _n in _MPIO_POR_NOMBRE: _nombres_repetidos.add(_n)
+        _MPIO_POR_NOMBRE[_n] = _cod
+for _n in _nombres_repetidos: del _MPIO_POR_NOMBRE[_n]
+_TODOS_NOMBRES = sorted(n for n in _MPIO_POR_NOMBRE if isinstance(n, str))
+_DPTO_POR_NOMBRE = {_normalizar_nombre(v): k for k, v in DPTOS_VALIDOS.items()}
+del _nombres_repetidos
+
+def mpio_valido(mp):
+    """True si el codigo DIVIPOLA de 5 digitos existe."""
+    return len(mp) == 5 and mp.isdigit() and _MPIO_DPTO[int(mp)] != 0
+
+def dpto_de_mpio(mp):
+    """Departamento ('05') de un codigo de municipio valido, o ''."""
+    return str(_MPIO_DPTO[int(mp)]).zfill(2) if mpio_valido(mp) else ""
+
+@lru_cache(maxsize=4096)
+def _mpio_aproximado(dp, nombre):
+    """Codigo del municipio con nombre mas parecido (dentro del dpto si se conoce). Cacheado por nombre."""
+    candidatos = _NOMBRES_POR_DPTO.get(dp) or _TODOS_NOMBRES
+    match = difflib.get_close_matches(nombre, candidatos, n=1, cutoff=0.85)
+    if not match: return ""
+    return _MPIO_POR_NOMBRE.get((dp, match[0])) or _MPIO_POR_NOMBRE.get(match[0], "")
+
+def corregir_ubicacion(dp, mp):
+    """Corrige dpto/municipio de un tercero usando los indices DIVIPOLA.
+    Acepta municipio sin ceros ('5001'), solo la parte municipal ('001' con dpto '05'),
+    nombre del municipio ('Medellin', 'Bogota D.C.'), nombre del dpto y prefijo de dpto errado.
+    Retorna (dp, mp) corregidos, o None si no hay nada que corregir o no se pudo."""
+    dp_nuevo, mp_nuevo = dp, mp
+    if dp and dp not in DPTOS_VALIDOS:
+        dp_nuevo = _DPTO_POR_NOMBRE.get(_normalizar_nombre(dp), dp)
+    if mp and not mpio_valido(mp):
+        if mp.isdigit():
+            if len(mp) <= 3 and dp_nuevo in DPTOS_VALIDOS:
+                mp_nuevo = dp_nuevo + mp.zfill(3)
+            elif len(mp) == 4:
+                mp_nuevo = mp.zfill(5)
+        else:
+            nombre = _normalizar_nombre(mp)
+            mp_nuevo = (_MPIO_POR_NOMBRE.get((dp_nuevo, nombre)) or _MPIO_POR_NOMBRE.get(nombre)
+                        or _mpio_aproximado(dp_nuevo if dp_nuevo in DPTOS_VALIDOS else "", nombre) or mp)
+        if not mpio_valido(mp_nuevo):
+            mp_nuevo = mp
+    if mpio_valido(mp_nuevo):
+        dp_nuevo = dpto_de_mpio(mp_nuevo)
+    if (dp_nuevo, mp_nuevo) == (dp, mp) or (dp_nuevo and dp_nuevo not in DPTOS_VALIDOS):
+        return None
+    return dp_nuevo, mp_nuevo
+
 CONCEPTOS_VALIDOS = {
     "F1001": ["5001","5002","5003","5004","5005","5006","5007","5008","5009","5010",
               "5011","5012","5013","5014","5015","5016","5023","5024","5025","5027",
@@ -115,8 +191,42 @@ def es_nacional(td):
     """Tipos de documento nacionales colombianos."""
     return td in ("11", "12", "13", "21", "22", "31", "46", "47", "48")
 
-def sanitizar_registro(reg, fdef, info_declarante):
+class RegistroParche:
+    """Vista de un registro con cambios superpuestos, sin copiar el registro original.
+    - Lectura: primero los cambios, luego el registro y por ultimo el relleno de direcciones
+      (solo para campos vacios de terceros con NIT distinto a cuantias menores).
+    - Escritura: va a `cambios`, el registro original no se modifica.
+    """
+    __slots__ = ("base", "relleno", "cambios")
+
+    def __init__(self, base, relleno=None):
+        self.base = base
+        self.relleno = relleno
+        self.cambios = {}
+
+    def get(self, campo, default=""):
+        if campo in self.cambios:
+            return self.cambios[campo]
+        val = self.base.get(campo, default)
+        if not val and self.relleno and campo in self.relleno:
+            nid = self.base.get("nid", "")
+            if nid and nid != NM:
+                return self.relleno[campo]
+        return val
+
+    def __getitem__(self, campo):
+        return self.get(campo)
+
+    def __setitem__(self, campo, val):
+        self.cambios[campo] = val
+
+    def __contains__(self, campo):
+        return campo in self.cambios or campo in self.base
+
+def sanitizar_registro(reg, fdef, info_declarante, relleno=None):
     """Sanitiza un registro para que el XML no tenga campos vacíos que la DIAN rechace.
+    No copia el registro: retorna un RegistroParche con los cambios superpuestos.
+    `relleno` son las direcciones por defecto de la hoja (ver rellenar_direcciones).
     Reglas:
     - td: OBLIGATORIO. Si vacío, auto-detectar del NIT.
     - nid: OBLIGATORIO. Si vacío, el registro no debería existir.
@@ -128,7 +238,7 @@ def sanitizar_registro(reg, fdef, info_declarante):
     - Nacional: dir, dp, mp obligatorios. Si faltan, usar datos de empresa.
     - Campos numéricos: "0" en vez de vacío.
     """
-    r = dict(reg)  # Copia
+    r = RegistroParche(reg, relleno)
     nid = r.get("nid", "")
     if not nid:
         return r  # Sin NIT no hay nada que hacer
@@ -220,6 +330,10 @@ def sanitizar_registro(reg, fdef, info_declarante):
             r["dp"] = info_declarante.get("dp", "") or "11"
         if "mp" in fdef["cols"] and not r.get("mp", ""):
             r["mp"] = info_declarante.get("mp", "") or "11001"
+        if "dp" in fdef["cols"] and "mp" in fdef["cols"]:
+            ubicacion = corregir_ubicacion(r.get("dp", ""), r.get("mp", ""))
+            if ubicacion:
+                r["dp"], r["mp"] = ubicacion
     
     # --- País por defecto ---
     if "pais" in fdef["cols"] and not r.get("pais", ""):
@@ -346,36 +460,90 @@ FORMATO_DEFS = {
     },
 }
 
-def leer_excel(uploaded_file):
-    xls = pd.ExcelFile(uploaded_file)
-    formatos = {}
-    for nombre_hoja in xls.sheet_names:
-        if nombre_hoja not in FORMATO_DEFS: continue
-        fdef = FORMATO_DEFS[nombre_hoja]
-        df = pd.read_excel(uploaded_file, sheet_name=nombre_hoja, header=None, skiprows=1)
-        if df.empty: continue
-        registros = []
-        for idx, row in df.iterrows():
-            reg = {}
-            for campo, col_idx in fdef["cols"].items():
-                if col_idx < len(row):
-                    val = safe_str(row.iloc[col_idx])
-                    if val.endswith('.0') and campo not in fdef.get("campos_valor", []):
-                        val = val[:-2]
-                    if val.lower() == 'nan': val = ""
-                    if campo == "dp" and val:
-                        val = val.zfill(2) if val.isdigit() else val
-                    elif campo == "mp" and val:
-                        val = val.zfill(3) if val.isdigit() else val
-                    elif campo == "dv" and val:
-                        val = val.split('.')[0] if '.' in val else val
-                    reg[campo] = val
-                else:
-                    reg[campo] = ""
-            reg["_fila"] = idx + 2
-            registros.append(reg)
-        formatos[nombre_hoja] = {"def": fdef, "registros": registros, "hoja": nombre_hoja}
-    return formatos
+# Campo del registro → etiqueta XML (los campos valor usan su mismo nombre)
+TAG_XML = {"concepto": "co", "td": "tdoc", "nid": "nid", "dv": "dv",
+    "a1": "ape1", "a2": "ape2", "n1": "nom1", "n2": "nom2",
+    "rs": "raz", "dir": "dir", "dp": "dpto", "mp": "mpio", "pais": "pais"}
+CAMPO_XML = {v: k for k, v in TAG_XML.items()}
+
+# XSD por formato (xsd/<formato>.xsd, el mismo que referencia noNamespaceSchemaLocation).
+# No son los XSD oficiales de la DIAN: describen la estructura que arma generar_xml_formato con los
+# tipos de la resolucion, asi que la validacion es un chequeo interno (campos, tipos, largos), no la del MUISCA.
+# Cada XSD fija su version (elemento Version de Cab): si no es la de FORMATO_DEFS se reporta, no se valida
+_XSD_DIR = next((d for d in (os.path.join(os.path.dirname(__file__), "xsd"),
+                             os.path.join(os.path.dirname(__file__), "..", "xsd")) if os.path.isdir(d)), "")
+
+def abrir_excel(uploaded_file):
+    """Abre el libro una sola vez en modo solo lectura: las celdas se leen en streaming al iterar."""
+    return openpyxl.load_workbook(uploaded_file, read_only=True, data_only=True)
+
+def _valor_celda(campo, v, campos_valor):
+    val = safe_str(v)
+    if val.endswith('.0') and campo not in campos_valor:
+        val = val[:-2]
+    if val.lower() == 'nan': val = ""
+    if campo == "dp" and val:
+        val = val.zfill(2) if val.isdigit() else val
+    elif campo == "mp" and val:
+        val = val.zfill(3) if val.isdigit() else val
+    elif campo == "dv" and val:
+        val = val.split('.')[0] if '.' in val else val
+    return val
+
+def iterar_registros(ws, fdef):
+    """Genera los registros de una hoja fila por fila (la fila 1 es el encabezado).
+    Las filas vacias solo se emiten si despues viene una fila con datos."""
+    cols = list(fdef["cols"].items())
+    campos_valor = set(fdef.get("campos_valor", []))
+    filas_vacias = []
+    for fila, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+        if all(v is None for v in row):
+            filas_vacias.append(fila)
+            continue
+        for fila_vacia in filas_vacias:
+            reg = {campo: "" for campo, _ in cols}
+            reg["_fila"] = fila_vacia
+            yield reg
+        filas_vacias = []
+        reg = {}
+        for campo, col_idx in cols:
+            reg[campo] = _valor_celda(campo, row[col_idx], campos_valor) if col_idx < len(row) else ""
+        reg["_fila"] = fila
+        yield reg
+
+def iterar_excel(libro):
+    """Recorre solo las hojas de FORMATO_DEFS del libro abierto: genera (hoja, fdef, registros_lazy).
+    En solo lectura openpyxl corta filas y columnas en la <dimension> que declara la hoja, y muchos
+    exportadores (ERP, librerias) la escriben mal o no la escriben: reset_dimensions() lee la hoja entera."""
+    for nombre_hoja in libro.sheetnames:
+        if nombre_hoja in FORMATO_DEFS:
+            fdef = FORMATO_DEFS[nombre_hoja]
+            ws = libro[nombre_hoja]
+            ws.reset_dimensions()
+            yield nombre_hoja, fdef, iterar_registros(ws, fdef)
+
+def leer_excel(uploaded_file, progreso=None):
+    """Lee las hojas de formatos con una sola apertura del archivo.
+    Los registros quedan en memoria (la validacion, el relleno y la generacion los recorren varias veces);
+    lo que se ahorra es el DataFrame y las celdas de openpyxl.
+    progreso(hoja, filas_leidas, hojas_leidas, hojas_totales) se llama cada 1,000 filas y al terminar
+    cada hoja (el total de filas no se conoce sin leer: la <dimension> de la hoja no es confiable)."""
+    libro = abrir_excel(uploaded_file)
+    try:
+        n_hojas = sum(1 for h in libro.sheetnames if h in FORMATO_DEFS)
+        formatos = {}
+        for i, (nombre_hoja, fdef, regs) in enumerate(iterar_excel(libro)):
+            registros = []
+            for reg in regs:
+                registros.append(reg)
+                if progreso and len(registros) % 1000 == 0:
+                    progreso(nombre_hoja, len(registros), i, n_hojas)
+            if progreso: progreso(nombre_hoja, len(registros), i + 1, n_hojas)
+            if not registros: continue
+            formatos[nombre_hoja] = {"def": fdef, "registros": registros, "hoja": nombre_hoja}
+        return formatos
+    finally:
+        libro.close()
 
 def contar_sin_direccion(formatos):
     resumen = {}
@@ -394,30 +562,32 @@ def contar_sin_direccion(formatos):
     return resumen, nits_sin_dir
 
 def rellenar_direcciones(formatos, direccion, dpto, mpio):
-    formatos_mod = copy.deepcopy(formatos)
+    """Calcula el relleno de direcciones como overlay por hoja, sin copiar ni modificar registros.
+    Retorna ({hoja: {campo: valor}}, total_rellenados). Los valores se aplican al leer
+    cada registro (RegistroParche) durante la validacion y al escribir el XML.
+    """
+    relleno = {}
     total_rellenados = 0
-    for nombre, datos in formatos_mod.items():
+    for nombre, datos in formatos.items():
         fdef = datos["def"]
         if "dir" not in fdef["cols"]: continue
+        relleno[nombre] = {"dir": direccion}
+        if "dp" in fdef["cols"]: relleno[nombre]["dp"] = dpto
+        if "mp" in fdef["cols"]: relleno[nombre]["mp"] = mpio
         for reg in datos["registros"]:
             nid = reg.get("nid", "")
-            if nid and nid != NM:
-                if not reg.get("dir", ""):
-                    reg["dir"] = direccion
-                    total_rellenados += 1
-                if not reg.get("dp", "") and "dp" in fdef["cols"]:
-                    reg["dp"] = dpto
-                if not reg.get("mp", "") and "mp" in fdef["cols"]:
-                    reg["mp"] = mpio
-    return formatos_mod, total_rellenados
-
-def validar_formato(nombre, datos):
+            if nid and nid != NM and not reg.get("dir", ""):
+                total_rellenados += 1
+    return relleno, total_rellenados
+
+def validar_formato(nombre, datos, relleno=None):
     fdef = datos["def"]
     registros = datos["registros"]
     errores = []
     fmt_code = fdef["formato"]
     conceptos_validos = CONCEPTOS_VALIDOS.get("F" + fmt_code, [])
     for reg in registros:
+        if relleno: reg = RegistroParche(reg, relleno)
         fila = reg["_fila"]
         nid = reg.get("nid", "")
         td = reg.get("td", "")
@@ -467,20 +637,29 @@ def validar_formato(nombre, datos):
             # Para exterior: dir debe ir vacía, no es error
         # --- Departamento ---
         dp = reg.get("dp", "")
+        mp = reg.get("mp", "")
+        ubicacion = None
+        if "dp" in fdef["cols"] and "mp" in fdef["cols"] and nid != NM and not es_tipo_doc_extranjero(td):
+            ubicacion = corregir_ubicacion(dp, mp)
         if "dp" in fdef["cols"] and nid != NM and not es_tipo_doc_extranjero(td):
             if dp and dp not in DPTOS_VALIDOS:
-                errores.append((fila, "dp", "warn", "Dpto '" + dp + "' no reconocido - NIT " + nid))
+                if ubicacion and ubicacion[0] in DPTOS_VALIDOS:
+                    errores.append((fila, "dp", "warn", "Dpto '" + dp + "' no reconocido - NIT " + nid + " → se corregira a " + ubicacion[0] + " " + DPTOS_VALIDOS[ubicacion[0]]))
+                else:
+                    errores.append((fila, "dp", "warn", "Dpto '" + dp + "' no reconocido - NIT " + nid))
             elif not dp:
                 errores.append((fila, "dp", "warn", "Departamento vacio - NIT " + nid + " → se usara dpto empresa"))
         # --- Municipio ---
-        mp = reg.get("mp", "")
         if "mp" in fdef["cols"] and nid != NM and not es_tipo_doc_extranjero(td):
             if not mp:
                 errores.append((fila, "mp", "warn", "Municipio vacio - NIT " + nid + " → se usara mpio empresa"))
-            elif MPIOS_VALIDOS and mp not in MPIOS_VALIDOS:
-                errores.append((fila, "mp", "error", "Municipio '" + mp + "' no existe en DIVIPOLA - NIT " + nid))
+            elif MPIOS_VALIDOS and not mpio_valido(mp):
+                if ubicacion and mpio_valido(ubicacion[1]):
+                    errores.append((fila, "mp", "warn", "Municipio '" + mp + "' no existe en DIVIPOLA - NIT " + nid + " → se corregira a " + ubicacion[1] + " " + MPIOS_VALIDOS[ubicacion[1]]))
+                else:
+                    errores.append((fila, "mp", "error", "Municipio '" + mp + "' no existe en DIVIPOLA - NIT " + nid))
             elif dp and mp and not mp.startswith(dp):
-                errores.append((fila, "mp", "warn", "Municipio " + mp + " no corresponde al dpto " + dp + " - NIT " + nid))
+                errores.append((fila, "mp", "warn", "Municipio " + mp + " no corresponde al dpto " + dp + " - NIT " + nid + " → se corregira dpto a " + dpto_de_mpio(mp)))
         # --- País ---
         if "pais" in fdef["cols"]:
             pais = reg.get("pais", "")
@@ -505,10 +684,10 @@ def validar_formato(nombre, datos):
                     errores.append((fila, campo_v, "error", "Valor no numerico en " + campo_v + ": '" + val + "' - NIT " + nid))
     return errores
 
-def resumen_validacion(formatos):
+def resumen_validacion(formatos, relleno=None):
     resultados = {}
     for nombre, datos in formatos.items():
-        errores = validar_formato(nombre, datos)
+        errores = validar_formato(nombre, datos, (relleno or {}).get(nombre))
         criticos = sum(1 for e in errores if e[2] == "error")
         warnings = sum(1 for e in errores if e[2] == "warn")
         resultados[nombre] = {
@@ -517,17 +696,18 @@ def resumen_validacion(formatos):
         }
     return resultados
 
-def generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio):
+MAX_REGISTROS_ENVIO = 5000  # Tope de registros por archivo (maxOccurs de los XSD)
+
+def bloques_envio(registros):
+    """Parte los registros de una hoja en envios de hasta MAX_REGISTROS_ENVIO."""
+    return [registros[i:i + MAX_REGISTROS_ENVIO] for i in range(0, len(registros), MAX_REGISTROS_ENVIO)]
+
+def generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio, relleno=None, registros=None):
+    """XML de un envio del formato. registros: el bloque del envio (por defecto toda la hoja)."""
     fdef = datos["def"]
-    registros = datos["registros"]
+    if registros is None: registros = datos["registros"]
     if not registros: return None
 
-    # --- Sanitizar TODOS los registros antes de generar XML ---
-    registros_limpios = []
-    for reg in registros:
-        r_limpio = sanitizar_registro(reg, fdef, info_declarante)
-        registros_limpios.append(r_limpio)
-
     root = Element("mas")
     root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
     root.set("xsi:noNamespaceSchemaLocation", "../xsd/" + fdef["formato"] + ".xsd")
@@ -546,7 +726,7 @@ def generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio):
         ("NumEnvio", str(num_envio).zfill(5)),
         ("FecEnvio", datetime.now().strftime("%Y-%m-%d")),
         ("FecIni", ANO_GRAVABLE + "-01-01"), ("FecFin", ANO_GRAVABLE + "-12-31"),
-        ("NumReg", str(len(registros_limpios))),
+        ("NumReg", str(len(registros))),
         ("TipoDoc", td_decl),
         ("NumNit", nit_decl),
         ("DV", dv_decl),
@@ -567,15 +747,14 @@ def generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio):
     sec = SubElement(root, fdef["xml_tag"])
     cols = fdef["cols"]
     campos_valor = fdef["campos_valor"]
-    TAG_MAP = {"concepto": "co", "td": "tdoc", "nid": "nid", "dv": "dv",
-        "a1": "ape1", "a2": "ape2", "n1": "nom1", "n2": "nom2",
-        "rs": "raz", "dir": "dir", "dp": "dpto", "mp": "mpio", "pais": "pais"}
 
-    for reg in registros_limpios:
+    # --- Sanitizar cada registro al escribirlo (sin copias de la hoja completa) ---
+    for reg in registros:
+        reg = sanitizar_registro(reg, fdef, info_declarante, relleno)
         row_el = SubElement(sec, fdef["xml_row"])
         for campo in cols:
             if campo.startswith("_"): continue
-            tag = TAG_MAP.get(campo, campo)
+            tag = TAG_XML.get(campo, campo)
             val = reg.get(campo, "")
             # Campos valor ya sanitizados, pero doble-check
             if campo in campos_valor:
@@ -594,6 +773,366 @@ def generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio):
     except Exception:
         return '<?xml version="1.0" encoding="ISO-8859-1"?>\n' + xml_str
 
+_XS = "{http://www.w3.org/2001/XMLSchema}"
+
+@lru_cache(maxsize=None)
+def _esquema_xsd(formato):
+    """Compila el XSD del formato una sola vez por proceso. Retorna (esquema, version que fija el XSD),
+    o None si no hay lxml o no existe el XSD."""
+    if lxml_etree is None or not _XSD_DIR: return None
+    ruta = os.path.join(_XSD_DIR, formato + ".xsd")
+    if not os.path.exists(ruta): return None
+    arbol = lxml_etree.parse(ruta)
+    nodo = arbol.find(".//" + _XS + "element[@name='Version']")
+    return lxml_etree.XMLSchema(arbol), (nodo.get("fixed", "") if nodo is not None else "")
+
+def validar_xml_xsd(xml_content, fdef, registros):
+    """Valida un XML generado contra el XSD de su formato/version.
+    Retorna [(fila, campo, "error", mensaje)] con la fila del Excel (_fila) o "Cab" para el encabezado,
+    o None si la validacion XSD no esta disponible. registros: los del envio, en el orden del XML.
+    Es un chequeo de estructura contra los XSD propios (ver _XSD_DIR), no la validacion oficial del MUISCA.
+    El XML se valida ya armado y no en streaming (iterparse con schema): este se detiene en el primer
+    error y aqui se quieren todos, con su fila; generar_xmls parte cada hoja en envios de hasta
+    MAX_REGISTROS_ENVIO registros, asi que el arbol es acotado."""
+    xsd = _esquema_xsd(fdef["formato"])
+    if xsd is None: return None
+    esquema, version_xsd = xsd
+    if version_xsd and version_xsd != fdef["version"]:
+        return [("Cab", "Version", "error", "XSD " + fdef["formato"] + " es de la version " + version_xsd
+                 + " y el formato se genera en version " + fdef["version"] + ": actualice xsd/" + fdef["formato"] + ".xsd")]
+    try:
+        doc = lxml_etree.fromstring(xml_content.encode("ISO-8859-1"))
+    except lxml_etree.XMLSyntaxError as e:
+        return [("Cab", "", "error", "XML mal formado: " + str(e)[:200])]
+    if esquema.validate(doc): return []
+    ruta_fila = re.compile(r"/" + fdef["xml_tag"] + r"/" + fdef["xml_row"] + r"(?:\[(\d+)\])?(?:/(\w+))?")
+    errores = []
+    for err in esquema.error_log:
+        m = ruta_fila.search(err.path or "")
+        if m:
+            idx = int(m.group(1) or 1) - 1
+            fila = registros[idx]["_fila"] if idx < len(registros) else "Reg " + str(idx + 1)
+            campo = CAMPO_XML.get(m.group(2) or "", m.group(2) or "")
+        else:
+            fila, campo = "Cab", (err.path or "").rsplit("/", 1)[-1]
+        errores.append((fila, campo, "error", "XSD " + fdef["formato"] + ": " + err.message))
+    return errores
+
+def validar_xmls_xsd(xmls_generados, formatos):
+    """Valida contra XSD cada XML generado. Retorna {archivo: errores} o None si no hay lxml.
+    Los envios de un mismo formato se emparejan, por consecutivo, con los bloques de bloques_envio."""
+    if lxml_etree is None: return None
+    por_formato = {d["def"]["formato"]: d for d in formatos.values()}
+    envios = {}
+    for fn in sorted(xmls_generados):  # Dmuisca_01FFFFVVYYYYNNNNNNNN: orden = consecutivo
+        envios.setdefault(fn[10:14], []).append(fn)
+    resultado = {}
+    for formato, archivos in envios.items():
+        datos = por_formato.get(formato)
+        if not datos: continue
+        for fn, registros in zip(archivos, bloques_envio(datos["registros"])):
+            errores = validar_xml_xsd(xmls_generados[fn], datos["def"], registros)
+            if errores is not None: resultado[fn] = errores
+    return resultado
+
+def nombre_xml(fdef, num_envio):
+    """Nombre DIAN del archivo: Dmuisca_CCFFFFFVVYYYYNNNNNNNN.xml"""
+    return "Dmuisca_01" + fdef["formato"] + fdef["version"].zfill(2) + ANO_GRAVABLE + str(num_envio).zfill(8) + ".xml"
+
+def generar_xmls(formatos, info_declarante, num_envio_inicio, formatos_seleccionados=None, relleno=None, progreso=None):
+    """Genera los XML de los formatos seleccionados (en ORDEN_FORMATOS) con consecutivos desde num_envio_inicio.
+    Una hoja con mas de MAX_REGISTROS_ENVIO registros sale en varios envios consecutivos.
+    Retorna {nombre_archivo: contenido}."""
+    if formatos_seleccionados is None:
+        formatos_seleccionados = [f for f in ORDEN_FORMATOS if f in formatos]
+    xmls_generados = {}
+    num_envio = num_envio_inicio
+    for i, nombre_hoja in enumerate(formatos_seleccionados):
+        datos = formatos[nombre_hoja]
+        for bloque in bloques_envio(datos["registros"]):
+            xml_content = generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio,
+                                              (relleno or {}).get(nombre_hoja), registros=bloque)
+            if xml_content:
+                xmls_generados[nombre_xml(datos["def"], num_envio)] = xml_content
+                num_envio += 1
+        if progreso: progreso(i + 1, len(formatos_seleccionados), nombre_hoja)
+    return xmls_generados
+
+def empaquetar_zip(xmls_generados):
+    """Empaqueta los XML en un ZIP (bytes), codificados en ISO-8859-1 como los espera el MUISCA."""
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for fn, content in xmls_generados.items():
+            zf.writestr(fn, content.encode("ISO-8859-1"))
+    return zip_buffer.getvalue()
+
+def validar_declarante(info):
+    """Errores en los datos del declarante que impiden generar los XML."""
+    errores_decl = []
+    nit = info.get("nit", "")
+    if not nit: errores_decl.append("NIT vacio")
+    elif not nit.isdigit(): errores_decl.append("NIT debe ser numerico")
+    if info.get("td") == "31" and not info.get("rs"): errores_decl.append("Razon social vacia")
+    if info.get("td") == "13" and not info.get("a1"): errores_decl.append("Primer apellido vacio")
+    if not info.get("dir"): errores_decl.append("Direccion vacia")
+    if not info.get("dp"): errores_decl.append("Departamento vacio")
+    mp = info.get("mp", "")
+    if not mp: errores_decl.append("Municipio vacio")
+    elif MPIOS_VALIDOS and not mpio_valido(mp): errores_decl.append("Municipio '" + mp + "' no existe en DIVIPOLA")
+    return errores_decl
+
+# ═══════════════════════════════════════════════════════════════
+#  LOTE — varios declarantes / varios libros
+# ═══════════════════════════════════════════════════════════════
+
+# Columnas del CSV de declarantes (header normalizado → campo)
+DECLARANTES_ALIASES = {
+    "nit": "nit", "nit_declarante": "nit", "numero_nit": "nit",
+    "dv": "dv", "digito_verificacion": "dv",
+    "td": "td", "tipo_doc": "td", "tipo_documento": "td",
+    "razon_social": "rs", "rs": "rs", "nombre": "rs",
+    "direccion": "dir", "dir": "dir",
+    "dpto": "dp", "dp": "dp", "departamento": "dp", "cod_dpto": "dp",
+    "mpio": "mp", "mp": "mp", "municipio": "mp", "cod_mpio": "mp",
+    "envio_inicial": "envio", "envio": "envio", "consecutivo": "envio", "num_envio": "envio",
+    "archivo": "archivo", "libro": "archivo", "excel": "archivo",
+}
+
+def _normalizar_header(h):
+    h = unicodedata.normalize("NFKD", str(h)).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", h.strip().lower()).strip("_")
+
+def leer_declarantes(archivo_csv):
+    """Lee el CSV de declarantes (separador , o ;). Retorna lista de info_declarante + envio + archivo."""
+    df = pd.read_csv(archivo_csv, dtype=str, sep=None, engine="python", encoding="utf-8-sig").fillna("")
+    campos = {c: DECLARANTES_ALIASES[_normalizar_header(c)] for c in df.columns
+              if _normalizar_header(c) in DECLARANTES_ALIASES}
+    declarantes = []
+    for _, row in df.iterrows():
+        d = {campo: safe_str(row[col]) for col, campo in campos.items()}
+        nit = re.sub(r"[^0-9]", "", d.get("nit", "").split("-")[0])
+        if not nit: continue
+        td = d.get("td") or "31"
+        rs = d.get("rs", "").upper()
+        info = {"td": td, "nit": nit, "dv": d.get("dv") or calc_dv(nit),
+                "a1": "", "a2": "", "n1": "", "n2": "", "rs": rs,
+                "dir": d.get("dir", ""), "dp": d.get("dp", "").zfill(2) if d.get("dp") else "",
+                "mp": d.get("mp", "").zfill(5) if d.get("mp") else ""}
+        if td != "31":
+            # Persona natural: razon social viene como "APELLIDO1 APELLIDO2 NOMBRE1 NOMBRE2"
+            p = rs.split()
+            info.update({"a1": p[0] if p else "", "a2": p[1] if len(p) > 1 else "",
+                         "n1": p[2] if len(p) > 2 else "", "n2": " ".join(p[3:]), "rs": ""})
+        declarantes.append({"info": info, "envio": safe_int(d.get("envio") or 1) or 1,
+                            "archivo": os.path.basename(d.get("archivo", ""))})
+    return declarantes
+
+def _numeros_nombre(nombre):
+    """Grupos de digitos del nombre del archivo: '901234567_exogena-2025.xlsx' → {'901234567', '2025'}."""
+    return set(re.findall(r"\d+", os.path.splitext(nombre)[0]))
+
+def asignar_libros(declarantes, libros):
+    """Asocia cada declarante con su libro: por columna 'archivo' o por el NIT en el nombre del archivo.
+    `libros` es {nombre_archivo: ruta}. Retorna [(declarante, ruta|None, motivo)]: motivo explica por
+    que no se asigno libro. El NIT debe aparecer como numero completo en el nombre (no como parte de
+    otro numero), un libro no se asigna a dos declarantes y si varios libros coinciden no se adivina."""
+    asignados = [None] * len(declarantes)
+    duenos = {}  # nombre_archivo → NIT al que ya se asigno
+    def _asignar(i, nombre):
+        asignados[i] = (declarantes[i], libros[nombre], "")
+        duenos[nombre] = declarantes[i]["info"]["nit"]
+    # Primero la columna Archivo: es explicita y reserva su libro
+    for i, decl in enumerate(declarantes):
+        nombre = decl["archivo"]
+        if not nombre: continue
+        if nombre not in libros:
+            asignados[i] = (decl, None, "No se cargo el libro '" + nombre + "' indicado en la columna Archivo")
+        elif nombre in duenos:
+            asignados[i] = (decl, None, "El libro '" + nombre + "' ya esta asignado al NIT " + duenos[nombre])
+        else:
+            _asignar(i, nombre)
+    # Luego, por el NIT en el nombre del archivo
+    for i, decl in enumerate(declarantes):
+        if decl["archivo"]: continue
+        nit = decl["info"]["nit"]
+        coinciden = sorted(n for n in libros if nit in _numeros_nombre(n))
+        libres = [n for n in coinciden if n not in duenos]
+        if len(libres) == 1:
+            _asignar(i, libres[0])
+        elif len(libres) > 1:
+            asignados[i] = (decl, None, "Varios libros tienen el NIT " + nit + " en el nombre (" + ", ".join(libres)
+                            + "): indique el libro en la columna Archivo")
+        elif coinciden:
+            asignados[i] = (decl, None, "El libro '" + coinciden[0] + "' ya esta asignado al NIT " + duenos[coinciden[0]])
+        else:
+            asignados[i] = (decl, None, "No se encontro un libro con el NIT " + nit + " en el nombre del archivo")
+    return asignados
+
+def procesar_declarante(decl, ruta_libro, dir_salida, forzar=False, motivo=""):
+    """Valida el libro de un declarante y escribe su ZIP de XML en dir_salida.
+    motivo: por que asignar_libros no le dio libro (si ruta_libro es None).
+    Corre en un worker: recibe y retorna solo datos serializables."""
+    info = decl["info"]
+    resumen = {"NIT": info["nit"], "Declarante": info["rs"] or " ".join(filter(None, [info["a1"], info["n1"]])),
+               "Archivo": os.path.basename(ruta_libro) if ruta_libro else decl["archivo"],
+               "Registros": 0, "Errores": 0, "Advertencias": 0, "XML": 0, "ZIP": "", "Estado": ""}
+    errores = []
+
+    def _error_general(msg):
+        errores.append({"NIT": info["nit"], "Archivo": resumen["Archivo"], "Formato": "", "Fila": "",
+                        "Campo": "", "Tipo": "error", "Mensaje": msg})
+        resumen["Errores"] += 1
+
+    if not ruta_libro:
+        _error_general(motivo or "No se encontro el libro de exogena del declarante")
+        resumen["Estado"] = "Sin libro"
+        return resumen, errores
+    for e in validar_declarante(info):
+        _error_general("Declarante: " + e)
+    try:
+        formatos = leer_excel(ruta_libro)
+    except Exception as e:
+        _error_general("No se pudo leer el Excel: " + str(e)[:200])
+        resumen["Estado"] = "Error de lectura"
+        return resumen, errores
+    if not formatos:
+        _error_general("No se encontraron hojas con formatos validos")
+        resumen["Estado"] = "Sin formatos"
+        return resumen, errores
+
+    for nombre, res in resumen_validacion(formatos).items():
+        resumen["Registros"] += res["registros"]
+        resumen["Errores"] += res["criticos"]
+        resumen["Advertencias"] += res["warnings"]
+        for fila, campo, tipo, msg in res["errores"]:
+            errores.append({"NIT": info["nit"], "Archivo": resumen["Archivo"], "Formato": nombre,
+                            "Fila": fila, "Campo": campo, "Tipo": tipo, "Mensaje": msg})
+
+    if resumen["Errores"] and not forzar:
+        resumen["Estado"] = "Con errores"
+        return resumen, errores
+    xmls = generar_xmls(formatos, info, decl["envio"])
+    errores_xsd = 0
+    for fn, errs in (validar_xmls_xsd(xmls, formatos) or {}).items():
+        errores_xsd += len(errs)
+        for fila, campo, tipo, msg in errs:
+            errores.append({"NIT": info["nit"], "Archivo": fn, "Formato": fn[10:14], "Fila": fila,
+                            "Campo": campo, "Tipo": "xsd", "Mensaje": msg})
+    resumen["Errores"] += errores_xsd
+    zip_name = "Exogena_XML_" + ANO_GRAVABLE + "_" + info["nit"] + ".zip"
+    with open(os.path.join(dir_salida, zip_name), "wb") as f:
+        f.write(empaquetar_zip(xmls))
+    estado = "Listo"
+    if errores_xsd: estado = "Error de estructura"
+    elif resumen["Errores"]: estado = "Generado con errores"
+    resumen.update({"XML": len(xmls), "ZIP": zip_name, "Estado": estado})
+    return resumen, errores
+
+def procesar_lote(declarantes, libros, dir_salida, workers=4, forzar=False, usar_procesos=True, progreso=None):
+    """Procesa todos los declarantes en un pool de workers.
+    Escribe un ZIP por declarante, resumen_lote.csv y reporte_errores.csv en dir_salida.
+    Retorna (resumen, errores) como DataFrames."""
+    os.makedirs(dir_salida, exist_ok=True)
+    pool_cls = ProcessPoolExecutor if usar_procesos else ThreadPoolExecutor
+    resumenes, todos_errores = [], []
+    asignados = asignar_libros(declarantes, libros)
+    with pool_cls(max_workers=max(1, workers)) as pool:
+        futuros = {pool.submit(procesar_declarante, decl, ruta, dir_salida, forzar, motivo): decl
+                   for decl, ruta, motivo in asignados}
+        for i, fut in enumerate(as_completed(futuros)):
+            decl = futuros[fut]
+            try:
+                resumen, errores = fut.result()
+            except Exception as e:
+                resumen = {"NIT": decl["info"]["nit"], "Declarante": decl["info"]["rs"], "Archivo": decl["archivo"],
+                           "Registros": 0, "Errores": 1, "Advertencias": 0, "XML": 0, "ZIP": "", "Estado": "Fallo"}
+                errores = [{"NIT": decl["info"]["nit"], "Archivo": decl["archivo"], "Formato": "", "Fila": "",
+                            "Campo": "", "Tipo": "error", "Mensaje": "Error procesando: " + str(e)[:200]}]
+            resumenes.append(resumen)
+            todos_errores.extend(errores)
+            if progreso: progreso(i + 1, len(futuros), resumen["NIT"])
+    df_resumen = pd.DataFrame(resumenes, columns=["NIT", "Declarante", "Archivo", "Registros", "Errores",
+                                                  "Advertencias", "XML", "ZIP", "Estado"]).sort_values("NIT")
+    df_errores = pd.DataFrame(todos_errores, columns=["NIT", "Archivo", "Formato", "Fila", "Campo", "Tipo", "Mensaje"])
+    df_resumen.to_csv(os.path.join(dir_salida, "resumen_lote.csv"), index=False, encoding="utf-8-sig")
+    df_errores.to_csv(os.path.join(dir_salida, "reporte_errores.csv"), index=False, encoding="utf-8-sig")
+    return df_resumen, df_errores
+
+def main_cli(argv=None):
+    """Modo lote por linea de comandos:
+    python 2_Prevalidador_XML.py lote declarantes.csv libros/*.xlsx -o salida -w 8"""
+    parser = argparse.ArgumentParser(prog="2_Prevalidador_XML.py lote",
+        description="Prevalida y genera los XML de exogena para varios declarantes")
+    parser.add_argument("declarantes", help="CSV con NIT, DV, razon social, direccion, dpto, mpio, envio inicial [, archivo]")
+    parser.add_argument("libros", nargs="+", help="Excel generados por la App de Exogena")
+    parser.add_argument("-o", "--salida", default="xml_lote", help="Carpeta de salida (default: xml_lote)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 4, help="Procesos en paralelo")
+    parser.add_argument("--forzar", action="store_true", help="Generar XML aunque haya errores criticos")
+    args = parser.parse_args(argv)
+
+    declarantes = leer_declarantes(args.declarantes)
+    libros = {os.path.basename(r): r for r in args.libros}
+    df_resumen, df_errores = procesar_lote(
+        declarantes, libros, args.salida, workers=args.workers, forzar=args.forzar,
+        progreso=lambda i, n, nit: print("[" + str(i) + "/" + str(n) + "] NIT " + nit, file=sys.stderr))
+    print(df_resumen.to_string(index=False))
+    listos = int((df_resumen["ZIP"] != "").sum())
+    # Los errores de estructura (XSD propios) tambien cuentan: el XML no es el que espera el formato
+    n_errores = int(df_errores["Tipo"].isin(["error", "xsd"]).sum())
+    print("\n" + str(listos) + "/" + str(len(df_resumen)) + " declarantes con XML generados en " + args.salida
+          + " — " + str(n_errores) + " errores en reporte_errores.csv")
+    return 0 if listos == len(df_resumen) and not (df_errores["Tipo"] == "xsd").any() else 1
+
+def main_lote():
+    """Modo lote en la app: varios libros + CSV de declarantes."""
+    import tempfile
+    st.subheader("Lote: varios declarantes")
+    st.caption("El CSV debe tener columnas NIT, DV, Razon Social, Direccion, Dpto, Mpio, Envio Inicial "
+               "y opcionalmente Archivo (nombre del Excel). Sin Archivo, se busca el NIT en el nombre del Excel.")
+    csv_file = st.file_uploader("CSV de declarantes", type=["csv"])
+    libros_up = st.file_uploader("Excel de exogena (uno por declarante)", type=["xlsx"], accept_multiple_files=True)
+    c1, c2 = st.columns(2)
+    with c1: workers = st.number_input("Workers en paralelo", min_value=1, max_value=32, value=4, step=1)
+    with c2: forzar = st.checkbox("Generar aunque haya errores criticos", value=False)
+    if not csv_file or not libros_up:
+        st.info("Suba el CSV de declarantes y los Excel generados por la App de Exogena.")
+        return
+    declarantes = leer_declarantes(csv_file)
+    st.markdown("**" + str(len(declarantes)) + " declarantes** y **" + str(len(libros_up)) + " libros** cargados")
+    if not st.button("Validar y generar lote", type="primary", use_container_width=True):
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dir_libros = os.path.join(tmp, "libros")
+        dir_salida = os.path.join(tmp, "salida")
+        os.makedirs(dir_libros)
+        libros = {}
+        for up in libros_up:
+            ruta = os.path.join(dir_libros, os.path.basename(up.name))
+            with open(ruta, "wb") as f:
+                f.write(up.getbuffer())
+            libros[os.path.basename(up.name)] = ruta
+        progress = st.progress(0, text="Procesando lote...")
+        df_resumen, df_errores = procesar_lote(
+            declarantes, libros, dir_salida, workers=int(workers), forzar=forzar, usar_procesos=False,
+            progreso=lambda i, n, nit: progress.progress(i / n, text="NIT " + nit + " (" + str(i) + "/" + str(n) + ")"))
+        progress.empty()
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zf:
+            for fn in sorted(os.listdir(dir_salida)):
+                zf.write(os.path.join(dir_salida, fn), fn)
+
+    listos = int((df_resumen["ZIP"] != "").sum())
+    if listos == len(df_resumen): st.success(str(listos) + " declarantes listos")
+    else: st.warning(str(listos) + "/" + str(len(df_resumen)) + " declarantes con XML generados")
+    st.dataframe(df_resumen, use_container_width=True, hide_index=True)
+    st.download_button("Descargar lote (ZIP por declarante + reportes)", data=zip_buffer.getvalue(),
+        file_name="Exogena_XML_Lote_" + ANO_GRAVABLE + ".zip", mime="application/zip",
+        type="primary", use_container_width=True)
+    if not df_errores.empty:
+        with st.expander("Reporte consolidado de errores (" + "{:,}".format(len(df_errores)) + ")"):
+            st.dataframe(df_errores.head(1000), use_container_width=True, hide_index=True)
+
 def main():
     st.set_page_config(page_title="Prevalidador XML - Exogena DIAN", page_icon="magnifier", layout="wide")
 
@@ -614,6 +1153,11 @@ def main():
     st.title("Prevalidador y Generador XML - Exogena DIAN")
     st.caption("Cargue el Excel, valide los datos, rellene direcciones faltantes y genere los XML para el MUISCA")
 
+    modo = st.radio("Modo", ["Un declarante", "Lote (varios declarantes)"], horizontal=True)
+    if modo.startswith("Lote"):
+        main_lote()
+        return
+
     with st.sidebar:
         st.header("Datos de la Empresa")
         st.caption("Van en el encabezado de cada XML")
@@ -699,19 +1243,24 @@ def main():
             """)
         return
 
-    if "formatos_originales" not in st.session_state: st.session_state.formatos_originales = None
-    if "formatos_trabajo" not in st.session_state: st.session_state.formatos_trabajo = None
+    if "formatos" not in st.session_state: st.session_state.formatos = None
+    if "relleno_direcciones" not in st.session_state: st.session_state.relleno_direcciones = None
     if "direcciones_rellenadas" not in st.session_state: st.session_state.direcciones_rellenadas = False
 
     file_id = uploaded.name + "_" + str(uploaded.size)
     if st.session_state.get("file_id") != file_id:
-        formatos = leer_excel(uploaded)
-        st.session_state.formatos_originales = formatos
-        st.session_state.formatos_trabajo = copy.deepcopy(formatos)
+        progress = st.progress(0, text="Leyendo Excel...")
+        def _progreso_lectura(hoja, leidas, hojas_leidas, hojas_totales):
+            texto = "Leyendo " + hoja + ": " + "{:,}".format(leidas) + " filas"
+            progress.progress(hojas_leidas / hojas_totales if hojas_totales else 0, text=texto)
+        st.session_state.formatos = leer_excel(uploaded, progreso=_progreso_lectura)
+        progress.empty()
+        st.session_state.relleno_direcciones = None
         st.session_state.file_id = file_id
         st.session_state.direcciones_rellenadas = False
 
-    formatos = st.session_state.formatos_trabajo
+    formatos = st.session_state.formatos
+    relleno = st.session_state.relleno_direcciones
     if not formatos:
         st.error("No se encontraron hojas con formatos validos.")
         return
@@ -729,8 +1278,8 @@ def main():
                 st.markdown("**Direccion de la empresa:** " + decl_dir + " (Dpto " + decl_dp + ", Mpio " + decl_mp + ")")
                 st.markdown("Se rellenaran direccion, departamento y municipio de todos los terceros que no tengan estos datos.")
                 if st.button("Rellenar " + str(total_sin) + " registros con direccion de la empresa", type="primary"):
-                    formatos_mod, n_rellenados = rellenar_direcciones(formatos, decl_dir, decl_dp, decl_mp)
-                    st.session_state.formatos_trabajo = formatos_mod
+                    relleno, n_rellenados = rellenar_direcciones(formatos, decl_dir, decl_dp, decl_mp)
+                    st.session_state.relleno_direcciones = relleno
                     st.session_state.direcciones_rellenadas = True
                     st.rerun()
             else:
@@ -738,14 +1287,14 @@ def main():
     elif st.session_state.direcciones_rellenadas:
         st.success("Direcciones ya rellenadas con datos de la empresa")
         if st.button("Deshacer relleno de direcciones"):
-            st.session_state.formatos_trabajo = copy.deepcopy(st.session_state.formatos_originales)
+            st.session_state.relleno_direcciones = None
             st.session_state.direcciones_rellenadas = False
             st.rerun()
 
     st.divider()
 
     # VALIDACION
-    resultados = resumen_validacion(formatos)
+    resultados = resumen_validacion(formatos, relleno)
     total_regs = sum(r["registros"] for r in resultados.values())
     total_criticos = sum(r["criticos"] for r in resultados.values())
     total_warnings = sum(r["warnings"] for r in resultados.values())
@@ -798,15 +1347,7 @@ def main():
 
     st.divider()
     st.subheader("Datos de la empresa para XML")
-    errores_decl = []
-    if not decl_nit: errores_decl.append("NIT vacio")
-    elif not decl_nit.isdigit(): errores_decl.append("NIT debe ser numerico")
-    if decl_td_code == "31" and not decl_rs: errores_decl.append("Razon social vacia")
-    if decl_td_code == "13" and not decl_a1: errores_decl.append("Primer apellido vacio")
-    if not decl_dir: errores_decl.append("Direccion vacia")
-    if not decl_dp: errores_decl.append("Departamento vacio")
-    if not decl_mp: errores_decl.append("Municipio vacio")
-    elif MPIOS_VALIDOS and decl_mp not in MPIOS_VALIDOS: errores_decl.append("Municipio '" + decl_mp + "' no existe en DIVIPOLA")
+    errores_decl = validar_declarante(info_declarante)
 
     if errores_decl:
         for e in errores_decl: st.error("❌ " + e)
@@ -821,11 +1362,8 @@ def main():
             consec_data = []
             n = num_envio_inicio
             for f in formatos_disponibles:
-                fmt_num = FORMATO_DEFS[f]["formato"]
-                version = FORMATO_DEFS[f]["version"]
-                xml_name = "Dmuisca_01" + fmt_num + version.zfill(2) + ANO_GRAVABLE + str(n).zfill(8) + ".xml"
-                consec_data.append({"Formato": f, "Codigo": fmt_num,
-                    "Archivo XML": xml_name, "Envio #": n})
+                consec_data.append({"Formato": f, "Codigo": FORMATO_DEFS[f]["formato"],
+                    "Archivo XML": nombre_xml(FORMATO_DEFS[f], n), "Envio #": n})
                 n += 1
             st.dataframe(pd.DataFrame(consec_data), use_container_width=True, hide_index=True)
 
@@ -843,20 +1381,10 @@ def main():
     elif puede_forzar: generar = st.button("Generar con errores", type="secondary", use_container_width=True)
 
     if generar and formatos_seleccionados:
-        xmls_generados = {}
-        num_envio = num_envio_inicio
         progress = st.progress(0, text="Generando XML...")
-        for i, nombre_hoja in enumerate(formatos_seleccionados):
-            datos = formatos[nombre_hoja]
-            fdef = datos["def"]
-            fmt_num = fdef["formato"]
-            xml_content = generar_xml_formato(nombre_hoja, datos, info_declarante, num_envio)
-            if xml_content:
-                version = fdef["version"]
-                filename = "Dmuisca_01" + fmt_num + version.zfill(2) + ANO_GRAVABLE + str(num_envio).zfill(8) + ".xml"
-                xmls_generados[filename] = xml_content
-                num_envio += 1
-            progress.progress((i + 1) / len(formatos_seleccionados), text="Generando " + nombre_hoja + "...")
+        xmls_generados = generar_xmls(formatos, info_declarante, num_envio_inicio,
+            formatos_seleccionados, relleno,
+            progreso=lambda i, n, hoja: progress.progress(i / n, text="Generando " + hoja + "..."))
         progress.empty()
 
         if xmls_generados:
@@ -867,6 +1395,26 @@ def main():
                     "Envio #": fn.split("_")[-1].replace(".xml", "")})
             st.dataframe(pd.DataFrame(tabla_xml), use_container_width=True, hide_index=True)
 
+            resultado_xsd = validar_xmls_xsd(xmls_generados, formatos)
+            if resultado_xsd is None:
+                st.caption("Chequeo de estructura XSD no disponible (requiere lxml)")
+            elif any(resultado_xsd.values()):
+                total_xsd = sum(len(e) for e in resultado_xsd.values())
+                st.error("**" + str(total_xsd) + " errores de estructura XSD** — revise estos archivos antes de cargarlos")
+                with st.expander("Ver errores XSD", expanded=True):
+                    for fn, errs in resultado_xsd.items():
+                        if not errs: continue
+                        st.markdown("**" + fn + "** (" + str(len(errs)) + ")")
+                        for fila, campo, tipo, msg in errs[:10]:
+                            st.markdown("  ❌ Fila " + str(fila) + (" [" + campo + "]" if campo else "") + ": " + msg)
+                        if len(errs) > 10:
+                            st.caption("  ... y " + str(len(errs) - 10) + " mas")
+            else:
+                st.success("Los " + str(len(resultado_xsd)) + " XML cumplen la estructura XSD de su formato")
+            if resultado_xsd is not None:
+                st.caption("Chequeo interno contra los XSD del prevalidador (campos, tipos y largos de cada formato); "
+                           "no reemplaza la validacion oficial del MUISCA al cargar los archivos.")
+
             st.markdown("**Descargar individual:**")
             cols_dl = st.columns(min(len(xmls_generados), 4))
             for i, (fn, content) in enumerate(xmls_generados.items()):
@@ -875,12 +1423,7 @@ def main():
                         file_name=fn, mime="application/xml", use_container_width=True)
 
             st.divider()
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for fn, content in xmls_generados.items():
-                    zf.writestr(fn, content.encode("ISO-8859-1"))
-            zip_buffer.seek(0)
-            st.download_button("Descargar TODOS los XML (ZIP)", data=zip_buffer,
+            st.download_button("Descargar TODOS los XML (ZIP)", data=empaquetar_zip(xmls_generados),
                 file_name="Exogena_XML_" + ANO_GRAVABLE + "_" + decl_nit + ".zip",
                 mime="application/zip", type="primary", use_container_width=True)
 
@@ -913,5 +1456,7 @@ def main():
             st.success("Sin errores. Datos limpios!")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "lote":
+        sys.exit(main_cli(sys.argv[2:]))
     main()
 
@@ -0,0 +1,18 @@
+"""Configuración de pytest para las apps Streamlit (raíz del repo).
+Ejecutar: python -m pytest tests/ -v
+"""
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+RAIZ = Path(__file__).resolve().parent.parent
+
+
+@pytest.fixture(scope="session")
+def pv():
+    """2_Prevalidador_XML.py como módulo (el nombre empieza por dígito: no se importa con import)."""
+    spec = importlib.util.spec_from_file_location("prevalidador_xml", RAIZ / "2_Prevalidador_XML.py")
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
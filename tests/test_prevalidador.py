@@ -0,0 +1,163 @@
+"""Tests de las funciones puras del Prevalidador XML (2_Prevalidador_XML.py)."""
+import pytest
+
+DECLARANTE = {"td": "31", "nit": "900123456", "dv": "", "a1": "", "a2": "", "n1": "", "n2": "",
+              "rs": "DECLARANTE SAS", "dir": "CALLE 2", "dp": "11", "mp": "11001"}
+
+
+def _pago(i: int, **cambios) -> dict:
+    reg = {"concepto": "5002", "td": "31", "nid": str(800000000 + i), "dv": "", "a1": "", "a2": "",
+           "n1": "", "n2": "", "rs": "EMPRESA " + str(i), "dir": "CALLE 1", "dp": "11", "mp": "001",
+           "pais": "169", "pago_deducible": "1000", "pago_no_deducible": "0", "iva_mayor_valor": "0",
+           "retfte_practicada": "0", "iva_mayor_valor_nd": "0", "retica": "0", "retiva_practicada": "0",
+           "retiva_asumida": "0", "_fila": i + 2}
+    reg.update(cambios)
+    return reg
+
+
+def _formatos(pv, registros):
+    return {"F1001 Pagos": {"def": pv.FORMATO_DEFS["F1001 Pagos"], "registros": registros, "hoja": "F1001 Pagos"}}
+
+
+class TestXsd:
+    @pytest.fixture(autouse=True)
+    def _requiere_lxml(self, pv):
+        if pv.lxml_etree is None:
+            pytest.skip("lxml no instalado")
+
+    def test_valid_xml_has_no_errors(self, pv):
+        formatos = _formatos(pv, [_pago(i) for i in range(3)])
+        xmls = pv.generar_xmls(formatos, DECLARANTE, 1)
+        assert list(pv.validar_xmls_xsd(xmls, formatos).values()) == [[]]
+
+    def test_error_maps_to_excel_row(self, pv):
+        registros = [_pago(i) for i in range(3)]
+        registros[1]["concepto"] = "ABC"
+        formatos = _formatos(pv, registros)
+        errores = next(iter(pv.validar_xmls_xsd(pv.generar_xmls(formatos, DECLARANTE, 1), formatos).values()))
+        assert [(fila, campo) for fila, campo, _, _ in errores] == [(3, "concepto")]
+
+    def test_sheet_over_limit_is_split_into_envios(self, pv):
+        """Más de 5.000 registros: varios envíos válidos, y los errores del segundo apuntan a su fila."""
+        n = pv.MAX_REGISTROS_ENVIO + 3
+        registros = [_pago(i) for i in range(n)]
+        registros[n - 2]["concepto"] = "ABC"
+        formatos = _formatos(pv, registros)
+        xmls = pv.generar_xmls(formatos, DECLARANTE, 7)
+        assert sorted(xmls) == [pv.nombre_xml(pv.FORMATO_DEFS["F1001 Pagos"], e) for e in (7, 8)]
+        assert "<NumReg>3</NumReg>" in xmls[sorted(xmls)[1]]
+        resultado = pv.validar_xmls_xsd(xmls, formatos)
+        primero, segundo = (resultado[fn] for fn in sorted(xmls))
+        assert primero == []
+        assert [(fila, campo) for fila, campo, _, _ in segundo] == [(n, "concepto")]
+
+    def test_version_mismatch_is_reported(self, pv):
+        fdef = dict(pv.FORMATO_DEFS["F1001 Pagos"], version="99")
+        errores = pv.validar_xml_xsd("<mas/>", fdef, [])
+        assert errores[0][:3] == ("Cab", "Version", "error")
+
+
+def _libro(tmp_path, filas, dimension=None):
+    """Libro con la hoja F1001 Pagos; dimension reescribe la <dimension> que declara la hoja."""
+    import re
+    import zipfile
+    import openpyxl
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "F1001 Pagos"
+    ws.append(["Concepto", "Tipo doc", "NIT"])
+    for fila in filas:
+        ws.append(fila)
+    ruta = tmp_path / "libro.xlsx"
+    wb.save(ruta)
+    if dimension is not None:
+        reescrito = tmp_path / "libro_export.xlsx"
+        with zipfile.ZipFile(ruta) as zin, zipfile.ZipFile(reescrito, "w") as zout:
+            for item in zin.infolist():
+                data = zin.read(item.filename)
+                if item.filename == "xl/worksheets/sheet1.xml":
+                    data = re.sub(rb'<dimension ref="[^"]*"/>', dimension.encode(), data)
+                zout.writestr(item, data)
+        ruta = reescrito
+    return ruta
+
+
+class TestLeerExcel:
+    def test_reads_rows_and_columns(self, pv, tmp_path):
+        formatos = pv.leer_excel(_libro(tmp_path, [["5002", 31, 800197268], ["5004", 13, 1234.0]]))
+        regs = formatos["F1001 Pagos"]["registros"]
+        assert [(r["concepto"], r["td"], r["nid"], r["_fila"]) for r in regs] == [
+            ("5002", "31", "800197268", 2), ("5004", "13", "1234", 3)]
+
+    @pytest.mark.parametrize("dimension", ['<dimension ref="A1:B2"/>', ""])
+    def test_wrong_or_missing_dimension_does_not_truncate(self, pv, tmp_path, dimension):
+        """Exportadores que declaran mal (o no declaran) la <dimension>: se lee la hoja completa."""
+        filas = [["5002", 31, 800000000 + i] for i in range(5)]
+        formatos = pv.leer_excel(_libro(tmp_path, filas, dimension))
+        regs = formatos["F1001 Pagos"]["registros"]
+        assert len(regs) == 5
+        assert regs[-1]["nid"] == "800000004"  # Columna C, fuera de A1:B2
+
+    def test_progress_reports_sheets(self, pv, tmp_path):
+        llamadas = []
+        pv.leer_excel(_libro(tmp_path, [["5002", 31, 800197268]]), progreso=lambda *a: llamadas.append(a))
+        assert llamadas[-1] == ("F1001 Pagos", 1, 1, 1)
+
+
+def _decl(nit: str, archivo: str = "") -> dict:
+    return {"info": dict(DECLARANTE, nit=nit), "envio": 1, "archivo": archivo}
+
+
+class TestAsignarLibros:
+    def test_short_nit_does_not_match_inside_other_number(self, pv):
+        """La cédula 1234 no toma el libro del NIT 901234567."""
+        libros = {"901234567_exogena.xlsx": "/l/a.xlsx", "exogena 1234.xlsx": "/l/b.xlsx"}
+        asignados = pv.asignar_libros([_decl("901234567"), _decl("1234")], libros)
+        assert [(d["info"]["nit"], ruta) for d, ruta, _ in asignados] == [
+            ("901234567", "/l/a.xlsx"), ("1234", "/l/b.xlsx")]
+
+    def test_substring_only_match_is_reported_missing(self, pv):
+        asignados = pv.asignar_libros([_decl("1234")], {"901234567_exogena.xlsx": "/l/a.xlsx"})
+        _, ruta, motivo = asignados[0]
+        assert ruta is None and "No se encontro" in motivo
+
+    def test_ambiguous_match_is_not_guessed(self, pv):
+        libros = {"800197268_2024.xlsx": "/l/a.xlsx", "800197268_2025.xlsx": "/l/b.xlsx"}
+        _, ruta, motivo = pv.asignar_libros([_decl("800197268")], libros)[0]
+        assert ruta is None and "Varios libros" in motivo
+
+    def test_book_is_not_given_to_two_declarantes(self, pv):
+        """Un libro reservado por la columna Archivo no se vuelve a asignar por NIT."""
+        libros = {"800197268.xlsx": "/l/a.xlsx"}
+        asignados = pv.asignar_libros([_decl("800197268"), _decl("900123456", "800197268.xlsx")], libros)
+        (_, ruta_nit, motivo), (_, ruta_archivo, _) = asignados
+        assert ruta_archivo == "/l/a.xlsx"
+        assert ruta_nit is None and "ya esta asignado al NIT 900123456" in motivo
+
+    def test_missing_book_reason_reaches_report(self, pv, tmp_path):
+        resumen, errores = pv.procesar_declarante(_decl("1234"), None, str(tmp_path), motivo="Varios libros ...")
+        assert resumen["Estado"] == "Sin libro"
+        assert errores[0]["Mensaje"] == "Varios libros ..."
+
+
+class TestCorregirUbicacion:
+    @pytest.mark.parametrize("dp, mp, esperado", [
+        ("05", "5001", ("05", "05001")),          # código sin cero a la izquierda
+        ("05", "001", ("05", "05001")),           # sufijo de 3 dígitos + departamento
+        ("", "Medellin", ("05", "05001")),        # nombre del municipio
+        ("11", "Bogota D.C.", ("11", "11001")),
+        ("Antioquia", "05001", ("05", "05001")),  # nombre del departamento
+        ("08", "05001", ("05", "05001")),         # departamento que no corresponde
+    ])
+    def test_fixes_common_mistakes(self, pv, dp, mp, esperado):
+        assert pv.corregir_ubicacion(dp, mp) == esperado
+
+    def test_misspelled_name_uses_fuzzy_match(self, pv):
+        assert pv.corregir_ubicacion("05", "Medelin") == ("05", "05001")
+        assert pv.corregir_ubicacion("05", "Envigado") == ("05", "05266")
+
+    def test_valid_pair_needs_no_fix(self, pv):
+        assert pv.corregir_ubicacion("05", "05001") is None
+
+    def test_unknown_name_is_not_guessed(self, pv):
+        assert pv.corregir_ubicacion("", "Xyzzy") is None